@@ -0,0 +1,190 @@
+"""
+Script to benchmark the application routes end-to-end. The Flask application is driven with the test client on the
+store that is selected in the configuration. The store can be seeded with synthetic seasons first (see
+generate_seasons).
+For every route the latency percentiles (p50, p95, p99), the number of store statements per request (from the query
+log) and the peak memory per request are measured. Latency is measured without memory tracing, peak memory in a separate pass.
+The results are written as JSON, so runs can be compared before and after an optimization.
+
+Example: seed a sqlite store at 10 times the current size, then benchmark:
+    python -m Tools.benchmark_routes --config testing --generate 10 --out c:\\temp\\bench_10.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import platform
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from competition import create_app, models_graph as mg
+from competition.main import routes
+from lib import my_env
+from Tools import generate_seasons
+
+bench_user = "benchmark"
+bench_pwd = "benchmark"
+
+
+def percentile(values, pct):
+    """
+    This function returns the percentile of the values, nearest rank method.
+    @param values: Sorted list of values
+    @param pct: Percentile (0 - 100)
+    @return: Value at the percentile
+    """
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def positive_int(value):
+    """
+    This function is the argparse type for a number of requests. At least one request is required to have latencies.
+    @param value: Argument value
+    @return: Value as integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("{v} is not an integer".format(v=value))
+    if number < 1:
+        raise argparse.ArgumentTypeError("{v} must be 1 or more".format(v=value))
+    return number
+
+
+def select_race():
+    """
+    This function selects the Hoofdwedstrijd with most participants. This is the race for the participant routes.
+    @return: nid of the race
+    """
+    racetype = mg.get_race_type_node("Hoofdwedstrijd")
+    race_nids = mg.ns.get_start_nodes(end_node_id=racetype["nid"], rel_type="type")
+    return max(race_nids, key=lambda nid: len(mg.ns.get_start_nodes(end_node_id=nid, rel_type="participates")))
+
+
+def get_routes(race_id):
+    """
+    This function returns the routes to benchmark. A route is a name, a method, the url and the form data, with an
+    optional request before and after every measured request. The add participant POST is undone by a remove, and the
+    remove participant POST is prepared by an add, so the dataset does not change over the run.
+    @param race_id: nid of the race for the participant routes
+    @return: list of route dictionaries
+    """
+    pers_id = mg.next_participant(race_id)[0][0]
+    prev_id = mg.participant_last_id(race_id)
+    add = ("post", "/participant/{r}/add".format(r=race_id), dict(name=pers_id, prev_runner=prev_id, pos="", remark=""))
+    remove = ("post", "/participant/remove/{r}/{p}".format(r=race_id, p=pers_id), None)
+    routes = [
+        ("overview_dames", ("get", "/overview/Dames", None), None, None),
+        ("overview_heren", ("get", "/overview/Heren", None), None, None),
+        ("result_dames", ("get", "/result/Dames", None), None, None),
+        ("result_heren", ("get", "/result/Heren", None), None, None),
+        ("participant_add_form", ("get", "/participant/{r}/add".format(r=race_id), None), None, None),
+        ("person_list", ("get", "/person/list", None), None, None),
+        ("organization_list", ("get", "/organization/list", None), None, None),
+        ("participant_add", add, None, remove),
+        ("participant_remove", remove, add, None)
+    ]
+    return [dict(name=name, req=req, before=before, after=after) for (name, req, before, after) in routes]
+
+
+def request(client, method, url, data):
+    r = getattr(client, method)(url, data=data)
+    if r.status_code not in [200, 302]:
+        logging.error("{m} {url} returns {s}".format(m=method.upper(), url=url, s=r.status_code))
+    return r
+
+
+def bench_route(client, route, iterations, warmup):
+    """
+    This function will benchmark a single route.
+    @param client: Flask test client, logged in.
+    @param route: Route dictionary from get_routes
+    @param iterations: Number of measured requests
+    @param warmup: Number of requests before measurement
+    @return: Dictionary with the measurements for the route
+    """
+    (method, url, data) = route["req"]
+    latencies = []
+    statements = Counter()
+    peak = 0
+    for cnt in range(warmup + iterations + 1):
+        if route["before"]:
+            request(client, *route["before"])
+        # Last request is for memory tracing
+        traced = (cnt == warmup + iterations)
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        request(client, method, url, data)
+        elapsed = time.perf_counter() - start
+        if traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif cnt >= warmup:
+            latencies.append(elapsed * 1000)
+            statements.update(routes.recent_queries[-1]["statements"])
+        if route["after"]:
+            request(client, *route["after"])
+    latencies.sort()
+    return dict(
+        method=method.upper(),
+        url=url,
+        requests=iterations,
+        p50_ms=round(percentile(latencies, 50), 2),
+        p95_ms=round(percentile(latencies, 95), 2),
+        p99_ms=round(percentile(latencies, 99), 2),
+        mean_ms=round(sum(latencies) / iterations, 2),
+        statements=sum(statements.values()) / iterations,
+        statements_by_name={key: value / iterations for (key, value) in sorted(statements.items())},
+        peak_kb=round(peak / 1024, 1)
+    )
+
+
+def dataset_size():
+    return {label: len(mg.ns.get_nodes(label)) for label in ["Person", "Organization", "Race", "Participant"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the application routes.")
+    parser.add_argument("--config", default="testing", help="Configuration name for create_app")
+    parser.add_argument("--generate", type=int, default=0, help="Seed the store with generated seasons at this scale")
+    parser.add_argument("--seasons", type=int, default=1, help="Number of seasons to generate")
+    parser.add_argument("--iterations", type=positive_int, default=50, help="Number of measured requests per route")
+    parser.add_argument("--warmup", type=int, default=3, help="Number of requests per route before measurement")
+    parser.add_argument("--routes", nargs="*", help="Names of the routes to benchmark, default all")
+    parser.add_argument("--out", default="benchmark.json", help="JSON file for the results")
+    args = parser.parse_args()
+    app = create_app(args.config)
+    app.config['QUERY_LOG'] = True
+    my_env.init_loghandler(__file__, app.config.get('LOGDIR'), "warning")
+    app_ctx = app.app_context()
+    app_ctx.push()
+    if args.generate:
+        generate_seasons.generate(mg.ns, args.seasons, 2017, generate_seasons.persons_per_season * args.generate,
+                                  generate_seasons.orgs_per_season * args.generate, generate_seasons.races_per_org,
+                                  2017)
+    mg.User().register(bench_user, bench_pwd)
+    client = app.test_client(use_cookies=True)
+    client.post('/login', data={'username': bench_user, 'password': bench_pwd})
+    results = {}
+    for route in get_routes(select_race()):
+        if args.routes and route["name"] not in args.routes:
+            continue
+        results[route["name"]] = bench_route(client, route, args.iterations, args.warmup)
+        logging.warning("{name}: p50 {p50_ms} ms, p95 {p95_ms} ms, p99 {p99_ms} ms, {statements} statements, "
+                        "peak {peak_kb} kB".format(name=route["name"], **results[route["name"]]))
+    report = dict(
+        timestamp=datetime.now().replace(microsecond=0).isoformat(),
+        host=platform.node(),
+        config=args.config,
+        store=type(mg.ns).__name__,
+        dataset=dataset_size(),
+        iterations=args.iterations,
+        routes=results
+    )
+    with open(args.out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    app_ctx.pop()
@@ -0,0 +1,27 @@
+"""
+Script to remove all date nodes (Day, Month, Year) that are not used anymore. The application removes the date of an
+organization when it is deleted or moved to another date, this script is the periodic full sweep to clean up dates
+that have been left behind.
+"""
+
+import logging
+from competition import neostore
+from lib import my_env
+
+
+def clear_dates(ns):
+    """
+    This function will remove the Day, Month and Year nodes that are not used anymore.
+    @param ns: Store object
+    @return: Dictionary with the label as key and the number of nodes removed as value.
+    """
+    cnt = {}
+    for label in ["Day", "Month", "Year"]:
+        cnt[label] = ns.clear_date_node(label)
+        logging.info("{cnt} {label} nodes removed".format(cnt=cnt[label], label=label))
+    return cnt
+
+
+if __name__ == "__main__":
+    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
+    clear_dates(neostore.NeoStore())
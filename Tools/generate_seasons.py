@@ -0,0 +1,187 @@
+"""
+Script to generate synthetic seasons for scale testing. It creates persons with a category (Dames, Heren), then for
+every season a number of organizations with races, and for every race a finisher chain of participants. The points
+are calculated for every organization, so overview and standings are available as for real data.
+The data is loaded through the store, one transaction per organization. Use the sqlite store to generate a dataset
+that can be used with STORE = "sqlite" or loaded in Neo4J with sql2neo.
+
+Example: generate 10 times the current size in a sqlite file:
+    python -m Tools.generate_seasons --scale 10 --store sqlite --file c:\\temp\\seasons_10.sqlite3
+"""
+
+import argparse
+import logging
+import random
+from datetime import date, timedelta
+from competition import models_graph as mg
+from competition import neostore
+from lib import my_env
+
+# Current size of a season: number of persons, organizations per season and races per organization.
+persons_per_season = 250
+orgs_per_season = 25
+races_per_org = 3
+
+cities = ["Lier", "Boechout", "Kessel", "Nijlen", "Duffel", "Mechelen", "Ranst", "Broechem", "Emblem", "Koningshooikt"]
+distances = ["10 km", "5 km", "15 km", "21 km", "3 km"]
+
+
+def get_store(store, dbfile):
+    """
+    This function will return the store to load the generated data in.
+    @param store: neo4j or sqlite
+    @param dbfile: Database file for the sqlite store.
+    @return: Store object
+    """
+    if store == "sqlite":
+        from competition.sqlstore import SqlStore
+        return SqlStore(dbfile)
+    else:
+        return neostore.NeoStore()
+
+
+def init_nodes(ns):
+    """
+    This function will create the nodes that are required for the application, if they do not exist already.
+    @param ns: Store object
+    @return:
+    """
+    required = [("MF", dict(name="Dames")), ("MF", dict(name="Heren")),
+                ("RaceType", dict(name="Hoofdwedstrijd", weight=10)),
+                ("RaceType", dict(name="Bijwedstrijd", weight=20)),
+                ("RaceType", dict(name="Deelname", weight=100)),
+                ("OrgType", dict(name="Wedstrijd")), ("OrgType", dict(name="Deelname"))]
+    for (label, props) in required:
+        if not ns.get_nodes(label, name=props["name"]):
+            ns.create_node(label, **props)
+    return
+
+
+def add_persons(ns, rnd, nr_persons):
+    """
+    This function will create the persons, with a birth date and a link to the category.
+    @param ns: Store object
+    @param rnd: Random generator
+    @param nr_persons: Number of persons to create
+    @return: list of person nodes.
+    """
+    mf_nodes = [ns.get_node("MF", name="Dames"), ns.get_node("MF", name="Heren")]
+    persons = []
+    with ns.transaction():
+        for cnt in range(nr_persons):
+            born = date(rnd.randint(1950, 2005), rnd.randint(1, 12), rnd.randint(1, 28))
+            person = ns.create_node("Person", name="Loper {cnt:06d}".format(cnt=cnt), born=born.strftime("%Y-%m-%d"))
+            # About 40% of the runners are in category Dames.
+            ns.create_relation(from_node=person, rel="mf", to_node=mf_nodes[rnd.random() >= 0.4])
+            persons.append(person)
+    return persons
+
+
+def add_organization(ns, rnd, persons, name, ds, org_type, nr_races):
+    """
+    This function will create an organization with its races and the finisher chain for every race. A person
+    participates in one race of the organization at most.
+    @param ns: Store object
+    @param rnd: Random generator
+    @param persons: List of person nodes.
+    @param name: Name of the organization
+    @param ds: Date of the organization
+    @param org_type: Wedstrijd or Deelname
+    @param nr_races: Number of races for the organization
+    @return: list of race nids.
+    """
+    # Calendar nodes are created outside of the transaction.
+    date_node = ns.date_node(ds)
+    loc_node = ns.get_node("Location", city=rnd.choice(cities))
+    if org_type == "Wedstrijd":
+        racetypes = ["Hoofdwedstrijd"] + ["Bijwedstrijd"] * (nr_races - 1)
+    else:
+        racetypes = ["Deelname"] * nr_races
+    # Runners of the organization, the main race has most of the runners.
+    runners = rnd.sample(persons, rnd.randint(len(persons) // 10, len(persons) // 3))
+    race_nids = []
+    with ns.transaction():
+        org_node = ns.create_node("Organization", name=name)
+        ns.create_relation(from_node=org_node, rel="In", to_node=loc_node)
+        ns.create_relation(from_node=org_node, rel="On", to_node=date_node)
+        ns.create_relation(from_node=org_node, rel="type", to_node=ns.get_node("OrgType", name=org_type))
+        for (cnt, racetype) in enumerate(racetypes):
+            race_node = ns.create_node("Race", name=distances[cnt % len(distances)])
+            ns.create_relation(from_node=org_node, rel="has", to_node=race_node)
+            ns.create_relation(from_node=race_node, rel="type", to_node=ns.get_node("RaceType", name=racetype))
+            race_nids.append(race_node["nid"])
+            if cnt == len(racetypes) - 1:
+                finishers = runners
+            else:
+                finishers = runners[:int(len(runners) * rnd.uniform(0.5, 0.8))]
+            runners = runners[len(finishers):]
+            # Other runners finish in between, so the position has gaps.
+            pos = 0
+            prev_part = None
+            for (seq, person) in enumerate(finishers):
+                pos += rnd.randint(1, 5)
+                part = ns.create_node("Participant", pos=pos, rank=(seq + 1) * neostore.rank_gap)
+                ns.create_relation(from_node=person, rel="is", to_node=part)
+                ns.create_relation(from_node=part, rel="participates", to_node=race_node)
+                if prev_part:
+                    ns.create_relation(from_node=part, rel="after", to_node=prev_part)
+                prev_part = part
+    return race_nids
+
+
+def generate(ns, seasons, first_year, nr_persons, nr_orgs, nr_races, seed):
+    """
+    This function will generate the seasons in the store.
+    @param ns: Store object
+    @param seasons: Number of seasons
+    @param first_year: Year of the first season
+    @param nr_persons: Number of persons
+    @param nr_orgs: Number of organizations per season
+    @param nr_races: Number of races per organization
+    @param seed: Seed for the random generator, the same seed generates the same dataset.
+    @return:
+    """
+    rnd = random.Random(seed)
+    mg.ns = ns
+    init_nodes(ns)
+    for city in cities:
+        if not ns.get_nodes("Location", city=city):
+            ns.create_node("Location", city=city)
+    persons = add_persons(ns, rnd, nr_persons)
+    logging.info("{cnt} persons created".format(cnt=nr_persons))
+    li = my_env.LoopInfo("Organizations", 20)
+    for year in range(first_year, first_year + seasons):
+        for cnt in range(nr_orgs):
+            ds = date(year, 1, 1) + timedelta(days=rnd.randint(0, 364))
+            # One organization out of five is a 'Deelname'.
+            org_type = "Deelname" if rnd.random() < 0.2 else "Wedstrijd"
+            name = "Organisatie {year}-{cnt:04d}".format(year=year, cnt=cnt)
+            race_nids = add_organization(ns, rnd, persons, name, ds, org_type, rnd.randint(1, nr_races))
+            # Points for a Wedstrijd are calculated for all races of the organization at once.
+            if org_type == "Wedstrijd":
+                race_nids = race_nids[:1]
+            for race_nid in race_nids:
+                mg.points_for_race(race_nid)
+            li.info_loop()
+    li.end_loop()
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic seasons for scale testing.")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier for persons and organizations per season")
+    parser.add_argument("--seasons", type=int, default=1, help="Number of seasons")
+    parser.add_argument("--first-year", type=int, default=2017, help="Year of the first season")
+    parser.add_argument("--persons", type=int, default=persons_per_season, help="Number of persons")
+    parser.add_argument("--orgs", type=int, default=orgs_per_season, help="Organizations per season")
+    parser.add_argument("--races", type=int, default=races_per_org, help="Maximum number of races per organization")
+    parser.add_argument("--seed", type=int, default=2017, help="Seed for the random generator")
+    parser.add_argument("--store", choices=["neo4j", "sqlite"], default="neo4j", help="Store to load the data in")
+    parser.add_argument("--file", help="Database file for the sqlite store")
+    args = parser.parse_args()
+    if args.store == "sqlite" and not args.file:
+        parser.error("--file is required for the sqlite store")
+    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
+    store = get_store(args.store, args.file)
+    generate(store, args.seasons, args.first_year, args.persons * args.scale, args.orgs * args.scale, args.races,
+             args.seed)
@@ -0,0 +1,33 @@
+"""
+Script to import the finish list of a race from a csv file. The file has a line for every finisher in sequence of
+arrival, with columns person (nid or name), pos and remark. The finishers are added after the participants that are
+in the race already, points are calculated once at the end. If there are errors in the file, then no participant is
+added.
+
+Usage: python -m Tools.import_finishers <race nid> <csv file>
+"""
+
+import argparse
+import logging
+import sys
+from competition import models_graph as mg
+from lib import my_env
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import the finish list of a race.")
+    parser.add_argument("race_id", help="nid of the race")
+    parser.add_argument("csvfile", help="csv file with the finishers in sequence of arrival")
+    args = parser.parse_args()
+    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
+    with open(args.csvfile, "rb") as fh:
+        data = fh.read()
+    try:
+        lines = mg.decode_csv(data).splitlines()
+    except UnicodeDecodeError as err:
+        logging.error("{f} is not utf-8 or cp1252: {err}".format(f=args.csvfile, err=err))
+        sys.exit(1)
+    rows = mg.finishers_from_csv(lines)
+    (cnt, errors) = mg.participants_import(args.race_id, rows)
+    for error in errors:
+        logging.error(error)
+    logging.info("{cnt} participants added to race {nid}".format(cnt=cnt, nid=args.race_id))
@@ -3,48 +3,80 @@ This script will dump a Neo4J database to an sqlite database. The sqlite databas
 components and every attribute for each component. The relations table shows all relations.
 This script can be used as a backup-tool or to get a snapshot during tests.
 In this script the nid is used as a unique reference.
+Nodes are read in pages with their outgoing relations and written with executemany in a single sqlite transaction, so
+memory use does not grow with the database. The columns for all property keys are created before the transaction. The dump is written to a temporary file that replaces the dumpfile at
+the end, so an existing dump is never left half-way.
 """
 
-from competition import neostore
+import logging
+import os
+from competition import cypher, neostore
 from lib import my_env, datastore
 
-if __name__ == "__main__":
-    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
-    ns = neostore.NeoStore()
-    dumpfile = "C:\\Development\\python\\FlaskRun\\neo_dump.sqlite3"
-    ds = datastore.DataStore(dumpfile)
-    ds.remove_tables()
+# Number of nodes per page.
+batch = 1000
+
+
+def dump(ns, dumpfile):
+    """
+    This function will dump the store to the sqlite database.
+    @param ns: Store object
+    @param dumpfile: Full path to the sqlite database.
+    @return: Number of nodes and number of relations in the dump.
+    """
+    # Every node needs a nid, since this is the reference in the dump.
+    ns.get_nodes_no_nid()
+    tmpfile = dumpfile + ".tmp"
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+    ds = datastore.DataStore(tmpfile)
+    ds.set_wal()
     ds.create_tables()
-    # First handle all nodes
-    nodes = ns.get_nodes()
-    all_attribs = []
-    all_labels = []
-    node_cnt = len(nodes)
-    for node in nodes:
-        # First get all attributes to create a component record.
-        rec = {}
-        for key in node.keys():
-            rec[key] = node[key]
-            if key not in all_attribs:
-                all_attribs.append(key)
-        # Load record in components table
-        # Remove field "id" first, since this is not required.
-        ds.insert_row("components", rec)
-        # Then get all labels, add label and nid to labels table
-        rec = {"nid": node["nid"]}
-        labels = node.labels()
-        for label in labels:
-            rec["label"] = label
-            if label not in all_labels:
-                all_labels.append(label)
-            # Load label record
-            ds.insert_row("labels", rec)
-    # Then handle all relations
-    rec = {}
-    fields = ["from_nid", "rel", "to_nid"]
-    res = ns.get_relations()
-    for line in res:
-        for field in fields:
-            rec[field] = line[field]
-        ds.insert_row("relations", rec)
+    for key in ns.property_keys():
+        ds.add_column("components", key)
+    columns = ds.get_key_list("components")
+    components, labels, relations = [], [], []
+    node_cnt, rel_cnt = 0, 0
+    li = my_env.LoopInfo("Nodes", 10000)
+    for (node, rels) in ns.stream_nodes(batch):
+        props = dict(node)
+        new_columns = [key for key in props if key not in columns]
+        if new_columns:
+            # Property that is set after the keys were read. Rows in the buffer have the current columns, write them
+            # before the table changes.
+            ds.insert_rows("components", columns, components)
+            components = []
+            for key in new_columns:
+                ds.add_column("components", key)
+                columns.append(key)
+        components.append(tuple(props.get(key) for key in columns))
+        # The Node label is on every node, it is set again on restore.
+        labels.extend((label, props["nid"]) for label in node.labels() if label != cypher.node_label)
+        relations.extend((rel_type, props["nid"], to_nid) for (rel_type, to_nid) in rels)
+        node_cnt += 1
+        rel_cnt += len(rels)
+        if len(components) >= batch:
+            ds.insert_rows("components", columns, components)
+            ds.insert_rows("labels", ["label", "nid"], labels)
+            ds.insert_rows("relations", ["rel", "from_nid", "to_nid"], relations)
+            components, labels, relations = [], [], []
+        li.info_loop()
+    ds.insert_rows("components", columns, components)
+    ds.insert_rows("labels", ["label", "nid"], labels)
+    ds.insert_rows("relations", ["rel", "from_nid", "to_nid"], relations)
+    ds.commit()
+    # A database in WAL mode has -wal and -shm files next to it, these are not renamed with the dumpfile.
+    ds.reset_wal()
     ds.close_connection()
+    li.end_loop()
+    os.replace(tmpfile, dumpfile)
+    total = ns.node_count()
+    if total != node_cnt:
+        logging.error("{cnt} nodes in the dump, {total} nodes in the database".format(cnt=node_cnt, total=total))
+    logging.info("{n} nodes and {r} relations dumped to {f}".format(n=node_cnt, r=rel_cnt, f=dumpfile))
+    return node_cnt, rel_cnt
+
+
+if __name__ == "__main__":
+    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
+    dump(neostore.NeoStore(), "C:\\Development\\python\\FlaskRun\\neo_dump.sqlite3")
@@ -0,0 +1,30 @@
+"""
+Script to set the rank property on the participants of all races. The rank is taken from the after chain. Races are
+ranked on first read as well, this script does it for all races at once.
+"""
+
+import logging
+from competition import neostore
+from lib import my_env
+
+
+def rank_races(ns):
+    """
+    This function will set the rank on the participants of every race from the after chain.
+    @param ns: Store object
+    @return: Number of participants that have been ranked.
+    """
+    total = 0
+    li = my_env.LoopInfo("Races", 20)
+    for race in ns.get_nodes("Race"):
+        cnt = ns.rank_participants(race["nid"])
+        logging.info("{cnt} participants ranked for race {nid}".format(cnt=cnt, nid=race["nid"]))
+        total += cnt
+        li.info_loop()
+    li.end_loop()
+    return total
+
+
+if __name__ == "__main__":
+    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
+    rank_races(neostore.NeoStore())
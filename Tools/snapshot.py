@@ -0,0 +1,26 @@
+"""
+Script to export the store to a snapshot file, or to replace the content of the store with a snapshot. A snapshot is a
+gzip compressed file with a JSON document on every line, see NeoStore.export_snapshot. Export and import read the
+store and the snapshot in pages, so this can be done for a database of many seasons.
+
+Usage:
+    python -m Tools.snapshot export c:\\temp\\stratenloop17.jsonl.gz
+    python -m Tools.snapshot import c:\\temp\\stratenloop17.jsonl.gz
+"""
+
+import argparse
+from competition import neostore
+from lib import my_env
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the store.")
+    parser.add_argument("action", choices=["export", "import"], help="Export the store or import the snapshot")
+    parser.add_argument("snapshot", help="Snapshot file")
+    parser.add_argument("--batch", type=int, default=1000, help="Number of nodes or relations per statement")
+    args = parser.parse_args()
+    my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
+    ns = neostore.NeoStore()
+    if args.action == "export":
+        ns.export_snapshot(args.snapshot, args.batch)
+    else:
+        ns.import_snapshot(args.snapshot, args.batch)
@@ -3,41 +3,114 @@ This script will restore a Neo4J database from a sqlite database. The sqlite dat
 components and every attribute for each component. The relations table shows all relations.
 This script can be used as a backup-tool or to get a snapshot during tests.
 In this script the nid is used as a unique reference.
+Components are read with their label in one query and merged in batches per label, relations are merged in batches per
+relation type, with the nodes found on the nid constraint of the Node label. After every batch the number of rows done is
+written to a checkpoint file next to the dump. If the restore is interrupted, then the next run continues after the
+last batch in the checkpoint. The store is cleared only on a run without checkpoint.
+
+Usage: python -m Tools.sql2neo <dumpfile> [--batch 1000] [--restart]
 """
 
+import argparse
+import json
+import logging
+import os
 from competition import neostore
 from lib import my_env, datastore
 
+# Number of rows per statement.
+batch = 1000
+
+
+def read_checkpoint(checkpoint_file):
+    """
+    This function will read the checkpoint of a previous run.
+    @param checkpoint_file: Full path to the checkpoint file.
+    @return: Dictionary with the number of nodes and relations that are done.
+    """
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as fh:
+            return json.load(fh)
+    return dict(nodes=0, relations=0)
+
+
+def write_checkpoint(checkpoint_file, checkpoint):
+    # The checkpoint is replaced at once, an interruption never leaves half a checkpoint file.
+    with open(checkpoint_file + ".tmp", "w") as fh:
+        json.dump(checkpoint, fh)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+    return
+
+
+def batches(rows, key, size):
+    """
+    This function will group the rows in batches with the same key and at most size rows.
+    @param rows: Iterator on the rows, sorted on key.
+    @param key: Function that returns the key for a row.
+    @param size: Maximum number of rows in a batch.
+    @return: generator of tuples (key, list of rows)
+    """
+    curr_key, rows_batch = None, []
+    for row in rows:
+        row_key = key(row)
+        if rows_batch and (row_key != curr_key or len(rows_batch) >= size):
+            yield curr_key, rows_batch
+            rows_batch = []
+        curr_key = row_key
+        rows_batch.append(row)
+    if rows_batch:
+        yield curr_key, rows_batch
+
+
+def restore(ns, dumpfile, size=batch):
+    """
+    This function will restore the dump in the store, or continue a restore from the checkpoint.
+    @param ns: Store object
+    @param dumpfile: Full path to the sqlite database.
+    @param size: Number of rows per statement.
+    @return: Number of nodes and number of relations in the store from the dump.
+    """
+    checkpoint_file = dumpfile + ".checkpoint"
+    checkpoint = read_checkpoint(checkpoint_file)
+    ds = datastore.DataStore(dumpfile)
+    ds.create_indexes()
+    if checkpoint["nodes"] == 0 and checkpoint["relations"] == 0:
+        ns.clear_store()
+    else:
+        logging.info("Continue restore after {nodes} nodes and {relations} relations".format(**checkpoint))
+    ns.init_graph()
+    li = my_env.LoopInfo("Node batches", 10)
+    rows = ds.get_labeled_components(checkpoint["nodes"])
+    for (label, rows_batch) in batches(rows, lambda row: row["node_label"], size):
+        props = [dict((key.lower(), row[key]) for key in row.keys() if key != "node_label" and row[key] is not None)
+                 for row in rows_batch]
+        ns.restore_nodes(label, props)
+        checkpoint["nodes"] += len(rows_batch)
+        write_checkpoint(checkpoint_file, checkpoint)
+        li.info_loop()
+    li.end_loop()
+    li = my_env.LoopInfo("Relation batches", 10)
+    rows = ds.get_sorted_relations(checkpoint["relations"])
+    for (rel_type, rows_batch) in batches(rows, lambda row: row["rel"], size):
+        rels = [dict(from_nid=row["from_nid"], to_nid=row["to_nid"]) for row in rows_batch]
+        ns.restore_relations(rel_type, rels)
+        checkpoint["relations"] += len(rows_batch)
+        write_checkpoint(checkpoint_file, checkpoint)
+        li.info_loop()
+    li.end_loop()
+    ds.close_connection()
+    os.remove(checkpoint_file)
+    logging.info("{nodes} nodes and {relations} relations restored from {f}".format(f=dumpfile, **checkpoint))
+    return checkpoint["nodes"], checkpoint["relations"]
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore a Neo4J database from a sqlite dump.")
+    parser.add_argument("dumpfile", help="sqlite dump from neo2sql")
+    parser.add_argument("--batch", type=int, default=batch, help="Number of rows per statement")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and restore from the start")
+    args = parser.parse_args()
     my_env.init_loghandler(__file__, "c:\\temp\\log", "info")
-    ns = neostore.NeoStore()
-    dumpfile = "C:\\Development\\python\\FlaskRun\\stratenloop15.sqlite3"
-    ds = datastore.DataStore(dumpfile)
-    ns.clear_store()
-    # First handle all nodes
-    # Get all Component rows
-    rows = ds.get_records("components")
-    key_list = ds.get_key_list("components")
-    node_obj = {}
-    node_info = my_env.LoopInfo("Nodes", 10)
-    for row in rows:
-        # Get node label
-        node_label = ds.get_label(row["nid"])
-        valuedict = {}
-        for attrib in key_list:
-            if row[attrib]:
-                valuedict[attrib.lower()] = row[attrib]
-        component = ns.create_node_no_nid(node_label, **valuedict)
-        # Remember component for Relation in next step
-        node_obj[row["nid"]] = component
-        node_info.info_loop()
-    node_info.end_loop()
-
-    # Handle relations
-    rows = ds.get_records("relations")
-    rel_info = my_env.LoopInfo("Relations", 10)
-    for row in rows:
-        ns.create_relation(node_obj[row["from_nid"]], row["rel"], node_obj[row["to_nid"]])
-        rel_info.info_loop()
-    rel_info.end_loop()
-    # logging.info('End Application')
+    if args.restart and os.path.exists(args.dumpfile + ".checkpoint"):
+        os.remove(args.dumpfile + ".checkpoint")
+    restore(neostore.NeoStore(), args.dumpfile, args.batch)
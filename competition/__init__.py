@@ -42,6 +42,19 @@ def create_app(config_name):
     # import blueprints
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
+
+    # Configure the store. This is Neo4J, unless the in-memory store (STORE = "memory") or the sqlite store
+    # (STORE = "sqlite") is selected in the configuration. The connection to Neo4J will be made on first use.
+    from . import models_graph, neostore
+    if app.config.get('STORE') == "memory":
+        from .memstore import MemStore
+        models_graph.ns = MemStore()
+    elif app.config.get('STORE') == "sqlite":
+        from .sqlstore import SqlStore
+        models_graph.ns = SqlStore()
+    elif type(models_graph.ns) is not neostore.NeoStore:
+        models_graph.ns = neostore.NeoStore()
+    models_graph.ns.init_app(app)
     # configure production logging of errors
     """
     try:
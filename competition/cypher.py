@@ -0,0 +1,381 @@
+"""
+This module consolidates the Cypher statements that are used by the neostore. Every statement is a constant text with
+$param bindings, so the text of a statement is the same on every call and Neo4J can re-use the cached query plan.
+The statements are run by name through method NeoStore.run. This also gives the full set of queries in one place, for
+review and tuning.
+Note that labels and relation types cannot be parameters in Cypher. Where the label is variable, there is a statement
+per label.
+Every node with a nid has the label Node as well, with a unique constraint on nid. Statements that find a node on nid
+without knowing its label use this label, so that Neo4J finds the node on the index instead of a scan of all nodes.
+"""
+
+# Label on all nodes with a nid.
+node_label = "Node"
+
+statements = dict(
+
+    cat4part="""
+        MATCH (n:Participant {nid: $part_nid})<-[:is]-()-[:mf]->(c:MF)
+        RETURN c.name as name
+    """,
+
+    # A person without category is returned with category null, so that the participant gets points too.
+    cat4race="""
+        MATCH (race:Race {nid: $race_id})<-[:participates]-(part:Participant)<-[:is]-(pers:Person)
+        OPTIONAL MATCH (pers)-[:mf]->(c:MF)
+        RETURN part.nid as nid, c.name as cat, pers.nid as pers_nid, pers.name as name
+    """,
+
+    # Date nodes - remove the date node if it only has the relation to the calendar tree left.
+    clear_day="""
+        MATCH (n:Day)-[rel]-()
+        WITH n, count(rel) as rel_cnt
+        WHERE rel_cnt=1
+        DETACH DELETE n
+        RETURN count(n) AS cnt
+    """,
+    clear_month="""
+        MATCH (n:Month)-[rel]-()
+        WITH n, count(rel) as rel_cnt
+        WHERE rel_cnt=1
+        DETACH DELETE n
+        RETURN count(n) AS cnt
+    """,
+    clear_year="""
+        MATCH (n:Year)-[rel]-()
+        WITH n, count(rel) as rel_cnt
+        WHERE rel_cnt=1
+        DETACH DELETE n
+        RETURN count(n) AS cnt
+    """,
+
+    clear_store="""
+        MATCH (n) DETACH DELETE n
+    """,
+
+    # Id of the last committed transaction, this changes on every commit from any process.
+    last_tx_id="""
+        CALL dbms.queryJmx("org.neo4j:instance=kernel#0,name=Transactions") YIELD attributes
+        RETURN attributes.LastCommittedTxId.value AS tx_id
+    """,
+
+    main_race="""
+        MATCH (n:Race {nid: $race_nid})<-[:has]-(:Organization)-[:has]->(r:Race),
+              (r)-[:type]->(t:RaceType {name:'Hoofdwedstrijd'})
+        RETURN r.nid as nid
+    """,
+
+    # Persons that do not yet participate in any race of the organization of the race.
+    next_participant="""
+        MATCH (race:Race {nid: $race_id})<-[:has]-(org:Organization)
+        MATCH (person:Person)
+        WHERE NOT (person)-[:is]->(:Participant)-[:participates]->(:Race)<-[:has]-(org)
+        RETURN person.nid as nid, person.name as name
+        ORDER BY name ASC
+    """,
+
+    create_after_chain="""
+        UNWIND $rows AS row
+        MATCH (next:Participant {nid: row.next_nid}), (prev:Participant {nid: row.prev_nid})
+        CREATE (next)-[:after]->(prev)
+    """,
+
+    create_participants="""
+        MATCH (race:Race {nid: $race_id})
+        UNWIND $rows AS row
+        MATCH (person:Person {nid: row.pers_nid})
+        CREATE (person)-[:is]->(part:Participant:Node)-[:participates]->(race)
+        SET part = row.props
+        RETURN count(part) AS cnt
+    """,
+
+    day_node="""
+        MATCH (day:Day {key: $key}) RETURN day LIMIT 1
+    """,
+
+    node_count="""
+        MATCH (n) RETURN count(n) AS cnt
+    """,
+
+    node="""
+        MATCH (n:Node {nid: $nid}) RETURN n LIMIT 1
+    """,
+
+    node_relations="""
+        MATCH (n:Node {nid: $nid})--(m) RETURN m.nid as m_nid
+    """,
+
+    nr_participants="""
+        MATCH (n:Race {nid: $race_nid})<-[:participates]-(:Participant)<-[:is]-(p:Person),
+              (p)-[:mf]->(c:MF {name: $cat})
+        RETURN count(p) as cnt
+    """,
+
+    organization="""
+        MATCH (day:Day {key: $datestamp})<-[:On]-(org:Organization {name: $name}),
+              (org)-[:In]->(loc:Location {city: $location})
+        RETURN org
+    """,
+
+    organization_from_id="""
+        MATCH (date:Day)<-[:On]-(org:Organization {nid: $org_id})-[:In]->(loc:Location)
+        RETURN date.day as day, date.month as month, date.year as year, date.key as date,
+               org.name as org, loc.city as city
+    """,
+
+    organization_list="""
+        MATCH (day:Day)<-[:On]-(org:Organization)-[:In]->(loc:Location),
+              (org)-[:type]->(ot:OrgType)
+        RETURN day.key as date, org.name as organization, loc.city as city, org.nid as id, ot.name as type
+        ORDER BY day.key ASC
+    """,
+
+    orphan_locations="""
+        MATCH (loc:Location) WHERE NOT (loc)--() RETURN loc.nid as loc_nid, loc.city as city
+    """,
+
+    overview="""
+        MATCH (c:MF {name: $cat})<-[:mf]-(person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race),
+              (race)<-[:has]-(org:Organization)
+        RETURN person.nid as pers_nid, org.nid as org_nid, race.name as race, part.pos as pos, part.points as points
+    """,
+
+    participant_in_race="""
+        MATCH (pers:Person {nid: $pers_id})-[:is]->(part:Participant)-[:participates]->(race:Race {nid: $race_id})
+        RETURN part
+    """,
+
+    # Arrival order from the after chain. Used only to set the rank on participants in races from before the rank.
+    participant_chain="""
+        MATCH race_ptn = (race:Race {nid: $race_id})<-[:participates]-(participant),
+              participants = (participant)<-[:after*0..]-()
+        WITH COLLECT(participants) AS results, MAX(length(participants)) AS maxLength
+        WITH [result IN results WHERE length(result) = maxLength] AS result_coll
+        UNWIND result_coll as result
+        RETURN nodes(result)
+    """,
+
+    participant_ranks="""
+        MATCH (race:Race {nid: $race_id})<-[:participates]-(part:Participant)
+        RETURN part.nid as nid, part.rank as rank
+        ORDER BY rank ASC
+    """,
+
+    participant_seq_list="""
+        MATCH (race:Race {nid: $race_id})<-[:participates]-(part:Participant)
+        RETURN part
+        ORDER BY part.rank ASC
+    """,
+
+    persons_nr_races="""
+        MATCH (person:Person)
+        OPTIONAL MATCH (person)-[:is]->(part:Participant)-[:participates]->(:Race)
+        RETURN person.nid as nid, person.name as name, count(part) as nr_races
+        ORDER BY nr_races DESC, name ASC
+    """,
+
+    ping="""
+        RETURN 1
+    """,
+
+    points_per_category="""
+        MATCH (c:MF {name: $cat})<-[:mf]-(n:Person)-[:is]->(p:Participant)
+        RETURN n.name as name, n.nid as nid, p.nid as part_nid, p.points as points
+    """,
+
+    # Property keys from the token store, so no scan of the nodes.
+    property_keys="""
+        CALL db.propertyKeys() YIELD propertyKey
+        RETURN propertyKey as key
+    """,
+
+    race_in_org="""
+        MATCH (org:Organization {nid: $org_id})-->(race:Race {name: $name})-->(racetype:RaceType {nid: $racetype_id})
+        RETURN race.nid as race_nid, org.name as org_name
+    """,
+
+    race_label="""
+        MATCH (race:Race {nid: $race_id})<-[:has]-(org)-[:On]->(date),
+              (org)-[:In]->(loc),
+              (type:RaceType)<-[:type]-(race)
+        RETURN race.name as race, org.name as org, loc.city as city, date.day as day,
+               date.month as month, date.year as year, type.name as type
+    """,
+
+    race_list="""
+        MATCH (org:Organization {nid: $org_id})-[:has]->(race:Race)-[:type]->(racetype:RaceType)
+        RETURN race.name as race, racetype.name as type, race.nid as race_id
+        ORDER BY racetype.weight, race.name
+    """,
+
+    race4person="""
+        MATCH (person:Person {nid: $pers_id})-[:is]->(part:Participant)-[:participates]->(race:Race),
+              (race)<-[:has]-(org:Organization)-[:On]->(day:Day),
+              (race)-[:type]->(racetype:RaceType),
+              (org)-[:In]->(loc:Location)
+        RETURN race, part, day, org, racetype, loc
+        ORDER BY day.key ASC
+    """,
+
+    relations="""
+        MATCH (n)-[r]->(m) RETURN n.nid as from_nid, type(r) as rel, m.nid as to_nid
+    """,
+
+    remove_node="""
+        MATCH (n:Node {nid: $nid}) DELETE n
+    """,
+
+    remove_node_force="""
+        MATCH (n:Node {nid: $nid}) DETACH DELETE n
+    """,
+
+    remove_day="""
+        MATCH (n:Day {key: $key})-[rel]-()
+        WITH n, count(rel) as rel_cnt
+        WHERE rel_cnt=1
+        DETACH DELETE n
+        RETURN count(n) AS cnt
+    """,
+
+    remove_month="""
+        MATCH (n:Month {key: $key})-[rel]-()
+        WITH n, count(rel) as rel_cnt
+        WHERE rel_cnt=1
+        DETACH DELETE n
+        RETURN count(n) AS cnt
+    """,
+
+    remove_year="""
+        MATCH (n:Year {key: $key})-[rel]-()
+        WITH n, count(rel) as rel_cnt
+        WHERE rel_cnt=1
+        DETACH DELETE n
+        RETURN count(n) AS cnt
+    """,
+
+    remove_relation="""
+        MATCH (start_node:Node {nid: $start_nid})-[rel]->(end_node:Node {nid: $end_nid})
+        WHERE type(rel) = $rel_type
+        DELETE rel
+    """,
+
+    set_node_nid="""
+        MATCH (n) WHERE id(n) = $node_id SET n.nid = $nid, n:Node RETURN n.nid
+    """,
+
+    set_participant_props="""
+        UNWIND $rows AS row
+        MATCH (part:Participant {nid: row.nid})
+        SET part += row
+    """,
+
+    wedstrijd_type="""
+        MATCH (org:Organization {nid: $org_id})-[:has]->(race:Race)-[:type]->(rt:RaceType {name: $racetype})
+        RETURN org, race, rt
+    """,
+)
+
+# Labels of the nodes that have a nid. Nodes without nid are searched per label, so that Neo4J uses the label scan
+# instead of a scan of all nodes. The nids are passed as parameter, one batch of nodes per statement.
+nid_labels = ["Calendar", "Year", "Month", "Day", "Participant", "Person", "Race", "Organization", "Location",
+              "RaceType", "OrgType", "MF", "User"]
+
+set_nids = """
+    MATCH (n:{label}) WHERE NOT EXISTS (n.nid)
+    WITH n LIMIT $batch
+    WITH collect(n) AS nodes
+    UNWIND range(0, size(nodes) - 1) AS i
+    WITH nodes[i] AS n, $nids[i] AS nid
+    SET n.nid = nid, n:Node
+    RETURN count(n) AS cnt
+"""
+
+for nid_label in nid_labels:
+    statements["set_nids_" + nid_label.lower()] = set_nids.format(label=nid_label)
+
+# Nodes from before the Node label get the label in batches per label.
+set_node_label = """
+    MATCH (n:{label}) WHERE EXISTS (n.nid) AND NOT n:Node
+    WITH n LIMIT $batch
+    SET n:Node
+    RETURN count(n) AS cnt
+"""
+
+for nid_label in nid_labels:
+    statements["set_node_label_" + nid_label.lower()] = set_node_label.format(label=nid_label)
+
+# Nodes are dumped per label in pages on nid, so that a dump never has all nodes in memory. A page has the nodes with
+# their outgoing relations.
+dump_nodes = """
+    MATCH (n:{label}) WHERE n.nid > $after
+    WITH n ORDER BY n.nid LIMIT $batch
+    OPTIONAL MATCH (n)-[r]->(m)
+    WITH n, collect([type(r), m.nid]) AS rels
+    RETURN n, rels
+    ORDER BY n.nid
+"""
+
+for nid_label in nid_labels:
+    statements["dump_" + nid_label.lower()] = dump_nodes.format(label=nid_label)
+
+# Relations are dumped in pages of start nodes, with the labels of the start and end node.
+dump_relations = """
+    MATCH (n:{label}) WHERE n.nid > $after
+    WITH n ORDER BY n.nid LIMIT $batch
+    OPTIONAL MATCH (n)-[r]->(m)
+    WITH n, collect([type(r), m.nid, labels(m)]) AS rels
+    RETURN n.nid AS nid, labels(n) AS labels, rels
+    ORDER BY nid
+"""
+
+for nid_label in nid_labels:
+    statements["dump_relations_" + nid_label.lower()] = dump_relations.format(label=nid_label)
+
+# Traversal primitives: neighbour nid and multiplicity, or all neighbour nids, in one round trip. There is a statement
+# for any relation type (neighbour_out) and a statement per relation type (neighbour_out_has), so that Neo4J expands
+# only the relations of the type. The number of relations is read from the degree of the node, a single neighbour is
+# found with a LIMIT instead of collecting all neighbours.
+rel_types = ["is", "participates", "after", "has", "type", "In", "On", "mf", "YEAR", "MONTH", "DAY"]
+
+neighbour = """
+    MATCH (n:Node {{nid: $nid}})
+    OPTIONAL MATCH (n){left}-[{rel}]-{right}(m)
+    WITH n, m LIMIT 1
+    RETURN n.nid as nid, m.nid as neighbour, size((n){left}-[{rel}]-{right}()) as cnt
+"""
+
+neighbours = """
+    MATCH (n:Node {{nid: $nid}})
+    OPTIONAL MATCH (n){left}-[{rel}]-{right}(m)
+    RETURN n.nid as nid, collect(DISTINCT m.nid) as neighbours
+"""
+
+for (direction, left, right) in [("in", "<", ""), ("out", "", ">")]:
+    for (suffix, rel) in [("", "")] + [("_" + rel_type.lower(), ":`" + rel_type + "`") for rel_type in rel_types]:
+        statements["neighbour_" + direction + suffix] = neighbour.format(left=left, rel=rel, right=right)
+        statements["neighbours_" + direction + suffix] = neighbours.format(left=left, rel=rel, right=right)
+
+# A restore (sql2neo) merges the nodes on nid in batches per label, and the relations in batches per relation type, so
+# that both ends are found on the Node constraint. Merge makes a batch that is done again after an interruption
+# harmless. Labels and relation types can not be parameters, so there is a statement for every label and every relation
+# type in the graph.
+restore_nodes = """
+    UNWIND $rows AS row
+    MERGE (n:Node {{nid: row.nid}})
+    SET n = row, n:{label}
+    RETURN count(n) AS cnt
+"""
+
+for nid_label in nid_labels:
+    statements["restore_" + nid_label.lower()] = restore_nodes.format(label=nid_label)
+
+restore_relations = """
+    UNWIND $rows AS row
+    MATCH (a:Node {{nid: row.from_nid}})
+    MATCH (b:Node {{nid: row.to_nid}})
+    MERGE (a)-[r:`{rel_type}`]->(b)
+    RETURN count(r) AS cnt
+"""
+
+for rel_type in rel_types:
+    statements["restore_rel_" + rel_type.lower()] = restore_relations.format(rel_type=rel_type)
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm as Form
-from wtforms import StringField, SubmitField, PasswordField, BooleanField, SelectField, RadioField
+from wtforms import StringField, SubmitField, PasswordField, BooleanField, SelectField, RadioField, FileField
 from wtforms.fields.html5 import DateField
 import wtforms.validators as wtv
 
@@ -39,6 +39,15 @@ class ParticipantAdd(Form):
     submit = SubmitField('OK')
 
 
+class ParticipantImport(Form):
+    """
+    Form to import the finish list of a race. The file has a line for every finisher in sequence of arrival, with
+    columns person (nid or name), pos and remark.
+    """
+    finishers = FileField('Aankomstlijst (csv): ', validators=[wtv.InputRequired()])
+    submit = SubmitField('OK')
+
+
 class ParticipantEdit(Form):
     pos = StringField('Plaats')
     remark = StringField('Opm.')
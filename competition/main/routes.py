@@ -1,10 +1,14 @@
 import competition.models_graph as mg
 # import logging
 # import datetime
+from collections import Counter, deque
+from functools import wraps
 from lib import my_env
 # from lib import neostore
-from flask import render_template, flash, current_app, redirect, url_for, request, make_response
-from flask_login import login_required, login_user, logout_user
+from flask import render_template, flash, current_app, redirect, url_for, request, make_response, jsonify, abort, \
+    session
+from flask_login import current_user, login_required, login_user, logout_user
+from werkzeug.http import is_resource_modified
 from .forms import *
 from . import main
 # from ..models_sql import User
@@ -15,6 +19,86 @@ from . import main
 released for pip and it may not be required at all: the data may not always be available, and a hassle to add the data.
 """
 part_config_props = ["pos", "remark"]
+# Query logs of the most recent requests, for the /_debug/queries view.
+recent_queries = deque(maxlen=50)
+
+
+def query_log_enabled():
+    """
+    The statements of every request are logged in debug mode, or if QUERY_LOG is set in the configuration.
+    """
+    return current_app.debug or current_app.config.get('QUERY_LOG')
+
+
+def data_etag():
+    """
+    The ETag for a read page is the data version of the store, with the user since the page is different for a logged
+    in user.
+    """
+    return "{v}-{u}".format(v=mg.ns.get_data_version(), u=current_user.get_id() if current_user.is_authenticated else 0)
+
+
+def conditional(view):
+    """
+    Decorator for the read views that depend on the data only. If the browser has the page for the ETag of the current
+    data version, then the view is not called and the answer is 304 Not Modified. Otherwise the ETag is taken after the
+    view, so that the page never goes with the ETag of a data version before the view. Pages with flashed messages are
+    not cached.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if session.get('_flashes'):
+            return view(*args, **kwargs)
+        etag = data_etag()
+        if not is_resource_modified(request.environ, etag=etag, last_modified=mg.ns.data_modified):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            etag = data_etag()
+        response.set_etag(etag)
+        response.last_modified = mg.ns.data_modified
+        # The browser must check the ETag on every request.
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+@main.before_app_request
+def start_node_cache():
+    """
+    Nodes are cached for the lifetime of a request, so that the same race, organization and person nodes are fetched
+    from Neo4J only once per request.
+    """
+    mg.ns.start_node_cache()
+    if query_log_enabled():
+        mg.ns.start_query_log()
+
+
+@main.after_app_request
+def add_query_log(response):
+    """
+    Add the number of statements and the database time of the request to the response headers, and keep the query log
+    for the /_debug/queries view.
+    """
+    query_log = mg.ns.stop_query_log()
+    if query_log is not None:
+        db_ms = sum(rec["ms"] for rec in query_log)
+        statements = Counter("{k}:{n}".format(k=rec["kind"], n=rec["name"]) for rec in query_log)
+        recent_queries.append(dict(method=request.method, url=request.full_path, count=len(query_log),
+                                   ms=round(db_ms, 2), statements=dict(statements.most_common()), queries=query_log))
+        response.headers["X-Query-Count"] = str(len(query_log))
+        response.headers["X-Query-Time"] = "{ms:.2f}".format(ms=db_ms)
+    return response
+
+
+@main.teardown_app_request
+def stop_node_cache(exc):
+    """
+    Close the node cache at the end of the request. A next request on this thread must not see nodes that may have been
+    modified in the meantime.
+    """
+    mg.ns.stop_node_cache()
+    mg.ns.stop_query_log()
 
 
 @main.route('/login', methods=['GET', 'POST'])
@@ -102,6 +186,7 @@ def person_edit(pers_id):
 
 
 @main.route('/person/list')
+@conditional
 def person_list():
     persons = mg.person_list(nr_races=True)
     return render_template('person_list.html', persons=persons)
@@ -145,6 +230,7 @@ def person_delete(pers_id):
 
 
 @main.route('/organization/list')
+@conditional
 def organization_list():
     organizations = mg.organization_list()
     return render_template('organization_list.html', organizations=organizations)
@@ -329,6 +415,7 @@ def race_edit(org_id, race_id):
 
 
 @main.route('/participant/<race_id>/list', methods=['GET'])
+@conditional
 def participant_list(race_id):
     """
     This method will show the participants in sequence of arrival for a race.
@@ -359,15 +446,14 @@ def participant_add(race_id):
         # Add collected info as participant to race.
         runner_id = form.name.data
         prev_runner_id = form.prev_runner.data
-        # Create the participant node, connect to person and to race.
-        part = mg.Participant(race_id=race_id, pers_id=runner_id)
-        part.add(prev_pers_id=prev_runner_id)
         # Collect properties for this participant
         props = {}
         for prop in part_config_props:
             if form.data[prop]:
                 props[prop] = form.data[prop]
-        part.set_props(**props)
+        # Create the participant node, connect to person, to race and to the previous runner.
+        part = mg.Participant(race_id=race_id, pers_id=runner_id)
+        part.add(prev_pers_id=prev_runner_id, **props)
         return redirect(url_for('main.participant_add', race_id=race_id))
     else:
         # Get method, initialize page.
@@ -389,6 +475,35 @@ def participant_add(race_id):
         return render_template('participant_add.html', **param_dict)
 
 
+@main.route('/participant/<race_id>/import', methods=['GET', 'POST'])
+@login_required
+def participant_import(race_id):
+    """
+    This method will add the finishers from a csv file to a race, after the participants that are in the race already.
+    The file has a line for every finisher in sequence of arrival, with columns person (nid or name), pos and remark.
+    If there are errors in the file, then no participant is added.
+    :param race_id: ID of the race.
+    :return: The finishers are added to the race.
+    """
+    race_label = mg.race_label(race_id)
+    form = ParticipantImport()
+    if form.validate_on_submit():
+        try:
+            lines = mg.decode_csv(form.finishers.data.read()).splitlines()
+        except UnicodeDecodeError:
+            flash("Het bestand is geen csv bestand in utf-8 of Windows (cp1252) codering.", "error")
+            return redirect(url_for('main.participant_import', race_id=race_id))
+        (cnt, errors) = mg.participants_import(race_id, mg.finishers_from_csv(lines))
+        for error in errors:
+            flash(error, "error")
+        if not errors:
+            flash("{cnt} deelnemers toegevoegd.".format(cnt=cnt), "success")
+            return redirect(url_for('main.participant_add', race_id=race_id))
+    org_id = mg.get_org_id(race_id)
+    return render_template('participant_import.html', form=form, race_id=race_id, race_label=race_label,
+                           org_id=org_id)
+
+
 @main.route('/participant/edit/<part_id>', methods=['GET', 'POST'])
 @login_required
 def participant_edit(part_id):
@@ -488,6 +603,7 @@ def hoofdwedstrijd_set(org_id, race_id):
 
 @main.route('/result/<cat>', methods=['GET'])
 @main.route('/result/<cat>/<person_id>', methods=['GET'])
+@conditional
 def results(cat, person_id=None):
     result_set = mg.results_for_category(cat)
     param_dict = dict(result_set=result_set, cat=cat)
@@ -502,6 +618,7 @@ def results(cat, person_id=None):
 
 
 @main.route('/overview/<cat>', methods=['GET'])
+@conditional
 def overview(cat):
     """
     This method shows the results in detail. For every person the result in every race will be shown.
@@ -515,18 +632,37 @@ def overview(cat):
     result_seq = mg.results_for_category(cat)
     param_dict = dict(
         org_list=org_list,
-        result_set=result_seq, cat=cat
+        result_set=result_seq, cat=cat,
+        result4person=mg.results4person_org(cat)
     )
-    result4person = {}
-    # Person nid is 4th element in the tuple
-    for person_res in result_seq:
-        person_nid = person_res[3]
-        races = mg.races4person_org(person_nid)
-        result4person[person_nid] = races
-    param_dict['result4person'] = result4person
     return render_template("overview_list.html", **param_dict)
 
 
+@main.route('/health', methods=['GET'])
+def health():
+    """
+    Health check for a load balancer or a monitor. The answer is 503 if the store does not respond, the connection is
+    made again on the next request then.
+    """
+    if mg.ns.ping():
+        return jsonify(status="ok")
+    return jsonify(status="unavailable"), 503
+
+
+@main.route('/_debug/queries', methods=['GET'])
+@login_required
+def debug_queries():
+    """
+    This method shows the query log of the most recent requests, most recent request first. For every request the
+    number of statements, the database time in ms, the count per statement and the statements are shown.
+    The view is available only if the query log is enabled, and for a logged in user only since the log has the urls
+    of all visitors.
+    """
+    if not query_log_enabled():
+        abort(404)
+    return jsonify(list(reversed(recent_queries)))
+
+
 @main.errorhandler(404)
 def not_found(e):
     return render_template("404.html", err=e)
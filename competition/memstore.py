@@ -0,0 +1,867 @@
+"""
+This module has an in-memory graph store that implements the NeoStore interface. Nodes are py2neo Node objects, so the
+models work with the same objects as on Neo4J. The named statements from module cypher are implemented as Python
+methods on the indexed node and relation dictionaries.
+The store can be loaded from a sqlite dump (Tools/neo2sql.py), so that tests and profiling runs do not need a Neo4J
+database.
+"""
+
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from py2neo import Node
+from competition.neostore import NeoStore, section_label, to_date
+from lib import datastore
+
+
+class MemCursor:
+    """
+    This class has the part of the py2neo Cursor interface that is used by the NeoStore. A record is a dictionary with
+    the return fields as keys.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.pos = -1
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def data(self):
+        return [dict(rec) for rec in self.records]
+
+    def evaluate(self):
+        """
+        Returns the first value of the first record, or None if there are no records.
+        """
+        for rec in self.records:
+            for value in rec.values():
+                return value
+        return None
+
+    def forward(self):
+        self.pos += 1
+        return self.pos < len(self.records)
+
+    def current(self):
+        return self.records[self.pos]
+
+    def next(self):
+        if not self.forward():
+            raise StopIteration
+        return self.current()
+
+    __next__ = next
+
+
+class MemGraph:
+    """
+    This class holds the nodes and the relations of the graph in memory. Nodes are indexed on label and on (label,
+    property, value). Relations are kept as ordered sets of (relation type, nid) for every node, in both directions.
+    While a transaction is open, every change adds an undo action to the journal.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.journal = None
+        self.clear()
+
+    def clear(self):
+        self.nodes = {}         # nid: Node
+        self.props = {}         # nid: properties as indexed, to update the index and to undo property changes
+        self.labels = {}        # label: {nid: None}
+        self.index = {}         # (label, property, value): {nid: None}
+        self.rels_out = {}      # nid: {(rel_type, end_nid): None}
+        self.rels_in = {}       # nid: {(rel_type, start_nid): None}
+        return
+
+    def undo(self, action):
+        if self.journal is not None:
+            self.journal.append(action)
+        return
+
+    def index_node(self, nid):
+        node = self.nodes[nid]
+        props = dict(node)
+        for label in node.labels():
+            self.labels.setdefault(label, {})[nid] = None
+            for key, value in props.items():
+                try:
+                    self.index.setdefault((label, key, value), {})[nid] = None
+                except TypeError:
+                    # Lists are not indexed.
+                    pass
+        self.props[nid] = props
+        return
+
+    def unindex_node(self, nid):
+        node = self.nodes[nid]
+        for label in node.labels():
+            self.labels[label].pop(nid, None)
+            for key, value in self.props[nid].items():
+                try:
+                    self.index[(label, key, value)].pop(nid, None)
+                except (KeyError, TypeError):
+                    pass
+        del self.props[nid]
+        return
+
+    def add_node(self, node):
+        if not node["nid"]:
+            node["nid"] = str(uuid.uuid4())
+        nid = node["nid"]
+        self.nodes[nid] = node
+        self.rels_out[nid] = {}
+        self.rels_in[nid] = {}
+        self.index_node(nid)
+        self.undo(lambda: self.delete_node(nid))
+        return node
+
+    def delete_node(self, nid):
+        if nid not in self.nodes:
+            return False
+        for (rel_type, end_nid) in list(self.rels_out[nid]):
+            self.delete_rel(nid, rel_type, end_nid)
+        for (rel_type, start_nid) in list(self.rels_in[nid]):
+            self.delete_rel(start_nid, rel_type, nid)
+        self.unindex_node(nid)
+        node = self.nodes.pop(nid)
+        del self.rels_out[nid]
+        del self.rels_in[nid]
+        self.undo(lambda: self.add_node(node))
+        return True
+
+    def update_node(self, node):
+        nid = node["nid"]
+        old_props = self.props[nid]
+        self.unindex_node(nid)
+        self.index_node(nid)
+
+        def restore():
+            for key in list(node.keys()):
+                del node[key]
+            for key, value in old_props.items():
+                node[key] = value
+            self.update_node(node)
+        self.undo(restore)
+        return
+
+    def add_rel(self, start_nid, rel_type, end_nid):
+        if (rel_type, end_nid) in self.rels_out[start_nid]:
+            return
+        self.rels_out[start_nid][(rel_type, end_nid)] = None
+        self.rels_in[end_nid][(rel_type, start_nid)] = None
+        self.undo(lambda: self.delete_rel(start_nid, rel_type, end_nid))
+        return
+
+    def delete_rel(self, start_nid, rel_type, end_nid):
+        if (rel_type, end_nid) not in self.rels_out.get(start_nid, {}):
+            return
+        del self.rels_out[start_nid][(rel_type, end_nid)]
+        del self.rels_in[end_nid][(rel_type, start_nid)]
+        self.undo(lambda: self.add_rel(start_nid, rel_type, end_nid))
+        return
+
+    def node(self, nid):
+        return self.nodes.get(nid)
+
+    def find(self, *labels, **props):
+        """
+        Returns the nodes with all labels and properties. The most selective index is used, remaining labels and
+        properties are checked on the candidates.
+        """
+        candidates = None
+        for label in labels:
+            for key, value in props.items():
+                nids = self.index.get((label, key, value), {})
+                if candidates is None or len(nids) < len(candidates):
+                    candidates = nids
+            if not props:
+                nids = self.labels.get(label, {})
+                if candidates is None or len(nids) < len(candidates):
+                    candidates = nids
+        if candidates is None:
+            candidates = self.nodes
+        nodes = []
+        for nid in candidates:
+            node = self.nodes[nid]
+            if all(node.has_label(label) for label in labels) and \
+                    all(node[key] == value for key, value in props.items()):
+                nodes.append(node)
+        return nodes
+
+    def all_nids(self):
+        return list(self.nodes)
+
+    def degree(self, nid):
+        return len(self.rels_out.get(nid, {})) + len(self.rels_in.get(nid, {}))
+
+    def relations(self):
+        return [(from_nid, rel_type, to_nid)
+                for from_nid in self.rels_out for (rel_type, to_nid) in self.rels_out[from_nid]]
+
+    def out_nids(self, nid, rel_type=None):
+        return [end_nid for (rtype, end_nid) in self.rels_out.get(nid, {}) if rel_type in (None, rtype)]
+
+    def in_nids(self, nid, rel_type=None):
+        return [start_nid for (rtype, start_nid) in self.rels_in.get(nid, {}) if rel_type in (None, rtype)]
+
+    # Methods used by NeoStore on the object returned by method db()
+
+    def create(self, node):
+        with self.lock:
+            self.add_node(node)
+        return
+
+    def merge(self, rel):
+        with self.lock:
+            self.add_rel(rel.start_node()["nid"], rel.type(), rel.end_node()["nid"])
+        return
+
+    def push(self, node):
+        with self.lock:
+            self.update_node(node)
+        return
+
+    @staticmethod
+    def exists(node):
+        if not isinstance(node, Node):
+            raise TypeError("Node expected")
+        return True
+
+
+class MemStore(NeoStore):
+    """
+    In-memory implementation of the NeoStore. Methods that work through run, db and node cache are inherited from the
+    NeoStore, the named statements are implemented in the query_<statement name> methods.
+    Statements and transactions are serialized on a lock.
+    """
+    # Nodes are found on nid in the store index, the nodes do not need the Node label.
+    shared_labels = []
+
+    def __init__(self, dumpfile=None):
+        """
+        Method to instantiate the in-memory store.
+
+        :param dumpfile: sqlite dump of a Neo4J database (from Tools/neo2sql.py) to load in the store.
+
+        :return: Object to handle neostore commands.
+        """
+        self.mem = MemGraph()
+        # Thread local storage, for the node cache and the open transaction.
+        self.local = threading.local()
+        # Date nodes are found on the key index, the date cache is not used.
+        self.date_cache = {}
+        self.init_data_version()
+        if dumpfile:
+            self.load_dump(dumpfile)
+        return
+
+    def init_app(self, app):
+        """
+        This method will load the dump file from the application configuration (STORE_DUMP), if there is one, and
+        configure the slow query log.
+
+        :param app: Flask application object.
+
+        :return:
+        """
+        dumpfile = app.config.get('STORE_DUMP')
+        if dumpfile:
+            self.load_dump(dumpfile)
+        self.init_slow_query_log(app)
+        return
+
+    def load_dump(self, dumpfile):
+        """
+        This method will replace the content of the store with the content of a sqlite dump.
+
+        :param dumpfile: Full path to the sqlite dump.
+
+        :return: Number of nodes loaded.
+        """
+        ds = datastore.DataStore(dumpfile)
+        labels = {}
+        for row in ds.get_records("labels"):
+            labels.setdefault(row["nid"], []).append(row["label"])
+        key_list = ds.get_key_list("components")
+        with self.mem.lock:
+            self.mem.clear()
+            for row in ds.get_records("components"):
+                valuedict = {}
+                for attrib in key_list:
+                    if row[attrib] is not None:
+                        valuedict[attrib.lower()] = row[attrib]
+                self.mem.add_node(Node(*labels.get(row["nid"], []), **valuedict))
+            for row in ds.get_records("relations"):
+                self.mem.add_rel(row["from_nid"], row["rel"], row["to_nid"])
+        ds.close_connection()
+        self.clear_node_cache()
+        self.new_data_version()
+        cnt = len(self.mem.all_nids())
+        logging.info("{cnt} nodes loaded from {dumpfile}".format(cnt=cnt, dumpfile=dumpfile))
+        return cnt
+
+    def connect(self):
+        return self.mem
+
+    def db(self):
+        return self.mem
+
+    def ping(self):
+        return True
+
+    def get_data_version(self):
+        # The data is changed by this process only.
+        return self.data_version
+
+    def run(self, stmt_name, **params):
+        """
+        This method will run the named statement on the in-memory graph.
+        :param stmt_name: Name of the statement in the registry.
+        :param params: Parameters for the statement.
+        :return: MemCursor with the result of the statement.
+        """
+        with self.query_timer("run", stmt_name, params) as rec:
+            with self.mem.lock:
+                records = getattr(self, "query_" + stmt_name)(**params)
+            rec["rows"] = len(records)
+        return MemCursor(records)
+
+    @contextmanager
+    def transaction(self):
+        """
+        This method opens a transaction for the current thread. Other threads wait until the transaction is done. If an
+        exception is raised in the with block, then all changes are undone from the journal.
+
+        :return:
+        """
+        if getattr(self.local, "tx", None) is not None:
+            yield
+            return
+        with self.mem.lock:
+            self.local.tx = self.mem
+            self.mem.journal = []
+            try:
+                yield
+            except Exception:
+                journal = self.mem.journal
+                self.mem.journal = None
+                for action in reversed(journal):
+                    action()
+                self.end_transaction(commit=False)
+                self.clear_node_cache()
+                raise
+            finally:
+                self.mem.journal = None
+                self.local.tx = None
+        self.end_transaction(commit=True)
+        return
+
+    def date_node(self, ds):
+        """
+        This method will get a datetime.date timestamp and return the associated Day node. Year, Month and Day nodes
+        are created like the py2neo calendar extension does.
+        @param ds: datetime.date representation of the date, or Calendar key 'YYYY-MM-DD'.
+        @return: node associated with the date, of False (ds could not be formatted as a date object).
+        """
+        ds = to_date(ds)
+        if not ds:
+            return False
+        with self.mem.lock:
+            parent = self.get_node("Calendar")
+            if not parent:
+                parent = self.create_node("Calendar", name="Gregorian")
+            path = [("YEAR", "Year", dict(year=ds.year, key=ds.strftime("%Y"))),
+                    ("MONTH", "Month", dict(year=ds.year, month=ds.month, key=ds.strftime("%Y-%m"))),
+                    ("DAY", "Day", dict(year=ds.year, month=ds.month, day=ds.day, key=ds.strftime("%Y-%m-%d")))]
+            for (rel_type, label, props) in path:
+                date_node = self.get_node(label, key=props["key"])
+                if not date_node:
+                    date_node = self.create_node(label, **props)
+                    self.mem.add_rel(parent["nid"], rel_type, date_node["nid"])
+                parent = date_node
+        return parent
+
+    def stream_nodes(self, batch=1000):
+        """
+        This method will return all nodes with their outgoing relations.
+        @param batch: Not used, the store is in memory.
+        @return: generator of tuples (node, relations), relations is a list of tuples (relation type, nid of end node).
+        """
+        rels_out = {}
+        for (from_nid, rel_type, to_nid) in self.mem.relations():
+            rels_out.setdefault(from_nid, []).append((rel_type, to_nid))
+        for nid in self.mem.all_nids():
+            yield self.mem.node(nid), rels_out.get(nid, [])
+
+    def stream_relations(self, batch=1000):
+        """
+        This method will return all relations with the label of the start and end node.
+        @param batch: Not used, the store is in memory.
+        @return: generator of tuples (start label, relation type, end label, start nid, end nid).
+        """
+        for (from_nid, rel_type, to_nid) in self.mem.relations():
+            yield (section_label(self.mem.node(from_nid).labels()), rel_type,
+                   section_label(self.mem.node(to_nid).labels()), from_nid, to_nid)
+
+    def node_count(self):
+        return len(self.mem.all_nids())
+
+    def property_keys(self):
+        keys = set()
+        for nid in self.mem.all_nids():
+            keys.update(self.mem.node(nid).keys())
+        return sorted(keys)
+
+    def restore_nodes(self, label, rows):
+        """
+        This method will restore a batch of nodes with the label. A node that exists already gets the properties from
+        the row.
+        @param label: Label for the nodes
+        @param rows: List of property dictionaries, each with a nid.
+        @return: Number of nodes in the batch.
+        """
+        with self.transaction():
+            for row in rows:
+                node = self.mem.node(row["nid"])
+                if node is None:
+                    self.mem.add_node(Node(label, **row))
+                else:
+                    for key in list(node.keys()):
+                        del node[key]
+                    node.update(row)
+                    self.mem.update_node(node)
+        return len(rows)
+
+    def restore_relations(self, rel_type, rows):
+        """
+        This method will restore a batch of relations of one type. Relations that exist already are not added again.
+        @param rel_type: Relation type
+        @param rows: List of dictionaries with from_nid and to_nid.
+        @return: Number of relations in the batch.
+        """
+        with self.transaction():
+            for row in rows:
+                self.mem.add_rel(row["from_nid"], rel_type, row["to_nid"])
+        return len(rows)
+
+    def get_nodes_no_nid(self, batch=1000):
+        """
+        Every node in the store gets a nid on creation, there are no nodes without nid.
+        """
+        return 0
+
+    def find_date_node(self, ds):
+        """
+        This method will get the node associated with the date, without creating the node if it does not exist.
+        @param ds: datetime.date representation of the date, or Calendar key 'YYYY-MM-DD'.
+        @return: node associated with the date, or False if there is no node for the date.
+        """
+        ds = to_date(ds)
+        if not ds:
+            return False
+        return self.get_node("Day", key=ds.strftime("%Y-%m-%d"))
+
+    def profile(self, stmt_name, **params):
+        """
+        Statements of the in-memory store are methods, there is no plan to profile.
+        """
+        return None
+
+    def get_nodes(self, *labels, **props):
+        """
+        This method will select all nodes that have labels and properties
+        @param labels:
+        @param props:
+        @return: list of nodes that fulfill the criteria
+        """
+        with self.query_timer("select", ":".join(labels), props) as rec:
+            with self.mem.lock:
+                nodes = self.mem.find(*labels, **props)
+            rec["rows"] = len(nodes)
+        return nodes
+
+    def create_indexes(self):
+        """
+        Nodes are indexed on creation, there are no indexes to create.
+        """
+        return
+
+    def init_graph(self):
+        """
+        This method will create the nodes required for the application, on condition that the nodes do not exist
+        already.
+        @return:
+        """
+        required = [("MF", dict(name="Dames")), ("MF", dict(name="Heren")),
+                    ("RaceType", dict(name="Hoofdwedstrijd", weight=10)),
+                    ("RaceType", dict(name="Bijwedstrijd", weight=20)),
+                    ("RaceType", dict(name="Deelname", weight=100)),
+                    ("OrgType", dict(name="Wedstrijd")), ("OrgType", dict(name="Deelname"))]
+        for (label, props) in required:
+            if not self.get_nodes(label, name=props["name"]):
+                self.create_node(label, **props)
+        return
+
+    # Helpers for the statements.
+
+    def out(self, nid, rel_type=None, label=None):
+        """
+        Returns the end nodes of the relations from the node with nid. Relation type and label of the end node are
+        optional filters.
+        """
+        nodes = [self.mem.node(end_nid) for end_nid in self.mem.out_nids(nid, rel_type)]
+        return [node for node in nodes if label is None or node.has_label(label)]
+
+    def inn(self, nid, rel_type=None, label=None):
+        """
+        Returns the start nodes of the relations to the node with nid. Relation type and label of the start node are
+        optional filters.
+        """
+        nodes = [self.mem.node(start_nid) for start_nid in self.mem.in_nids(nid, rel_type)]
+        return [node for node in nodes if label is None or node.has_label(label)]
+
+    def one(self, label, nid):
+        """
+        Returns the node with nid if it has the label, None otherwise.
+        """
+        node = self.mem.node(nid)
+        if node is not None and node.has_label(label):
+            return node
+        return None
+
+    def cat(self, person_nid):
+        """
+        Returns the MF node (category) for the person, or None.
+        """
+        for mf in self.out(person_nid, "mf", "MF"):
+            return mf
+        return None
+
+    def participations(self, person_nid):
+        """
+        Returns (participant, race) node tuples for every participation of the person.
+        """
+        return [(part, race) for part in self.out(person_nid, "is", "Participant")
+                for race in self.out(part["nid"], "participates", "Race")]
+
+    def race_participants(self, race_id):
+        race = self.one("Race", race_id)
+        if race is None:
+            return []
+        return self.inn(race_id, "participates", "Participant")
+
+    @staticmethod
+    def by_rank(part):
+        return (part["rank"] is None, part["rank"])
+
+    # Named statements, see module cypher for the Cypher version.
+
+    def query_cat4part(self, part_nid):
+        if not self.one("Participant", part_nid):
+            return []
+        return [dict(name=mf["name"]) for pers in self.inn(part_nid, "is") for mf in self.out(pers["nid"], "mf", "MF")]
+
+    def query_cat4race(self, race_id):
+        res = []
+        for part in self.race_participants(race_id):
+            for pers in self.inn(part["nid"], "is", "Person"):
+                cats = [mf["name"] for mf in self.out(pers["nid"], "mf", "MF")] or [None]
+                for cat in cats:
+                    res.append(dict(nid=part["nid"], cat=cat, pers_nid=pers["nid"], name=pers["name"]))
+        return res
+
+    def clear_date_label(self, label):
+        cnt = 0
+        for node in self.get_nodes(label):
+            nid = node["nid"]
+            if self.mem.degree(nid) == 1:
+                self.mem.delete_node(nid)
+                cnt += 1
+        return [dict(cnt=cnt)]
+
+    def query_create_after_chain(self, rows):
+        for row in rows:
+            self.mem.add_rel(row["next_nid"], "after", row["prev_nid"])
+        return []
+
+    def query_create_participants(self, race_id, rows):
+        res = []
+        if self.one("Race", race_id):
+            for row in rows:
+                if self.one("Person", row["pers_nid"]):
+                    part = Node("Participant", **row["props"])
+                    self.mem.add_node(part)
+                    self.mem.add_rel(row["pers_nid"], "is", part["nid"])
+                    self.mem.add_rel(part["nid"], "participates", race_id)
+                    res.append(part)
+        return [dict(cnt=len(res))]
+
+    def query_clear_day(self):
+        return self.clear_date_label("Day")
+
+    def query_clear_month(self):
+        return self.clear_date_label("Month")
+
+    def query_clear_year(self):
+        return self.clear_date_label("Year")
+
+    def remove_date_key(self, label, key):
+        res = []
+        for node in self.get_nodes(label, key=key):
+            if self.mem.degree(node["nid"]) == 1:
+                self.mem.delete_node(node["nid"])
+                res.append(dict(cnt=1))
+        return res
+
+    def query_remove_day(self, key):
+        return self.remove_date_key("Day", key)
+
+    def query_remove_month(self, key):
+        return self.remove_date_key("Month", key)
+
+    def query_remove_year(self, key):
+        return self.remove_date_key("Year", key)
+
+    def query_clear_store(self):
+        for nid in self.mem.all_nids():
+            self.mem.delete_node(nid)
+        return []
+
+    def query_main_race(self, race_nid):
+        res = []
+        if self.one("Race", race_nid):
+            for org in self.inn(race_nid, "has", "Organization"):
+                for race in self.out(org["nid"], "has", "Race"):
+                    if [rt for rt in self.out(race["nid"], "type", "RaceType") if rt["name"] == "Hoofdwedstrijd"]:
+                        res.append(dict(nid=race["nid"]))
+        return res
+
+    @staticmethod
+    def typed_statement(stmt_name, rel_type):
+        # The query methods filter on the relation type.
+        return stmt_name
+
+    def query_neighbour_in(self, nid, rel_type):
+        if self.mem.node(nid) is None:
+            return []
+        nids = self.mem.in_nids(nid, rel_type)
+        return [dict(nid=nid, neighbour=nids[0] if nids else None, cnt=len(nids))]
+
+    def query_neighbour_out(self, nid, rel_type):
+        if self.mem.node(nid) is None:
+            return []
+        nids = self.mem.out_nids(nid, rel_type)
+        return [dict(nid=nid, neighbour=nids[0] if nids else None, cnt=len(nids))]
+
+    def query_neighbours_in(self, nid, rel_type):
+        if self.mem.node(nid) is None:
+            return []
+        return [dict(nid=nid, neighbours=list(dict.fromkeys(self.mem.in_nids(nid, rel_type))))]
+
+    def query_neighbours_out(self, nid, rel_type):
+        if self.mem.node(nid) is None:
+            return []
+        return [dict(nid=nid, neighbours=list(dict.fromkeys(self.mem.out_nids(nid, rel_type))))]
+
+    def query_next_participant(self, race_id):
+        res = []
+        for org in self.inn(race_id, "has", "Organization"):
+            org_races = [race["nid"] for race in self.out(org["nid"], "has", "Race")]
+            for person in self.get_nodes("Person"):
+                if not [race for (part, race) in self.participations(person["nid"]) if race["nid"] in org_races]:
+                    res.append(dict(nid=person["nid"], name=person["name"]))
+        return sorted(res, key=lambda rec: rec["name"])
+
+    def query_node(self, nid):
+        node = self.mem.node(nid)
+        return [dict(n=node)] if node is not None else []
+
+    def query_node_relations(self, nid):
+        return [dict(m_nid=m_nid) for m_nid in self.mem.out_nids(nid) + self.mem.in_nids(nid)]
+
+    def query_nr_participants(self, race_nid, cat):
+        cnt = 0
+        for part in self.race_participants(race_nid):
+            for pers in self.inn(part["nid"], "is", "Person"):
+                cnt += len([mf for mf in self.out(pers["nid"], "mf", "MF") if mf["name"] == cat])
+        return [dict(cnt=cnt)]
+
+    def query_organization(self, datestamp, name, location):
+        res = []
+        for org in self.get_nodes("Organization", name=name):
+            days = [day for day in self.out(org["nid"], "On", "Day") if day["key"] == datestamp]
+            locs = [loc for loc in self.out(org["nid"], "In", "Location") if loc["city"] == location]
+            res += [dict(org=org) for day in days for loc in locs]
+        return res
+
+    def query_organization_from_id(self, org_id):
+        res = []
+        if self.one("Organization", org_id):
+            org = self.mem.node(org_id)
+            for day in self.out(org_id, "On", "Day"):
+                for loc in self.out(org_id, "In", "Location"):
+                    res.append(dict(day=day["day"], month=day["month"], year=day["year"], date=day["key"],
+                                    org=org["name"], city=loc["city"]))
+        return res
+
+    def query_organization_list(self):
+        res = []
+        for org in self.get_nodes("Organization"):
+            for day in self.out(org["nid"], "On", "Day"):
+                for loc in self.out(org["nid"], "In", "Location"):
+                    for ot in self.out(org["nid"], "type", "OrgType"):
+                        res.append(dict(date=day["key"], organization=org["name"], city=loc["city"], id=org["nid"],
+                                        type=ot["name"]))
+        return sorted(res, key=lambda rec: rec["date"])
+
+    def query_orphan_locations(self):
+        return [dict(loc_nid=loc["nid"], city=loc["city"]) for loc in self.get_nodes("Location")
+                if not self.mem.degree(loc["nid"])]
+
+    def query_overview(self, cat):
+        res = []
+        for mf in self.get_nodes("MF", name=cat):
+            for person in self.inn(mf["nid"], "mf", "Person"):
+                for (part, race) in self.participations(person["nid"]):
+                    for org in self.inn(race["nid"], "has", "Organization"):
+                        res.append(dict(pers_nid=person["nid"], org_nid=org["nid"], race=race["name"],
+                                        pos=part["pos"], points=part["points"]))
+        return res
+
+    def query_participant_in_race(self, pers_id, race_id):
+        if not self.one("Person", pers_id):
+            return []
+        return [dict(part=part) for (part, race) in self.participations(pers_id) if race["nid"] == race_id]
+
+    def query_participant_chain(self, race_id):
+        parts = self.race_participants(race_id)
+        if not parts:
+            return []
+        longest = []
+        for part in parts:
+            # Follow the after relations from every participant to the last arrival, keep the longest chain.
+            chain = [part]
+            chain_nids = {part["nid"]}
+            while True:
+                next_parts = self.inn(chain[-1]["nid"], "after", "Participant")
+                if not next_parts or next_parts[0]["nid"] in chain_nids:
+                    break
+                chain.append(next_parts[0])
+                chain_nids.add(next_parts[0]["nid"])
+            if len(chain) > len(longest):
+                longest = chain
+        return [{"nodes(result)": longest}]
+
+    def query_participant_ranks(self, race_id):
+        parts = sorted(self.race_participants(race_id), key=self.by_rank)
+        return [dict(nid=part["nid"], rank=part["rank"]) for part in parts]
+
+    def query_participant_seq_list(self, race_id):
+        return [dict(part=part) for part in sorted(self.race_participants(race_id), key=self.by_rank)]
+
+    def query_persons_nr_races(self):
+        res = [dict(nid=person["nid"], name=person["name"], nr_races=len(self.participations(person["nid"])))
+               for person in self.get_nodes("Person")]
+        return sorted(res, key=lambda rec: (-rec["nr_races"], rec["name"]))
+
+    @staticmethod
+    def query_ping():
+        return [{"1": 1}]
+
+    def query_points_per_category(self, cat):
+        res = []
+        for mf in self.get_nodes("MF", name=cat):
+            for person in self.inn(mf["nid"], "mf", "Person"):
+                for part in self.out(person["nid"], "is", "Participant"):
+                    res.append(dict(name=person["name"], nid=person["nid"], part_nid=part["nid"],
+                                    points=part["points"]))
+        return res
+
+    def query_race_in_org(self, org_id, racetype_id, name):
+        res = []
+        org = self.one("Organization", org_id)
+        if org:
+            for race in self.out(org_id, label="Race"):
+                if race["name"] == name and [rt for rt in self.out(race["nid"], label="RaceType")
+                                             if rt["nid"] == racetype_id]:
+                    res.append(dict(race_nid=race["nid"], org_name=org["name"]))
+        return res
+
+    def query_race_label(self, race_id):
+        res = []
+        race = self.one("Race", race_id)
+        if race:
+            for org in self.inn(race_id, "has"):
+                for day in self.out(org["nid"], "On"):
+                    for loc in self.out(org["nid"], "In"):
+                        for rt in self.out(race_id, "type", "RaceType"):
+                            res.append(dict(race=race["name"], org=org["name"], city=loc["city"], day=day["day"],
+                                            month=day["month"], year=day["year"], type=rt["name"]))
+        return res
+
+    def query_race_list(self, org_id):
+        res = []
+        if self.one("Organization", org_id):
+            for race in self.out(org_id, "has", "Race"):
+                for rt in self.out(race["nid"], "type", "RaceType"):
+                    res.append((rt["weight"], race["name"], dict(race=race["name"], type=rt["name"],
+                                                                  race_id=race["nid"])))
+        # Weight is a number, also in a sqlite dump with a text weight column.
+        res.sort(key=lambda rec: (rec[0] is None, int(rec[0] or 0), rec[1]))
+        return [rec for (weight, name, rec) in res]
+
+    def query_race4person(self, pers_id):
+        res = []
+        if self.one("Person", pers_id):
+            for (part, race) in self.participations(pers_id):
+                for org in self.inn(race["nid"], "has", "Organization"):
+                    for day in self.out(org["nid"], "On", "Day"):
+                        for racetype in self.out(race["nid"], "type", "RaceType"):
+                            for loc in self.out(org["nid"], "In", "Location"):
+                                res.append(dict(race=race, part=part, day=day, org=org, racetype=racetype, loc=loc))
+        return sorted(res, key=lambda rec: rec["day"]["key"])
+
+    def query_relations(self):
+        return [dict(from_nid=from_nid, rel=rel_type, to_nid=to_nid)
+                for (from_nid, rel_type, to_nid) in self.mem.relations()]
+
+    def query_remove_node(self, nid):
+        if self.mem.degree(nid):
+            raise ValueError("Node {nid} still has relations".format(nid=nid))
+        self.mem.delete_node(nid)
+        return []
+
+    def query_remove_node_force(self, nid):
+        self.mem.delete_node(nid)
+        return []
+
+    def query_remove_relation(self, start_nid, end_nid, rel_type):
+        self.mem.delete_rel(start_nid, rel_type, end_nid)
+        return []
+
+    @staticmethod
+    def query_set_node_nid(node_id, nid):
+        # Every node in the store has a nid.
+        return []
+
+    def query_set_participant_props(self, rows):
+        for row in rows:
+            part = self.one("Participant", row["nid"])
+            if part is not None:
+                for key, value in row.items():
+                    part[key] = value
+                self.mem.update_node(part)
+        return []
+
+    def query_wedstrijd_type(self, org_id, racetype):
+        res = []
+        org = self.one("Organization", org_id)
+        if org:
+            for race in self.out(org_id, "has", "Race"):
+                for rt in self.out(race["nid"], "type", "RaceType"):
+                    if rt["name"] == racetype:
+                        res.append(dict(org=org, race=race, rt=rt))
+        return res
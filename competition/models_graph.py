@@ -1,20 +1,18 @@
+import csv
 import logging
-import os
+import threading
 from . import lm
 from competition import neostore
 from flask_login import UserMixin
 # from lib import my_env
 from werkzeug.security import generate_password_hash, check_password_hash
 
-neo4j_params = dict(
-    user=os.environ.get('Neo4J_User'),
-    password=os.environ.get('Neo4J_Pwd'),
-    db=os.environ.get('Neo4J_Db')
-)
-host = os.environ.get("Neo4J_Host")
-if isinstance(host, str):
-    neo4j_params['host'] = host
-ns = neostore.NeoStore(**neo4j_params)
+# The connection to Neo4J is made on first use. The application configuration is set in create_app.
+ns = neostore.NeoStore()
+
+# Points are counted for the best races only, every additional race gives a fixed number of points.
+points_best_races = 7
+add_points_per_race = 10
 
 
 class User(UserMixin):
@@ -95,15 +93,15 @@ def load_user(user_id):
 class Participant:
 
     # List of calculated properties for the participant node.
-    calc_props = ["nid", "points", "rel_pos"]
+    calc_props = ["nid", "points", "rel_pos", "rank"]
 
     def __init__(self, part_id=None, race_id=None, pers_id=None):
         """
         A Participant Object is the path: (person)-[:is]->(participant)-[:participates]->(race).
         If participant id is provided, then find race id and person id.
-        If race id and person id are provided, then try to find participant id. If not successful, then create
-        participant id. The application must call the 'add' method to add this participant in the correct sequence.
-        At the end of initialization, participant node, id, race id and person id are set.
+        If race id and person id are provided, then try to find participant id. If not successful, then the participant
+        node is created by the 'add' method, that adds this participant in the correct sequence.
+        At the end of initialization, race id and person id are set, participant node and id if the participant exists.
         When a participant is added or deleted, then the points for the race will be recalculated.
         :param part_id: nid of the participant
         :param race_id: nid of the race
@@ -125,11 +123,6 @@ class Participant:
             self.part_node = ns.get_participant_in_race(pers_id=pers_id, race_id=race_id)
             if self.part_node:
                 self.part_id = self.part_node["nid"]
-            else:
-                # Participant node not found, so create one.
-                # First remember first arrival in the race
-                self.first_arrival_in_race = participant_first_id(race_id)
-                self.part_id = self.set_part_race()
         else:
             logging.fatal("No input provided.")
             raise ValueError("CannotCreateObject")
@@ -173,19 +166,21 @@ class Participant:
         """
         return self.race_id
 
-    def set_part_race(self):
+    def set_part_race(self, **props):
         """
         This method will link the person to the race. This is done by creating an Participant Node. This function will
         not link the participant to the previous or next participant.
         The method will set the participant node and the participant nid.
+        @param props: User properties (pos, remark) for the participant node.
         @return: Node ID of the participant node.
         """
-        self.part_node = ns.create_node("Participant")
-        self.part_id = self.part_node["nid"]
-        race_node = ns.node(self.race_id)
-        ns.create_relation(from_node=self.part_node, rel="participates", to_node=race_node)
-        pers_node = ns.node(self.pers_id)
-        ns.create_relation(from_node=pers_node, rel="is", to_node=self.part_node)
+        with ns.transaction():
+            self.part_node = ns.create_node("Participant", **props)
+            self.part_id = self.part_node["nid"]
+            race_node = ns.node(self.race_id)
+            ns.create_relation(from_node=self.part_node, rel="participates", to_node=race_node)
+            pers_node = ns.node(self.pers_id)
+            ns.create_relation(from_node=pers_node, rel="is", to_node=self.part_node)
         return self.part_id
 
     def set_props(self, **props):
@@ -223,48 +218,86 @@ class Participant:
             ns.create_relation(from_node=next_part_node, rel="after", to_node=prev_part_node)
         return
 
-    def add(self, prev_pers_id=None):
+    def add(self, prev_pers_id=None, **props):
         """
-        This method will add the participant in the chain of arrivals. This is required only if there is more than one
-        participant in the race.
+        This method will add the participant in the chain of arrivals. The participant node is created first, if the
+        person does not participate in the race yet. The chain is required only if there is more than one participant
+        in the race.
         First action will be determined, then the action will be executed.
         Is there a previous arrival (prev_pers_id) for this runner? Remember nid for previous arrival. Else this
         participant is the first arrival.
         Is there a next arrival for this runner? Remove relation between previous and next, remember next.
         Now link current participant to previous arrival and to next arrival.
+        The participant node and the chain of arrivals are changed in a single transaction, so a participant is never
+        left outside of the chain.
         :param prev_pers_id: nid of previous arrival, or -1 if current participant in first arrival
+        :param props: User properties (pos, remark) for a new participant node.
         :return:
         """
-        # Count total number of arrivals. Process required only if there is more than one.
-        nr_participants = len(participant_list(self.race_id))
-        if nr_participants > 1:
-            # Process required only if there is more than one participant in the race
-            if prev_pers_id != "-1":
-                # There is an arrival before current participant
-                # Find participant nid for this person
-                prev_arrival_obj = Participant(race_id=self.race_id, pers_id=prev_pers_id)
-                prev_arrival_nid = prev_arrival_obj.get_id()
-                # This can be linked to a next_arrival. Current participant will break this link
-                next_arrival_nid = prev_arrival_obj.next_runner()
+        with ns.transaction():
+            # Participants in sequence of arrival, before set_part_race(). The first arrival and the number of
+            # arrivals follow from this single query.
+            node_list = ns.get_participant_seq_list(self.race_id) or []
+            nr_participants = len(node_list)
+            if self.part_id == -1:
+                self.set_part_race(**props)
+                nr_participants += 1
+            if nr_participants > 1:
+                # Process required only if there is more than one participant in the race
+                if prev_pers_id != "-1":
+                    # There is an arrival before current participant
+                    # Find participant nid for this person
+                    prev_arrival_obj = Participant(race_id=self.race_id, pers_id=prev_pers_id)
+                    prev_arrival_nid = prev_arrival_obj.get_id()
+                    # This can be linked to a next_arrival. Current participant will break this link
+                    next_arrival_nid = prev_arrival_obj.next_runner()
+                    if next_arrival_nid:
+                        ns.remove_relation(start_nid=next_arrival_nid, end_nid=prev_arrival_nid, rel_type="after")
+                else:
+                    # This participant is the first one in the race. Find the next participant.
+                    prev_arrival_nid = False
+                    next_arrival_nid = node_list[0]["nid"]
+                # Previous and next arrival have been calculated, create relation if required
+                if prev_arrival_nid:
+                    self.set_relation(next_id=self.part_id, prev_id=prev_arrival_nid)
                 if next_arrival_nid:
-                    ns.remove_relation(start_nid=next_arrival_nid, end_nid=prev_arrival_nid, rel_type="after")
+                    self.set_relation(next_id=next_arrival_nid, prev_id=self.part_id)
+                self.set_rank(prev_id=prev_arrival_nid, next_id=next_arrival_nid)
             else:
-                # This participant is the first one in the race. Find the next participant.
-                # Be careful, method 'participant_first_id' requires valid chain. So this needs to run before
-                # set_part_race()
-                prev_arrival_nid = False
-                # Get participant nid for person nid first arrival.
-                next_arrival_obj = Participant(race_id=self.race_id, pers_id=self.first_arrival_in_race)
-                next_arrival_nid = next_arrival_obj.get_id()
-            # Previous and next arrival have been calculated, create relation if required
-            if prev_arrival_nid:
-                self.set_relation(next_id=self.part_id, prev_id=prev_arrival_nid)
-            if next_arrival_nid:
-                self.set_relation(next_id=next_arrival_nid, prev_id=self.part_id)
+                ns.participants_set_attribs([dict(nid=self.part_id, rank=neostore.rank_gap)])
         # Calculate points after adding participant
         points_for_race(self.race_id)
         return
 
+    def set_rank(self, prev_id=None, next_id=None):
+        """
+        This method will set the rank of the participant halfway between the rank of the previous and the next arrival.
+        If there is no room between previous and next arrival, then all participants in the race get a new rank. If the
+        race has not been ranked before, then the rank for all participants is set from the after chain. The participant
+        must be linked in the chain of arrivals already.
+        :param prev_id: nid of the previous arrival, False if this participant is the first arrival.
+        :param next_id: nid of the next arrival, False if this participant is the last arrival.
+        :return:
+        """
+        ranks = ns.get_participant_ranks(self.race_id)
+        rank4part = dict(ranks)
+        if None in [rank for (nid, rank) in ranks if nid != self.part_id]:
+            ns.rank_participants(self.race_id)
+            return
+        prev_rank = rank4part[prev_id] if prev_id else 0
+        if not next_id:
+            rank = prev_rank + neostore.rank_gap
+        elif rank4part[next_id] - prev_rank > 1:
+            rank = (prev_rank + rank4part[next_id]) // 2
+        else:
+            # No room left between previous and next arrival.
+            part_nids = [nid for (nid, rank) in ranks if nid != self.part_id]
+            part_nids.insert(part_nids.index(prev_id) + 1 if prev_id else 0, self.part_id)
+            ns.rank_participants(self.race_id, part_nids)
+            return
+        ns.participants_set_attribs([dict(nid=self.part_id, rank=rank)])
+        return
+
     def prev_runner(self):
         """
         This method will get the node ID for this Participant's previous runner.
@@ -293,11 +326,13 @@ class Participant:
         Recalculate points for the race.
         @return:
         """
-        if self.prev_runner() and self.next_runner():
-            # There is a previous and next runner, link them
-            ns.create_relation(from_node=ns.node(self.next_runner()), rel="after", to_node=ns.node(self.prev_runner()))
-        # Remove Participant Node
-        ns.remove_node_force(self.part_id)
+        with ns.transaction():
+            if self.prev_runner() and self.next_runner():
+                # There is a previous and next runner, link them
+                ns.create_relation(from_node=ns.node(self.next_runner()), rel="after",
+                                   to_node=ns.node(self.prev_runner()))
+            # Remove Participant Node
+            ns.remove_node_force(self.part_id)
         # Reset Object
         self.part_id = -1
         self.part_node = None
@@ -495,18 +530,19 @@ class Organization:
             # No need to register (Organization exist already), and organization attributes are set.
             return False
         else:
-            # Organization on Location and datestamp does not yet exist, register the node.
-            self.org_node = ns.create_node("Organization", name=self.org["name"])
-            # graph.create(self.org_node)  # Node will be created on first Relation creation.
-            # Organization node known, now I can link it with the Location.
-            self.set_location(self.org["location"])
-            # Set Date  for Organization
-            self.set_date(self.org["datestamp"])
-            # Set Organization Type
-            org_type_node = get_org_type_node(org_type)
-            ns.create_relation(from_node=self.org_node, rel="type", to_node=org_type_node)
-            # Set organization parameters by finding the created organization
-            self.find(**org_dict)
+            with ns.transaction():
+                # Organization on Location and datestamp does not yet exist, register the node.
+                self.org_node = ns.create_node("Organization", name=self.org["name"])
+                # graph.create(self.org_node)  # Node will be created on first Relation creation.
+                # Organization node known, now I can link it with the Location.
+                self.set_location(self.org["location"])
+                # Set Date  for Organization
+                self.set_date(self.org["datestamp"])
+                # Set Organization Type
+                org_type_node = get_org_type_node(org_type)
+                ns.create_relation(from_node=self.org_node, rel="type", to_node=org_type_node)
+                # Set organization parameters by finding the created organization
+                self.find(**org_dict)
             return True
 
     def edit(self, **properties):
@@ -523,55 +559,57 @@ class Organization:
         @return: True if the organization has been updated, False if the organization (name, location, date) existed
          already. A change in Organization Type only is also a successful (True) change.
         """
-        # Check Organization Type
-        curr_org_type = self.get_org_type()
-        if not curr_org_type == properties["org_type"]:
-            self.set_org_type(new_org_type=properties["org_type"], curr_org_type=curr_org_type)
-            # Organization type changed, so re-calculate points for all races in the organization
-            racelist = race_list(self.org_id)
-            for rec in racelist:
+        result, org_id = True, self.org_id
+        with ns.transaction():
+            # Check Organization Type
+            curr_org_type = self.get_org_type()
+            org_type_changed = not curr_org_type == properties["org_type"]
+            if org_type_changed:
+                self.set_org_type(new_org_type=properties["org_type"], curr_org_type=curr_org_type)
+            del properties["org_type"]
+            # Check if name, date or location are changed
+            changed_keys = [key for key in sorted(properties) if not (properties[key] == self.org[key])]
+            if len(changed_keys) > 0:
+                # Something is changed, so I need to end-up in unique combination of name, location, date
+                if self.find(**properties):
+                    logging.error("Aangepaste Organisatie bestaat reeds: {props}".format(props=properties))
+                    result = False
+                else:
+                    if 'name' in changed_keys:
+                        node_prop = dict(
+                            name=properties["name"],
+                            nid=self.org_id
+                        )
+                        ns.node_update(**node_prop)
+                    if 'location' in changed_keys:
+                        # Remember current location - before fiddling around with relations!
+                        curr_loc = Location(self.org["location"]).get_node()
+                        curr_loc_id = ns.node_id(curr_loc)
+                        # First create link to new location
+                        self.set_location(properties["location"])
+                        # Then remove link to current location
+                        ns.remove_relation(start_nid=self.org_id, end_nid=curr_loc_id, rel_type="In")
+                        # Finally check if current location is still required. Remove if there are no more links.
+                        ns.remove_node(curr_loc_id)
+                    if 'datestamp' in changed_keys:
+                        # Get Node for current day
+                        curr_ds = self.org["datestamp"]
+                        curr_date_node = ns.find_date_node(curr_ds)
+                        # First create link to new date
+                        self.set_date(properties["datestamp"])
+                        # Then remove link from current date
+                        if curr_date_node:
+                            ns.remove_relation(start_nid=self.org_id, end_nid=curr_date_node["nid"], rel_type="On")
+                        # Finally check if current date (day, month, year) can be removed.
+                        ns.remove_date(curr_ds)
+                    # New attributes configured, now set Organization again.
+                    self.set(self.org_id)
+        if org_type_changed:
+            # Organization type changed, so re-calculate points for all races in the organization.
+            for rec in race_list(org_id):
                 # Probably not efficient, but then you should't change organization type too often.
                 points_for_race(rec["race_id"])
-        del properties["org_type"]
-        # Check if name, date or location are changed
-        changed_keys = [key for key in sorted(properties) if not (properties[key] == self.org[key])]
-        if len(changed_keys) > 0:
-            # Something is changed, so I need to end-up in unique combination of name, location, date
-            if self.find(**properties):
-                logging.error("Aangepaste Organisatie bestaat reeds: {props}".format(props=properties))
-                return False
-            else:
-                if 'name' in changed_keys:
-                    node_prop = dict(
-                        name=properties["name"],
-                        nid=self.org_id
-                    )
-                    ns.node_update(**node_prop)
-                if 'location' in changed_keys:
-                    # Remember current location - before fiddling around with relations!
-                    curr_loc = Location(self.org["location"]).get_node()
-                    curr_loc_id = ns.node_id(curr_loc)
-                    # First create link to new location
-                    self.set_location(properties["location"])
-                    # Then remove link to current location
-                    ns.remove_relation(start_nid=self.org_id, end_nid=curr_loc_id, rel_type="In")
-                    # Finally check if current location is still required. Remove if there are no more links.
-                    ns.remove_node(curr_loc_id)
-                if 'datestamp' in changed_keys:
-                    # Get Node for current day
-                    curr_ds = self.org["datestamp"]
-                    curr_date_node = ns.date_node(curr_ds)
-                    # First create link to new date
-                    self.set_date(properties["datestamp"])
-                    # Then remove link from current date
-                    ns.remove_relation(start_nid=self.org_id, end_nid=ns.node_id(curr_date_node), rel_type="On")
-                    # Finally check if date (day, month, year) can be removed.
-                    # Don't remove single date, clear all dates that can be removed. This avoids the handling of key
-                    # because date nodes don't have a nid.
-                    ns.clear_date()
-                # New attributes configured, now set Organization again.
-                self.set(self.org_id)
-        return True
+        return result
 
     def set(self, org_id):
         """
@@ -818,17 +856,18 @@ class Race:
             # No need to register (Race exist already).
             return False
         else:
-            # Race for Organization does not yet exist, register it.
-            props = {
-                "name": name
-            }
-            race_node = ns.create_node("Race", **props)
-            self.race_id = race_node["nid"]
-            org_node = ns.node(self.org_id)
-            ns.create_relation(from_node=org_node, rel="has", to_node=race_node)
-            set_race_type(race_id=ns.node_id(race_node), race_type_node=racetype_node)
-            # Set organization parameters by finding the created organization
-            self.find(racetype_id)
+            with ns.transaction():
+                # Race for Organization does not yet exist, register it.
+                props = {
+                    "name": name
+                }
+                race_node = ns.create_node("Race", **props)
+                self.race_id = race_node["nid"]
+                org_node = ns.node(self.org_id)
+                ns.create_relation(from_node=org_node, rel="has", to_node=race_node)
+                set_race_type(race_id=ns.node_id(race_node), race_type_node=racetype_node)
+                # Set organization parameters by finding the created organization
+                self.find(racetype_id)
             return True
 
     def edit(self, name):
@@ -925,6 +964,74 @@ class Location:
         return node
 
 
+class Standings:
+    """
+    This class keeps the standings per category (Dames, Heren) in memory, so the result pages don't need to collect and
+    aggregate all participations on every page view. The standings of a category are loaded from the database on first
+    request, with the data version of the store. They are loaded again on the first request after the data version
+    changed. This way changes from other processes (e.g. a script in Tools) are seen and changes that are rolled back
+    are never seen.
+    The standings are not maintained incrementally on every participant change, since points of a race depend on all
+    participants in the race. A category is loaded again as a whole on a new data version instead. The load runs
+    outside of the lock, the new result is swapped in under the lock. So requests for a current result or for the
+    other category never wait for a load.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Dictionary with category as key, value is tuple (data version, sorted result list).
+        self.results = {}
+
+    def clear(self):
+        """
+        This method will forget all standings. They will be loaded from the database on next request.
+        :return:
+        """
+        with self.lock:
+            self.results = {}
+        return
+
+    @staticmethod
+    def load(cat):
+        """
+        This method will load standings for a category from the database.
+        :param cat: Category (Dames, Heren)
+        :return: Sorted list with lists (name, points, number of races, nid for person).
+        """
+        persons = {}
+        for rec in ns.points_per_category(cat):
+            try:
+                persons[rec["nid"]]["points"].append(rec["points"])
+            except KeyError:
+                persons[rec["nid"]] = dict(name=rec["name"], points=[rec["points"]])
+        result_total = [[person["name"], points_sum(person["points"]), len(person["points"]), nid]
+                        for (nid, person) in persons.items()]
+        return sorted(result_total, key=lambda x: -x[1])
+
+    def get(self, cat):
+        """
+        This method will return the standings for the category. The standings are loaded only if the data version
+        changed since the previous load.
+        :param cat: Category (Dames, Heren)
+        :return: Sorted list with lists (name, points, number of races, nid for person). The list is shared between
+        callers and must not be modified.
+        """
+        # The version is taken before the load, a change during the load gives a new load on next request.
+        version = ns.get_data_version()
+        with self.lock:
+            loaded = self.results.get(cat)
+        if loaded and loaded[0] == version:
+            return loaded[1]
+        # Requests that arrive during the load, load too. The result is the same for the same version.
+        result = self.load(cat)
+        with self.lock:
+            self.results[cat] = (version, result)
+        return result
+
+
+standings = Standings()
+
+
 def organization_list():
     """
     This function will return a list of organizations. Each item in the list is a dictionary with fields date,
@@ -938,8 +1045,8 @@ def organization_list():
 def organization_delete(org_id=None):
     """
     This method will delete an organization. This can be done only if there are no more races attached to the
-    organization. If an organization is removed, then check is done for orphan date and orphan location. If available,
-    these will also be removed.
+    organization. If an organization is removed, then check is done for orphan date (the date of the organization) and
+    orphan location. If available, these will also be removed.
     @param org_id:
     @return:
     """
@@ -947,12 +1054,15 @@ def organization_delete(org_id=None):
         logging.info("Organization with id {org_id} cannot be removed, races are attached.".format(org_id=org_id))
         return False
     else:
-        # Remove Organization
+        # Remember the date of the organization, then remove Organization
+        date_id = ns.get_end_node(start_node_id=org_id, rel_type="On")
+        date_node = ns.node(date_id) if date_id else False
         logging.debug("trying to remove org")
         ns.remove_node_force(org_id)
-        # Check if this results in orphan dates, remove these dates
+        # Check if this results in an orphan date, remove this date
         logging.debug("Then trying to remove date")
-        ns.clear_date()
+        if date_node:
+            ns.remove_date(date_node["key"])
         # Check if this results in orphan locations, remove these locations.
         logging.debug("Trying to delete organization")
         ns.clear_locations()
@@ -1087,6 +1197,19 @@ def races4person_org(pers_id):
     return race_org
 
 
+def results4person_org(cat):
+    """
+    This method will get the result for every person in the category on every organization. It is the data for the
+    Results Overview page, collected in one query instead of races4person_org for every person.
+
+    :param cat: Category (Dames or Heren)
+
+    :return: Dictionary with key person nid and value dictionary with key org_nid and value dictionary of race name
+    and participant pos and points.
+    """
+    return ns.get_overview(cat)
+
+
 def race_delete(race_id=None):
     """
     This method will delete a race. This can be done only if there are no more participants attached to the
@@ -1110,17 +1233,14 @@ def person_list(nr_races=None):
     @param nr_races: if True then add number of races for the person to the list.
     @return: List of persons objects. Each person is represented in a list with nid and name of the person.
     """
+    if nr_races:
+        # Aggregated in and sorted by the database, no query per person.
+        return ns.get_persons_nr_races()
     res = ns.get_nodes('Person')
     person_arr = []
     for node in res:
-        attribs = [node["nid"], node["name"]]
-        if nr_races:
-            attribs.append(len(ns.get_race4person(person_id=node["nid"])))
-        person_arr.append(attribs)
-    if nr_races:
-        person_arr.sort(key=lambda x: -x[2])
-    else:
-        person_arr.sort(key=lambda x: x[1])
+        person_arr.append([node["nid"], node["name"]])
+    person_arr.sort(key=lambda x: x[1])
     return person_arr
 
 
@@ -1144,18 +1264,108 @@ def person4participant(part_id):
 
 def participant_list(race_id):
     """
-    Returns the list of participants in hash of id, name.
+    Returns the list of participants in hash of id, name. The persons are collected in a single query.
     @param race_id: ID of the race for which current participants are returned
     @return: List of Person Objects. Each person object is represented as a list with id, name of the participant.
     """
-    res = ns.get_start_nodes(end_node_id=race_id, rel_type="participates")
-    part_arr = []
-    for part_nid in res:
-        person_nid = ns.get_start_node(end_node_id=part_nid, rel_type="is")
-        person_node = ns.node(person_nid)
-        attribs = [person_node["nid"], person_node["name"]]
-        part_arr.append(attribs)
-    return part_arr
+    return [[rec["pers_nid"], rec["name"]] for rec in ns.get_cat4race(race_id).values()]
+
+
+def decode_csv(data):
+    """
+    This method will decode the contents of a csv file. The file is utf-8, with or without byte order mark. Excel on
+    Windows saves a csv file in cp1252, so this is tried next.
+
+    :param data: Contents of the csv file (bytes).
+
+    :return: Text of the file. UnicodeDecodeError is raised if the file is not utf-8 and not cp1252.
+    """
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1252")
+
+
+def finishers_from_csv(lines):
+    """
+    This method will read a finish list in csv format. Columns are person (nid or name), pos and remark, only person is
+    mandatory. A header line with first column 'person' is optional. Delimiter can be comma, semicolon or tab.
+
+    :param lines: Lines of the csv file.
+
+    :return: List of dictionaries with keys person, pos and remark, in sequence of the file.
+    """
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return []
+    try:
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = []
+    for rec in csv.reader(lines, dialect):
+        values = [value.strip() for value in rec]
+        if not rows and values[0].lower() == "person":
+            continue
+        rows.append(dict(zip(["person", "pos", "remark"], values)))
+    return rows
+
+
+def participants_import(race_id, rows):
+    """
+    This method will add a list of finishers to the race, in sequence of arrival. The finishers are added after the
+    last participant in the race. Participant nodes and the chain of arrivals are created in one transaction, points
+    for the race are calculated once at the end.
+    The list is checked first, in the transaction: every person must exist (nid or name) and must not participate in
+    the organization yet. If there are errors, then no participant is added.
+
+    :param race_id: nid of the race.
+
+    :param rows: List of dictionaries in sequence of arrival, with key person (nid or name of the person) and optional
+    keys pos and remark.
+
+    :return: tuple with the number of participants added and the list of error messages.
+    """
+    if not neostore.validate_node(ns.node(race_id), "Race"):
+        return 0, ["Race {nid} not found".format(nid=race_id)]
+    with ns.transaction():
+        # Persons that can be added to the race, with nid as key and name as value. This is checked in the
+        # transaction, so a participant that is added in the meantime is not added again.
+        available = dict(ns.get_next_participants(race_id))
+        nid4name = {name: nid for (nid, name) in available.items()}
+        errors = []
+        part_rows = []
+        pers_nids = set()
+        for (linenr, row) in enumerate(rows, start=1):
+            person = str(row.get("person") or "").strip()
+            pers_nid = person if person in available else nid4name.get(person)
+            if not pers_nid:
+                errors.append("Line {n}: {p} is not a person or participates in the organization already"
+                              .format(n=linenr, p=person))
+            elif pers_nid in pers_nids:
+                errors.append("Line {n}: {p} is in the list already".format(n=linenr, p=person))
+            else:
+                pers_nids.add(pers_nid)
+                props = {prop: row[prop] for prop in ["pos", "remark"] if row.get(prop)}
+                part_rows.append(dict(pers_nid=pers_nid, props=props))
+        if errors:
+            return 0, errors
+        if not part_rows:
+            return 0, []
+        # New finishers arrive after the last participant in the race.
+        node_list = ns.get_participant_seq_list(race_id)
+        if node_list:
+            prev_part_id = node_list[-1]["nid"]
+            rank = node_list[-1]["rank"]
+        else:
+            prev_part_id = None
+            rank = 0
+        for row in part_rows:
+            rank += neostore.rank_gap
+            row["props"]["rank"] = rank
+        ns.add_participants(race_id, part_rows, prev_part_id=prev_part_id)
+    points_for_race(race_id)
+    return len(part_rows), []
 
 
 def get_cat4part(part_nid):
@@ -1202,14 +1412,12 @@ def points_for_race(race_id):
         points_deelname(race_id)
     else:
         org_id = race_obj.get_org_id()
-        races = get_races_for_org(org_id=org_id)
-        for rid in races:
-            r_obj = Race(race_id=rid)
-            r_type = r_obj.get_racetype()
-            if r_type == "Hoofdwedstrijd":
-                points_hoofdwedstrijd(rid)
+        # The race list has the race type for every race, no need to get the Race objects.
+        for rec in race_list(org_id):
+            if rec["type"] == "Hoofdwedstrijd":
+                points_hoofdwedstrijd(rec["race_id"])
             else:
-                points_bijwedstrijd(rid)
+                points_bijwedstrijd(rec["race_id"])
     return
 
 
@@ -1218,6 +1426,7 @@ def points_bijwedstrijd(race_id):
     This method will assign points to participants in a race for type 'Bijwedstrijd'. It will add 'bijwedstrijd' points
     to every participant. Participant list is sufficient, sequence list is not required. But this function does not
     exist (I think).
+    Categories for all participants are collected in one query and points are written in one statement.
     :param race_id:
     :return:
     """
@@ -1235,18 +1444,17 @@ def points_bijwedstrijd(race_id):
     d_points = points_position(d_rel_pos)
     m_points = points_position(m_rel_pos)
     # Now add points for everyone in the race.
-    node_list = ns.get_participant_seq_list(race_id)
-    if node_list:
-        for part in node_list:
-            mf = get_cat4part(part["nid"])
-            if mf == "Heren":
-                points = m_points
-                rel_pos = m_rel_pos
-            else:
-                points = d_points
-                rel_pos = d_rel_pos
-            props = dict(nid=part["nid"], points=points, rel_pos=rel_pos)
-            ns.node_set_attribs(**props)
+    cat4part = ns.get_cat4race(race_id)
+    rows = []
+    for part_nid in cat4part:
+        if cat4part[part_nid]["cat"] == "Heren":
+            points = m_points
+            rel_pos = m_rel_pos
+        else:
+            points = d_points
+            rel_pos = d_rel_pos
+        rows.append(dict(nid=part_nid, points=points, rel_pos=rel_pos))
+    ns.participants_set_attribs(rows)
     return
 
 
@@ -1255,37 +1463,40 @@ def points_hoofdwedstrijd(race_id):
     This method will assign points to participants in a race. It gets the participant nids in sequence of arrival. For
     each participant, it will extract Category (Dames, Heren) then assign points for the participant.
     This method should be called for 'Hoofdwedstrijd' only.
+    Categories for all participants are collected in one query and points are written in one statement.
     :param race_id:
     :return:
     """
     cnt = dict(Dames=0, Heren=0)
     node_list = ns.get_participant_seq_list(race_id)
     if node_list:
+        cat4part = ns.get_cat4race(race_id)
+        rows = []
         for part in node_list:
-            mf = get_cat4part(part["nid"])
+            mf = cat4part.get(part["nid"], {}).get("cat")
+            if mf not in cnt:
+                logging.error("No category for participant {nid}, no points assigned.".format(nid=part["nid"]))
+                continue
             cnt[mf] += 1
             points = points_position(cnt[mf])
             rel_pos = cnt[mf]
             # Set points for participant
-            props = dict(nid=part["nid"], points=points, rel_pos=rel_pos)
-            ns.node_set_attribs(**props)
+            rows.append(dict(nid=part["nid"], points=points, rel_pos=rel_pos))
+        ns.participants_set_attribs(rows)
     return
 
 
 def points_deelname(race_id):
     """
     This method will assign points to participants in a race for type 'Deelname'. It will add 'deelname' points to
-    every participant. Participant list is sufficient, sequence list is not required. But this function does not
-    exist (I think).
+    every participant. Participant list is sufficient, sequence list is not required.
     :param race_id:
     :return:
     """
-    node_list = ns.get_participant_seq_list(race_id)
+    cat4part = ns.get_cat4race(race_id)
     points = 20
-    if node_list:
-        for part in node_list:
-            props = dict(nid=part["nid"], points=points)
-            ns.node_set_attribs(**props)
+    rows = [dict(nid=part_nid, points=points) for part_nid in cat4part]
+    ns.participants_set_attribs(rows)
     return
 
 
@@ -1298,11 +1509,9 @@ def points_sum(point_list):
 
     :return: sum of the points
     """
-    nr_races = 7
-    add_points_per_race = 10
-    max_list = sorted(point_list)[-nr_races:]
-    if len(point_list) > nr_races:
-        add_points = (len(point_list) - nr_races) * add_points_per_race
+    max_list = sorted(point_list)[-points_best_races:]
+    if len(point_list) > points_best_races:
+        add_points = (len(point_list) - points_best_races) * add_points_per_race
     else:
         add_points = 0
     points = sum(max_list) + add_points
@@ -1311,36 +1520,20 @@ def points_sum(point_list):
 
 def results_for_category(cat):
     """
-    This method will calculate the points for all participants in a category. Split up in points for wedstrijd and
-    points for deelname at this point.
+    This method will return the points for all participants in a category. The standings are kept in the standings
+    object for the data version, so no need to collect all participations on every call.
 
     :param cat: Category to calculate the points
 
-    :return: Sorted list with tuples (name, points, number of races, nid for person).
-    """
-    res = ns.points_per_category(cat)
-    # 1. Add points to list per person
-    result_list = {}
-    result_total = []
-    nid4name = {}
-    while res.forward():
-        rec = res.current()
-        # Remember the nid for this participant.
-        nid4name[rec["name"]] = rec["nid"]
-        try:
-            result_list[rec["name"]].append(rec["points"])
-        except KeyError:
-            result_list[rec["name"]] = [rec["points"]]
-    # 2. Calculate points per person
-    for name in result_list:
-        result_total.append([name, points_sum(result_list[name]), len(result_list[name]), nid4name[name]])
-    result_sorted = sorted(result_total, key=lambda x: -x[1])
-    return result_sorted
+    :return: Sorted list with lists (name, points, number of races, nid for person).
+    """
+    return standings.get(cat)
 
 
 def participant_seq_list(race_id):
     """
-    This method will collect the people in a race in sequence of arrival.
+    This method will collect the people in a race in sequence of arrival. The participants and the persons are
+    collected in two queries, independent of the number of participants.
 
     :param race_id: nid of the race for which the participants are returned in sequence of arrival.
 
@@ -1350,14 +1543,13 @@ def participant_seq_list(race_id):
     """
     node_list = ns.get_participant_seq_list(race_id)
     if node_list:
+        cat4part = ns.get_cat4race(race_id)
         finisher_list = []
-        # If there are finishers, then recordlist has one element, which is a nodelist
         for part in node_list:
-            part_obj = Participant(part_id=part["nid"])
-            person_obj = Person(person_id=part_obj.get_person_nid())
-            person_dict = person_obj.get_dict()
-            pers_part_tuple = (person_dict, dict(part))
-            finisher_list.append(pers_part_tuple)
+            person = cat4part[part["nid"]]
+            # A person with a participation is active, see Person.active().
+            person_dict = dict(nid=person["pers_nid"], label=person["name"], active=True)
+            finisher_list.append((person_dict, dict(part)))
         return finisher_list
     else:
         return False
@@ -1422,18 +1614,8 @@ def next_participant(race_id):
     @param race_id:
     @return: List of the Person objects (Person nid and Person name) that can be selected as participant in the race.
     """
-    # Todo: extend to participants that have been selected for this organization (one participation per race per org.)
-    # Get Organization for this race
-    # org_id = get_org_id(race_id)
-    org_id = get_org_id(race_id)
-    races = get_races_for_org(org_id)
-    participants = []
-    for race_id in races:
-        parts_race = participant_list(race_id)
-        participants += parts_race
-    persons = person_list()
-    next_participants = [part for part in persons if part not in participants]
-    return next_participants
+    # The anti-join on the organization is done in the database, in one query.
+    return ns.get_next_participants(race_id)
 
 
 def racetype_list():
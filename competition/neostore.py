@@ -2,37 +2,300 @@
 This class consolidates functions related to the neo4J datastore.
 """
 
+import gzip
+import itertools
+import json
 import logging
 import os
 import sys
+import threading
+import time
 import uuid
+from contextlib import contextmanager
 from datetime import datetime, date
+from functools import lru_cache
 from pandas import DataFrame
 from py2neo import Graph, Node, Relationship, NodeSelector
 from py2neo.database import DBMS
 from py2neo.ext.calendar import GregorianCalendar
+from competition.cypher import statements, nid_labels, node_label
+from lib import my_env
 # from py2neo import watch
 
 
 # watch("neo4j.http")
 
+# Modules of the store. The caller of a slow statement is the first frame outside of these modules.
+store_modules = ["competition.neostore", "competition.memstore", "competition.sqlstore", "contextlib"]
+# Parameters that are not written to the slow query log.
+secret_params = ["pwd", "password"]
+# Kinds of store calls that change the data, next to the write statements from the registry. Date nodes that the
+# calendar creates are pushed, so the calendar lookup itself is not a change.
+write_kinds = ["create", "merge", "push"]
+
+# Gap between the rank of consecutive participants in a race. A participant that is added between two others gets the
+# rank halfway, so a race needs to be ranked again only after a number of additions on the same place.
+rank_gap = 1024
+
+# Snapshot file format, see method export_snapshot.
+snapshot_format = "flrun-snapshot"
+snapshot_version = 1
+
+
+def params_shape(params):
+    """
+    This function returns the shape of statement parameters for the query log: the type of every value, with the length
+    for lists. Values are not logged.
+    :param params: Dictionary with the parameters.
+    :return: Dictionary with the parameter names as key and the shape as value.
+    """
+    shape = {}
+    for (key, value) in (params or {}).items():
+        if isinstance(value, (list, tuple)):
+            shape[key] = "{t}[{n}]".format(t=type(value).__name__, n=len(value))
+        else:
+            shape[key] = type(value).__name__
+    return shape
+
+
+@lru_cache(maxsize=None)
+def write_statement(stmt_name):
+    """
+    This function checks if a statement from the registry changes the data.
+    @param stmt_name: Name of the statement in the registry.
+    @return: True if the statement has a CREATE, MERGE, SET, DELETE or REMOVE clause.
+    """
+    words = statements.get(stmt_name, "").upper().split()
+    return any(word in words for word in ["CREATE", "MERGE", "SET", "DELETE", "DETACH", "REMOVE"])
+
+
+def query_caller():
+    """
+    This function returns the function that called the store, as module.function:line. This is the first frame on the
+    stack outside of the store modules.
+    :return: Calling function, or None if it could not be found.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__") not in store_modules:
+            return "{m}.{f}:{l}".format(m=frame.f_globals.get("__name__"), f=frame.f_code.co_name, l=frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+
+class LoggedCursor:
+    """
+    This class wraps a py2neo Cursor while the query log is active. The records that are read from the cursor and the
+    time spent reading them are added to the query log record of the statement.
+    """
+
+    def __init__(self, cursor, rec):
+        self.cursor = cursor
+        self.rec = rec
+        self.rec["rows"] = 0
+
+    def timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.rec["ms"] += (time.perf_counter() - start) * 1000
+
+    def __iter__(self):
+        while self.forward():
+            yield self.current()
+
+    def forward(self, amount=1):
+        moved = self.timed(self.cursor.forward, amount)
+        self.rec["rows"] += moved
+        return moved
+
+    def current(self):
+        return self.cursor.current()
+
+    def next(self):
+        if self.forward():
+            return self.current()
+        raise StopIteration()
+
+    __next__ = next
+
+    def data(self):
+        res = self.timed(self.cursor.data)
+        self.rec["rows"] += len(res)
+        return res
+
+    def evaluate(self, field=0):
+        res = self.timed(self.cursor.evaluate, field)
+        if res is not None:
+            self.rec["rows"] += 1
+        return res
+
 
 class NeoStore:
 
+    # Statements that take longer than slow_query_ms are written to the slow query log, None to disable the log.
+    slow_query_ms = None
+    # Profile slow statements from the registry: read statements are run again with PROFILE, write statements are
+    # explained only.
+    slow_query_profile = False
+    # Seconds between two reads of the last committed transaction id, see get_data_version.
+    data_version_seconds = 1
+    # Labels that every node gets on creation, see module cypher.
+    shared_labels = [node_label]
+
     def __init__(self, **neo4j_params):
         """
-        Method to instantiate the class in an object for the neostore.
+        Method to instantiate the class in an object for the neostore. The connection to Neo4J is not made here, but
+        on first use of the graph. The object can be shared by all threads: the connection is made once under a lock,
+        transactions, node cache and query log are kept per thread.
 
         :param neo4j_params: dictionary with Neo4J User, Pwd and Database. If host is not default localhost, it also
-        needs to be defined in the dictionary.
+        needs to be defined in the dictionary. If no parameters are given, then these are read from the environment
+        variables Neo4J_User, Neo4J_Pwd, Neo4J_Db and Neo4J_Host at the moment of connecting.
 
         :return: Object to handle neostore commands.
         """
-        self.graph = self.connect2db(**neo4j_params)
-        self.calendar = GregorianCalendar(self.graph)
-        self.selector = NodeSelector(self.graph)
+        self.neo4j_params = neo4j_params
+        self.lock = threading.Lock()
+        self._graph = None
+        self._calendar = None
+        self._selector = None
+        # Day nodes with the key (YYYY-MM-DD) of the date as key. Date nodes are shared by all threads and are not
+        # created in the transaction of the thread.
+        self.date_cache = {}
+        # Thread local storage, for the node cache and the query log that are valid for a single request.
+        self.local = threading.local()
+        self.init_data_version()
+        return
+
+    def init_app(self, app):
+        """
+        This method will configure the neostore from the application configuration. An existing connection is dropped,
+        a new connection will be made on first use.
+
+        :param app: Flask application object.
+
+        :return:
+        """
+        neo4j_params = dict(
+            user=app.config.get('NEO4J_USER'),
+            password=app.config.get('NEO4J_PWD'),
+            db=app.config.get('NEO4J_DB')
+        )
+        host = app.config.get('NEO4J_HOST')
+        if isinstance(host, str):
+            neo4j_params['host'] = host
+        with self.lock:
+            self.neo4j_params = neo4j_params
+            self._graph = None
+            self.date_cache = {}
+        self.new_data_version()
+        self.init_slow_query_log(app)
+        return
+
+    def init_slow_query_log(self, app):
+        """
+        This method will configure the slow query log from the application configuration: threshold in ms
+        (SLOW_QUERY_MS) and profile of slow statements (SLOW_QUERY_PROFILE). The slow query log is a separate rotating
+        file in the log directory.
+
+        :param app: Flask application object.
+
+        :return:
+        """
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS')
+        self.slow_query_profile = app.config.get('SLOW_QUERY_PROFILE', False)
+        if self.slow_query_ms is not None:
+            my_env.init_file_logger("slow_query", __name__, app.config.get('LOGDIR'))
         return
 
+    def connect(self):
+        """
+        This method will connect to the Neo4J database if there is no connection yet. Calendar and selector objects
+        are created with the connection. The lock makes sure that only one thread connects.
+
+        :return: Graph object.
+        """
+        with self.lock:
+            if self._graph is None:
+                neo4j_params = self.neo4j_params
+                if not neo4j_params:
+                    neo4j_params = dict(
+                        user=os.environ.get('Neo4J_User'),
+                        password=os.environ.get('Neo4J_Pwd'),
+                        db=os.environ.get('Neo4J_Db')
+                    )
+                    host = os.environ.get('Neo4J_Host')
+                    if isinstance(host, str):
+                        neo4j_params['host'] = host
+                graph = self.connect2db(**neo4j_params)
+                self.set_node_labels(graph)
+                self._calendar = GregorianCalendar(graph)
+                self._selector = NodeSelector(graph)
+                self._graph = graph
+            return self._graph
+
+    @property
+    def graph(self):
+        graph = self._graph
+        if graph is None:
+            graph = self.connect()
+        return graph
+
+    @property
+    def calendar(self):
+        if self._graph is None:
+            self.connect()
+        return self._calendar
+
+    @property
+    def selector(self):
+        if self._graph is None:
+            self.connect()
+        return self._selector
+
+    @staticmethod
+    def set_node_labels(graph, batch=1000):
+        """
+        This method will give the Node label to the nodes with a nid that do not have the label yet. This is for
+        databases from before the Node label, it is done on connect so that lookups on nid find all nodes. The nodes
+        are labeled in batches per label (cypher.nid_labels).
+
+        :param graph: Graph object of the new connection.
+
+        :param batch: Maximum number of nodes per statement.
+
+        :return: count of number of nodes that got the label.
+        """
+        graph.run("CREATE CONSTRAINT ON (n:{label}) ASSERT n.nid IS UNIQUE".format(label=node_label))
+        cnt = 0
+        for label in nid_labels:
+            while True:
+                set_cnt = graph.run(statements["set_node_label_" + label.lower()], batch=batch).evaluate() or 0
+                cnt += set_cnt
+                if set_cnt < batch:
+                    break
+        if cnt:
+            logging.info("{cnt} nodes got label {label}".format(cnt=cnt, label=node_label))
+        return cnt
+
+    def ping(self):
+        """
+        This method is the health check on the connection. If the database does not respond, then the connection is
+        dropped so that the next statement will connect again.
+
+        :return: True if the database responds, False otherwise.
+        """
+        try:
+            self.run("ping").evaluate()
+        except Exception as exc:
+            logging.error("Neo4J health check failed: {exc}".format(exc=exc))
+            with self.lock:
+                self._graph = None
+            return False
+        return True
+
     @staticmethod
     def connect2db(**neo4j_params):
         """
@@ -74,10 +337,7 @@ class NeoStore:
         """
         # Note that you could DETACH DELETE location nodes here, but then you miss the opportunity to log what is
         # removed.
-        query = """
-            MATCH (loc:Location) WHERE NOT (loc)--() RETURN loc.nid as loc_nid, loc.city as city
-        """
-        res = self.graph.run(query).data()
+        res = self.run("orphan_locations").data()
         for locs in res:
             logging.info("Remove location {city} with nid {loc_nid}".format(city=locs['city'], loc_nid=locs['loc_nid']))
             self.remove_node(locs['loc_nid'])
@@ -93,8 +353,12 @@ class NeoStore:
         :return: Node that has been created.
         """
         props['nid'] = str(uuid.uuid4())
-        component = Node(*labels, **props)
-        self.graph.create(component)
+        component = Node(*(list(labels) + self.shared_labels), **props)
+        with self.query_timer("create", ":".join(labels), props):
+            self.db().create(component)
+        node_cache = self.node_cache()
+        if node_cache is not None:
+            node_cache[props['nid']] = component
         return component
 
     def create_node_no_nid(self, *labels, **props):     # pragma: no cover
@@ -107,7 +371,8 @@ class NeoStore:
         @return: Node that has been created.
         """
         component = Node(*labels, **props)
-        self.graph.create(component)
+        with self.query_timer("create", ":".join(labels), props):
+            self.db().create(component)
         return component
 
     def create_relation(self, from_node=None, rel=None, to_node=None):
@@ -118,8 +383,8 @@ class NeoStore:
         @param to_node: End node for the relation
         @return:
         """
-        rel = Relationship(from_node, rel, to_node)
-        self.graph.merge(rel)
+        with self.query_timer("merge", rel):
+            self.db().merge(Relationship(from_node, rel, to_node))
         return
 
     def clear_date_node(self, label):
@@ -128,16 +393,29 @@ class NeoStore:
         deleted if not used anymore. So it can have only one incoming relation: DAY - MONTH or YEAR.
         Therefore find all relations. If there is only one, then the date node can be deleted.
         @param label: Day, Month or Year
-        @return:
+        @return: Number of date nodes that have been removed.
         """
         logging.info("Clearing all date nodes with label {l}".format(l=label))
-        query = """
-            MATCH (n:{label})-[rel]-()
-            WITH n, count(rel) as rel_cnt
-            WHERE rel_cnt=1
-            DETACH DELETE n
-        """.format(label=label.capitalize())
-        self.graph.run(query)
+        cnt = self.run("clear_" + label.lower()).evaluate() or 0
+        # Date nodes are removed without knowing the nid, so the node and date caches can no longer be trusted.
+        self.clear_node_cache()
+        self.evict_date()
+        return cnt
+
+    def evict_date(self, key=None):
+        """
+        This method will remove a day from the date cache, after the date node has been removed. The date cache is shared
+        by all threads, so in a transaction the day is removed after the commit. Before the commit, another thread can
+        still find the date node and put it in the cache again.
+        @param key: Calendar key 'YYYY-MM-DD' of the day, or None to clear the date cache.
+        @return:
+        """
+        if getattr(self.local, "tx", None) is not None:
+            self.local.evict_dates = getattr(self.local, "evict_dates", []) + [key]
+        elif key is None:
+            self.date_cache.clear()
+        else:
+            self.date_cache.pop(key, None)
         return
 
     def clear_date(self):
@@ -157,35 +435,99 @@ class NeoStore:
         self.clear_date_node("Year")
         return
 
+    def remove_date(self, ds):
+        """
+        This method will remove the date if it is not used anymore: the Day node is removed if it has no relation other
+        than the one from the Month, then the Month and the Year are checked the same way. Only the date chain of this
+        date is checked, compare with method clear_date that checks all dates.
+        @param ds: datetime.date representation of the date, or Calendar key 'YYYY-MM-DD'.
+        @return: Number of date nodes that have been removed.
+        """
+        ds = to_date(ds)
+        if not ds:
+            return 0
+        cnt = 0
+        for (label, key) in [("Day", "%Y-%m-%d"), ("Month", "%Y-%m"), ("Year", "%Y")]:
+            if not self.run("remove_" + label.lower(), key=ds.strftime(key)).evaluate():
+                # Date node is still in use, so are the nodes higher in the chain.
+                break
+            cnt += 1
+        if cnt:
+            self.evict_date(ds.strftime("%Y-%m-%d"))
+        self.clear_node_cache()
+        return cnt
+
     def clear_store(self):      # pragma: no cover
         """
         This method will remove all nodes and relations in a datastore. It should be used during tests only.
         :return:
         """
-        query = "MATCH (n) DETACH DELETE n"
-        self.graph.run(query)
+        self.run("clear_store")
+        self.clear_node_cache()
+        self.date_cache.clear()
         return
 
+    def db(self):
+        """
+        This method returns the object to send statements to. This is the transaction of the current thread if a
+        transaction is open, the graph otherwise. Both have the methods run, create, merge, push and exists.
+
+        :return: py2neo Transaction or Graph object.
+        """
+        tx = getattr(self.local, "tx", None)
+        if tx is not None:
+            return tx
+        return self.graph
+
     def date_node(self, ds):
         """
         This method will get a datetime.date timestamp and return the associated node. The calendar module will
-        ensure that the node is created if required.
+        ensure that the node is created if required. Day nodes are cached on key, so the calendar is called only for
+        dates that have not been used before.
+        A nid is set on the Year, Month and Day node if the calendar has created the node.
         @param ds: datetime.date representation of the date, or Calendar key 'YYYY-MM-DD'.
         @return: node associated with the date, of False (ds could not be formatted as a date object).
         """
-        # If date format is string, convert to datetime object
-        if isinstance(ds, str):
-            try:
-                ds = datetime.strptime(ds, '%Y-%m-%d').date()
-            except ValueError:
-                return False
-        if isinstance(ds, date):
-            date_node = self.calendar.date(ds.year, ds.month, ds.day).day   # Get Date (day) node
-            # Check if a new node has been created and nid is set
-            self.get_nodes_no_nid()
-            return date_node
-        else:
+        ds = to_date(ds)
+        if not ds:
             return False
+        key = ds.strftime("%Y-%m-%d")
+        try:
+            return self.date_cache[key]
+        except KeyError:
+            pass
+        with self.query_timer("calendar", "date"):
+            cal_date = self.calendar.date(ds.year, ds.month, ds.day)
+        # Nodes that have been created by the calendar don't have a nid yet.
+        new_nodes = [node for node in [cal_date.year, cal_date.month, cal_date.day] if node["nid"] is None]
+        if new_nodes:
+            for node in new_nodes:
+                node["nid"] = str(uuid.uuid4())
+                node.add_label(node_label)
+            with self.query_timer("push", "date"):
+                self.graph.push(cal_date)
+        self.date_cache[key] = cal_date.day
+        return cal_date.day
+
+    def find_date_node(self, ds):
+        """
+        This method will get the node associated with the date, without creating the node if it does not exist.
+        @param ds: datetime.date representation of the date, or Calendar key 'YYYY-MM-DD'.
+        @return: node associated with the date, or False if there is no node for the date.
+        """
+        ds = to_date(ds)
+        if not ds:
+            return False
+        key = ds.strftime("%Y-%m-%d")
+        try:
+            return self.date_cache[key]
+        except KeyError:
+            pass
+        date_node = self.run("day_node", key=key).evaluate()
+        if not date_node:
+            return False
+        self.date_cache[key] = date_node
+        return date_node
 
     def get_end_node(self, start_node_id=None, rel_type=None):
         """
@@ -200,23 +542,17 @@ class NeoStore:
 
         :return: Node ID (integer) of the end Node, or False.
         """
-        # First get Node from end node ID
-        start_node = self.node(start_node_id)
-        if start_node:
-            # Then get relation to end node.
-            try:
-                rel = next(item for item in self.graph.match(start_node=start_node, rel_type=rel_type))
-            except StopIteration:
+        res = self.get_neighbour(start_node_id, rel_type=rel_type, direction="out")
+        if res:
+            (end_node_id, cnt) = res
+            if cnt == 0:
                 logging.warning("No end node found for start node ID: {nid} and relation: {rel}"
                                 .format(nid=start_node_id, rel=rel_type))
                 return False
-            else:
-                # Check if there are more elements in the iterator.
-                if len([item for item in self.graph.match(start_node=start_node, rel_type=rel_type)]) > 1:
-                    logging.warning("More than one end node found for start node ID {nid} and relation {rel},"
-                                    " returning first".format(nid=start_node_id, rel=rel_type))
-                end_node_id = self.node_id(rel.end_node())
-                return end_node_id
+            elif cnt > 1:
+                logging.warning("More than one end node found for start node ID {nid} and relation {rel},"
+                                " returning first".format(nid=start_node_id, rel=rel_type))
+            return end_node_id
         else:
             logging.error("Non-existing start node ID: {start_node_id}".format(start_node_id=start_node_id))
             return False
@@ -227,14 +563,27 @@ class NeoStore:
         @param part_nid: Nid of the participant node.
         @return: Category (Dames or Heren), or False if no category could be found.
         """
-        query = "MATCH (n:Participant {nid:{p}})<-[:is]-()-[:mf]->(c:MF) RETURN c.name as name"
-        res = self.graph.run(query, p=part_nid)
+        res = self.run("cat4part", part_nid=part_nid)
         try:
             rec = res.next()
         except StopIteration:
             return False
         return rec["name"]
 
+    def get_cat4race(self, race_id):
+        """
+        This method will return the category for every participant in the race in a single query. Compare with method
+        get_cat4part, that gets the category for one participant. The nid and name of the person are returned as well.
+        @param race_id: Nid of the race node.
+        @return: Dictionary with participant nid as key and a dictionary with cat (Dames, Heren or None if the person
+        has no category), pers_nid and name (of the person) as value.
+        """
+        res = self.run("cat4race", race_id=race_id)
+        cat4part = {}
+        for rec in res:
+            cat4part[rec["nid"]] = dict(cat=rec["cat"], pers_nid=rec["pers_nid"], name=rec["name"])
+        return cat4part
+
     def get_end_nodes(self, start_node_id=None, rel_type=None):
         """
         This method will calculate all end nodes from a start Node ID and a relation type. If relation type is not
@@ -244,16 +593,10 @@ class NeoStore:
         @param rel_type: Relation type
         @return: List with Node IDs (integers) of the end Nodes, or False.
         """
-        # First get Node from end node ID
-        start_node = self.node(start_node_id)
-        if start_node:
-            # Then get relation to end node.
-            node_list = [self.node_id(rel.end_node())
-                         for rel in self.graph.match(start_node=start_node, rel_type=rel_type)]
-            # Convert to set to remove duplicates
-            node_set = set(node_list)
-            # Then return the list
-            return list(node_set)
+        node_list = self.get_neighbours(start_node_id, rel_type=rel_type, direction="out")
+        if isinstance(node_list, list):
+            # Duplicates have been removed in the query.
+            return node_list
         else:
             logging.error("Non-existing start node ID: {start_node_id}".format(start_node_id=start_node_id))
             return False
@@ -265,12 +608,7 @@ class NeoStore:
         @param race_id: nid of the Bijwedstrijd
         @return: nid of the Hoofdwedstrijd.
         """
-        query = """
-            MATCH (n:Race {nid:{race_nid}})<-[:has]-(:Organization)-[:has]->(r:Race),
-                  (r)-[:type]->(t:RaceType {name:'Hoofdwedstrijd'})
-            RETURN r.nid as nid
-            """
-        res = self.graph.run(query, race_nid=race_id)
+        res = self.run("main_race", race_nid=race_id)
         try:
             rec = res.next()
         except StopIteration:
@@ -285,12 +623,7 @@ class NeoStore:
         :param cat: Category name
         :return: Number of participants. 0 is a valid response.
         """
-        query = """
-            MATCH (n:Race {nid:{race_nid}})<-[:participates]-(:Participant)<-[:is]-(p:Person),
-                  (p)-[:mf]->(c:MF {name:{cat}})
-            RETURN count(p) as cnt
-        """
-        res = self.graph.run(query, race_nid=race_id, cat=cat)
+        res = self.run("nr_participants", race_nid=race_id, cat=cat)
         try:
             rec = res.next()
         except StopIteration:
@@ -313,28 +646,215 @@ class NeoStore:
                           .format(l=labels, p=props, m=len(nodes)))
         return nodes[0]
 
+    def get_next_participants(self, race_id):
+        """
+        This method will get the persons that can be selected as participant in the race. These are the persons that do
+        not participate in any race of the organization yet.
+
+        :param race_id: nid of the race.
+
+        :return: list of [nid, name] for every eligible person, sorted on name.
+        """
+        res = self.run("next_participant", race_id=race_id)
+        return [[rec["nid"], rec["name"]] for rec in res]
+
     def get_nodes(self, *labels, **props):
         """
         This method will select all nodes that have labels and properties
+        Note that the selector does not run in the transaction of the thread, so it finds committed nodes only.
         @param labels:
         @param props:
         @return: list of nodes that fulfill the criteria
         """
-        nodes = self.selector.select(*labels, **props)
-        return list(nodes)
-
-    def get_nodes_no_nid(self):
-        """
-        This method will select all nodes that have no nid. These should be limited to Calendar nodes. A nid will be
-        added since this is used as unique reference for the node in relations
+        with self.query_timer("select", ":".join(labels), props) as rec:
+            nodes = list(self.selector.select(*labels, **props))
+            rec["rows"] = len(nodes)
+        return nodes
+
+    def stream_nodes(self, batch=1000):
+        """
+        This method will return all nodes with a nid, with their outgoing relations. The nodes are read per label in
+        pages of batch nodes, so only a page of nodes is in memory. A node with more than one label is returned once, for
+        the first of its labels in cypher.nid_labels. Nodes without a label in nid_labels are not returned.
+        @param batch: Number of nodes per page.
+        @return: generator of tuples (node, relations), relations is a list of tuples (relation type, nid of end node).
+        """
+        for label in nid_labels:
+            after = ""
+            while True:
+                records = self.run("dump_" + label.lower(), after=after, batch=batch).data()
+                for rec in records:
+                    node = rec["n"]
+                    if section_label(node.labels()) == label:
+                        yield node, [(rel_type, to_nid) for (rel_type, to_nid) in rec["rels"] if rel_type]
+                if len(records) < batch:
+                    break
+                after = records[-1]["n"]["nid"]
+
+    def stream_relations(self, batch=1000):
+        """
+        This method will return all relations between nodes with a nid, with the label of the start and end node. The
+        relations are read in pages of start nodes per label, as in stream_nodes.
+        @param batch: Number of start nodes per page.
+        @return: generator of tuples (start label, relation type, end label, start nid, end nid).
+        """
+        for label in nid_labels:
+            after = ""
+            while True:
+                records = self.run("dump_relations_" + label.lower(), after=after, batch=batch).data()
+                for rec in records:
+                    if section_label(rec["labels"]) == label:
+                        for (rel_type, to_nid, to_labels) in rec["rels"]:
+                            if rel_type:
+                                yield label, rel_type, section_label(to_labels), rec["nid"], to_nid
+                if len(records) < batch:
+                    break
+                after = records[-1]["nid"]
+
+    def export_snapshot(self, snapshot, batch=1000):
+        """
+        This method will write a snapshot of the store to a gzip compressed file with a JSON document on every line.
+        The first line is a header with format, version and time of creation. Then follow sections: a section starts
+        with a line ["nodes", label] followed by a line with the properties of every node, or with a line
+        ["relations"] followed by a line [start label, relation type, end label, start nid, end nid] for every
+        relation. The last line is ["end", {"nodes": count, "relations": count}], so a snapshot that is not complete
+        is found on import.
+        Nodes and relations are read in pages, so memory use does not depend on the size of the store. The snapshot is
+        written to a temporary file that replaces the snapshot at the end.
+        @param snapshot: Full path to the snapshot file.
+        @param batch: Number of nodes per page.
+        @return: Number of nodes and number of relations in the snapshot.
+        """
+        # Every node needs a nid, since this is the reference in the snapshot.
+        self.get_nodes_no_nid()
+        tmpfile = snapshot + ".tmp"
+        node_cnt, rel_cnt = 0, 0
+        with gzip.open(tmpfile, "wt", encoding="utf-8", compresslevel=6) as fh:
+            def write(rec):
+                fh.write(json.dumps(rec, separators=(",", ":")) + "\n")
+            write(dict(format=snapshot_format, version=snapshot_version,
+                       created=datetime.now().replace(microsecond=0).isoformat()))
+            label = None
+            for (node, rels) in self.stream_nodes(batch):
+                node_label = section_label(node.labels())
+                if node_label != label:
+                    write(["nodes", node_label])
+                    label = node_label
+                write(dict(node))
+                node_cnt += 1
+            write(["relations"])
+            for rel in self.stream_relations(batch):
+                write(list(rel))
+                rel_cnt += 1
+            write(["end", dict(nodes=node_cnt, relations=rel_cnt)])
+        os.replace(tmpfile, snapshot)
+        logging.info("{n} nodes and {r} relations in snapshot {f}".format(n=node_cnt, r=rel_cnt, f=snapshot))
+        return node_cnt, rel_cnt
+
+    def import_snapshot(self, snapshot, batch=1000):
+        """
+        This method will replace the content of the store with a snapshot from export_snapshot. The snapshot is read
+        line by line, nodes are restored in batches per label and relations in batches per relation type, so memory use
+        does not depend on the size of the snapshot.
+        @param snapshot: Full path to the snapshot file.
+        @param batch: Number of nodes or relations per statement.
+        @return: Number of nodes and number of relations restored.
+        """
+        with gzip.open(snapshot, "rt", encoding="utf-8") as fh:
+            header = json.loads(fh.readline() or "{}")
+            if header.get("format") != snapshot_format or header.get("version") != snapshot_version:
+                raise ValueError("{f} is not a snapshot version {v}".format(f=snapshot, v=snapshot_version))
+            self.clear_store()
+            self.create_indexes()
+            label, nodes, rels = None, [], {}
+            node_cnt, rel_cnt, end = 0, 0, None
+            for line in fh:
+                rec = json.loads(line)
+                if isinstance(rec, dict):
+                    nodes.append(rec)
+                    node_cnt += 1
+                    if len(nodes) >= batch:
+                        self.restore_nodes(label, nodes)
+                        nodes = []
+                elif len(rec) == 5:
+                    (from_label, rel_type, to_label, from_nid, to_nid) = rec
+                    rels.setdefault(rel_type, []).append(dict(from_nid=from_nid, to_nid=to_nid))
+                    rel_cnt += 1
+                    if len(rels[rel_type]) >= batch:
+                        self.restore_relations(rel_type, rels.pop(rel_type))
+                else:
+                    # Start of a section, nodes of the previous section go first.
+                    if nodes:
+                        self.restore_nodes(label, nodes)
+                        nodes = []
+                    if rec[0] == "nodes":
+                        label = rec[1]
+                    elif rec[0] == "end":
+                        end = rec[1]
+            if nodes:
+                self.restore_nodes(label, nodes)
+            for (rel_type, rows) in rels.items():
+                self.restore_relations(rel_type, rows)
+        self.clear_node_cache()
+        if end != dict(nodes=node_cnt, relations=rel_cnt):
+            raise ValueError("Snapshot {f} is not complete, {n} nodes and {r} relations restored"
+                             .format(f=snapshot, n=node_cnt, r=rel_cnt))
+        logging.info("{n} nodes and {r} relations restored from {f}".format(n=node_cnt, r=rel_cnt, f=snapshot))
+        return node_cnt, rel_cnt
+
+    def node_count(self):
+        """
+        This method will return the number of nodes in the database.
+        @return: Number of nodes.
+        """
+        return self.run("node_count").evaluate()
+
+    def property_keys(self):
+        """
+        This method will return the property keys in the database. The list can have keys that are not on a node
+        anymore.
+        @return: List of property keys.
+        """
+        return [rec["key"] for rec in self.run("property_keys")]
+
+    def restore_nodes(self, label, rows):
+        """
+        This method will restore a batch of nodes with the label from a dump. The nodes are merged on nid, so a batch
+        that has been restored before does not create nodes again.
+        @param label: Label for the nodes, one of cypher.nid_labels.
+        @param rows: List of property dictionaries, each with a nid.
+        @return: Number of nodes in the batch.
+        """
+        return self.run("restore_" + label.lower(), rows=rows).evaluate()
+
+    def restore_relations(self, rel_type, rows):
+        """
+        This method will restore a batch of relations of one type. The nodes are found on nid, the relations are
+        merged.
+        @param rel_type: Relation type, one of cypher.rel_types.
+        @param rows: List of dictionaries with from_nid and to_nid.
+        @return: Number of relations in the batch.
+        """
+        return self.run("restore_rel_" + rel_type.lower(), rows=rows).evaluate()
+
+    def get_nodes_no_nid(self, batch=1000):
+        """
+        This method will set a nid on all nodes that have no nid. These should be limited to Calendar nodes, or nodes
+        from a restore with create_node_no_nid. The nodes are searched per label (cypher.nid_labels), the nids are set
+        in batches of nodes in one statement.
+        @param batch: Maximum number of nodes per statement.
         @return: count of number of nodes that have been updated.
         """
-        query = "MATCH (n) WHERE NOT EXISTS (n.nid) RETURN id(n) as node_id"
-        res = self.graph.run(query)
         cnt = 0
-        for rec in res:
-            self.set_node_nid(node_id=rec["node_id"])
-            cnt += 1
+        for label in nid_labels:
+            while True:
+                nids = [str(uuid.uuid4()) for _ in range(batch)]
+                set_cnt = self.run("set_nids_" + label.lower(), batch=batch, nids=nids).evaluate() or 0
+                cnt += set_cnt
+                if set_cnt < batch:
+                    break
+        if cnt:
+            logging.info("{cnt} nodes got a nid".format(cnt=cnt))
         return cnt
 
     def get_organization(self, **org_dict):
@@ -346,15 +866,10 @@ class NeoStore:
          method.
         @return: True if organization is found, False otherwise.
         """
-        query = """
-        MATCH (day:Day {key: {datestamp}})<-[:On]-(org:Organization {name: {name}}),
-              (org)-[:In]->(loc:Location {city: {location}})
-        RETURN org
-        """
         if not isinstance(org_dict["datestamp"], str):
             org_dict["datestamp"] = org_dict["datestamp"].strftime("%Y-%m-%d")
-        cursor = self.graph.run(query, name=org_dict["name"], location=org_dict["location"],
-                                datestamp=org_dict["datestamp"])
+        cursor = self.run("organization", name=org_dict["name"], location=org_dict["location"],
+                          datestamp=org_dict["datestamp"])
         org_list = nodelist_from_cursor(cursor)
         if len(org_list) == 0:
             # No organization found on this date for this location
@@ -377,13 +892,7 @@ class NeoStore:
         @param org_id: nid of the organization Node.
         @return: Dictionary with organization details: date, day, month, year, org (organization label) and city
         """
-        query = """
-            MATCH (date:Day)<-[:On]-(org:Organization)-[:In]->(loc:Location)
-            WHERE org.nid = '{org_id}'
-            RETURN date.day as day, date.month as month, date.year as year, date.key as date,
-                   org.name as org, loc.city as city
-        """.format(org_id=org_id)
-        org_array = DataFrame(self.graph.run(query).data())
+        org_array = DataFrame(self.run("organization_from_id", org_id=org_id).data())
         df_length = org_array.index
         if len(df_length) == 0:
             logging.error("No organization found for nid {nid}".format(nid=org_id))
@@ -400,18 +909,34 @@ class NeoStore:
 
         :return:
         """
-        query = """
-            MATCH (day:Day)<-[:On]-(org:Organization)-[:In]->(loc:Location),
-                  (org)-[:type]->(ot:OrgType)
-            RETURN day.key as date, org.name as organization, loc.city as city, org.nid as id, ot.name as type
-            ORDER BY day.key ASC
-        """
-        res = self.graph.run(query).data()
+        res = self.run("organization_list").data()
         # Convert date key from YYYY-MM-DD to DD-MM-YYYY
         for rec in res:
             rec["date"] = datetime.strptime(rec["date"], "%Y-%m-%d").strftime("%d-%m-%Y")
         return res
 
+    def get_overview(self, cat):
+        """
+        This method will collect the result of every person in category cat on every organization in one query. The
+        records are handled as they are streamed from the cursor.
+
+        :param cat: Category (Dames or Heren)
+
+        :return: Dictionary with person nid as key. Value is a dictionary with organization nid as key and dictionary
+        with race (race name) and part (pos and points of the participant) as value.
+        """
+        overview = {}
+        cursor = self.run("overview", cat=cat)
+        while cursor.forward():
+            rec = cursor.current()
+            res4org = dict(race=dict(name=rec["race"]),
+                           part=dict(pos=rec["pos"], points=rec["points"]))
+            try:
+                overview[rec["pers_nid"]][rec["org_nid"]] = res4org
+            except KeyError:
+                overview[rec["pers_nid"]] = {rec["org_nid"]: res4org}
+        return overview
+
     def get_participant_in_race(self, pers_id=None, race_id=None):
         """
         This function will for a person get the participant node in a race, or False if the person did not
@@ -420,12 +945,7 @@ class NeoStore:
         @param race_id:
         @return: participant node, or False
         """
-        query = """
-            MATCH (pers:Person)-[:is]->(part:Participant)-[:participates]->(race:Race)
-            WHERE pers.nid='{pers_id}' AND race.nid='{race_id}'
-            RETURN part
-        """.format(pers_id=pers_id, race_id=race_id)
-        res = self.graph.run(query)
+        res = self.run("participant_in_race", pers_id=pers_id, race_id=race_id)
         nodes = nodelist_from_cursor(res)
         if len(nodes) > 1:
             logging.error("More than one ({nr}) Participant node for Person {pnid} and Race {rnid}"
@@ -434,39 +954,45 @@ class NeoStore:
             return False
         return nodes[0]
 
+    def get_participant_ranks(self, race_id):
+        """
+        This method will return the nid and the rank of the participants in the race, in sequence of the rank.
+        Participants without rank are at the end of the list.
+
+        :param race_id: nid of the race.
+
+        :return: list of (nid, rank) tuples. Rank is None for a participant without rank.
+        """
+        res = self.run("participant_ranks", race_id=race_id)
+        return [(rec["nid"], rec["rank"]) for rec in res]
+
     def get_participant_seq_list(self, race_id):
         """
-        This method will return a list of participant nodes in sequence of arrival for a particular race.
+        This method will return a list of participant nodes in sequence of arrival for a particular race. The sequence
+        of arrival is the rank property of the participant. If there are participants without rank, then the race has
+        not been ranked before and the rank is set from the after chain first.
         @param race_id:
-        @return: Node list
-        """
-        query = """
-            MATCH race_ptn = (race)<-[:participates]-(participant),
-                  participants = (participant)<-[:after*0..]-()
-            WHERE race.nid = '{race_id}'
-            WITH COLLECT(participants) AS results, MAX(length(participants)) AS maxLength
-            WITH FILTER(result IN results WHERE length(result) = maxLength) AS result_coll
-            UNWIND result_coll as result
-            RETURN nodes(result)
-        """.format(race_id=race_id)
-        # Get the result of the query in a recordlist
-        cursor = self.graph.run(query)
-        try:
-            rec = cursor.next()
-        except StopIteration:
+        @return: Node list, or False if there are no participants in the race.
+        """
+        node_list = [rec["part"] for rec in self.run("participant_seq_list", race_id=race_id)]
+        if not node_list:
             return False
-        return rec["nodes(result)"]
+        if None in [part["rank"] for part in node_list]:
+            # The rank follows from the after chain, the race looks the same after ranking.
+            with self.unversioned():
+                self.rank_participants(race_id)
+            node_list = [rec["part"] for rec in self.run("participant_seq_list", race_id=race_id)]
+        return node_list
 
     def points_per_category(self, cat):
         """
         This query will for the specified category collect every participation and points that go with the participation
         for every person in the category.
         :param cat:
-        :return: A cursor with records having the name, nid and points for each participation on every race.
+        :return: A list of dictionaries with the name, nid (of the person), part_nid and points for each participation
+        on every race.
         """
-        query = "match (c:MF {name:{cat}})<-[:mf]-(n:Person)-[:is]->(p) " \
-                "return n.name as name, n.nid as nid, p.points as points"
-        res = self.graph.run(query, cat=cat)
+        res = self.run("points_per_category", cat=cat).data()
         return res
 
     def get_race_in_org(self, org_id, racetype_id, name):
@@ -482,14 +1008,7 @@ class NeoStore:
 
         :return: tuple with race nid and organization name, or False if race not found.
         """
-        query = """
-        MATCH (org:Organization)-->(race:Race)-->(racetype:RaceType)
-        WHERE org.nid='{org_id}'
-          AND racetype.nid='{racetype}'
-          AND race.name='{name}'
-        RETURN race.nid as race_nid, org.name as org_name
-        """.format(org_id=org_id, racetype=racetype_id, name=name)
-        race_cursor = self.graph.run(query)
+        race_cursor = self.run("race_in_org", org_id=org_id, racetype_id=racetype_id, name=name)
         try:
             race_data = next(race_cursor)
         except StopIteration:
@@ -497,21 +1016,22 @@ class NeoStore:
         else:
             return race_data["race_nid"], race_data["org_name"]
 
+    def get_persons_nr_races(self):
+        """
+        This method will get all persons with the number of races they participated in, in one aggregated query.
+
+        :return: list of [nid, name, nr_races] for every person, sorted on number of races (descending) and name.
+        """
+        res = self.run("persons_nr_races")
+        return [[rec["nid"], rec["name"], rec["nr_races"]] for rec in res]
+
     def get_race_label(self, race_id):
         """
         This method will return the dictionary that allows to create the race label.
         @param race_id: nid of the race.
         @return: Dictionary with the Race information. Fields: race, org, city, day, month, year.
         """
-        query = """
-            MATCH (race:Race)<-[:has]-(org)-[:On]->(date),
-                  (org)-[:In]->(loc),
-                  (type:RaceType)<-[:type]-(race)
-            WHERE race.nid='{race_id}'
-            RETURN race.name as race, org.name as org, loc.city as city, date.day as day,
-                   date.month as month, date.year as year, type.name as type
-        """.format(race_id=race_id)
-        recordlist = self.graph.run(query).data()
+        recordlist = self.run("race_label", race_id=race_id).data()
         if len(recordlist) == 0:
             logging.error("Expected to find a Race Label, but no match... ({nid})".format(nid=race_id))
             return False
@@ -527,13 +1047,7 @@ class NeoStore:
         @param org_id: nid of the Organization.
         @return: List of dictionaries, or empty list which evaluates to False.
         """
-        query = """
-            MATCH (org:Organization)-[:has]->(race:Race)-[:type]->(racetype:RaceType)
-            WHERE org.nid = '{org_id}'
-            RETURN race.name as race, racetype.name as type, race.nid as race_id
-            ORDER BY racetype.weight, race.name
-        """.format(org_id=org_id)
-        res = self.graph.run(query).data()
+        res = self.run("race_list", org_id=org_id).data()
         return res
 
     def get_race4person(self, person_id):
@@ -547,16 +1061,7 @@ class NeoStore:
         sequence.
         """
         race4person = []
-        query = """
-            MATCH (person:Person)-[:is]->(part:Participant)-[:participates]->(race:Race),
-                  (race)<-[:has]-(org:Organization)-[:On]->(day:Day),
-                  (race)-[:type]->(racetype:RaceType),
-                  (org)-[:In]->(loc:Location)
-            WHERE person.nid='{pers_id}'
-            RETURN race, part, day, org, racetype, loc
-            ORDER BY day.key ASC
-        """.format(pers_id=person_id)
-        cursor = self.graph.run(query)
+        cursor = self.run("race4person", pers_id=person_id)
         while cursor.forward():
             rec = cursor.current()
             res_dict = dict(part=dict(rec['part']),
@@ -574,8 +1079,7 @@ class NeoStore:
         @return: cursor with every possible relation. A cursor is an generator, so only a single pass in a for-loop is
          possible. Access the fields from_nid, rel and to_nid as dictionary items.
         """
-        query = "match (n)-[r]->(m) return n.nid as from_nid, type(r) as rel, m.nid as to_nid"
-        res = self.graph.run(query)
+        res = self.run("relations")
         return res
 
     def get_start_node(self, end_node_id=None, rel_type=None):
@@ -588,22 +1092,17 @@ class NeoStore:
         @param rel_type: Relation type
         @return: Node nid of the start Node, or False.
         """
-        # First get Node from end node ID
-        end_node = self.node(end_node_id)
-        if end_node:
-            # Then get relation to end node.
-            try:
-                rel = next(item for item in self.graph.match(end_node=end_node, rel_type=rel_type))
-            except StopIteration:
+        res = self.get_neighbour(end_node_id, rel_type=rel_type, direction="in")
+        if res:
+            (start_node_id, cnt) = res
+            if cnt == 0:
                 logging.warning("No start node found for end node ID {nid} and relation {rel}"
                                 .format(nid=end_node_id, rel=rel_type))
-            else:
-                # Check if there are more elements in the iterator.
-                if len([item for item in self.graph.match(end_node=end_node, rel_type=rel_type)]) > 1:
-                    logging.warning("More than one start node found for end node ID {nid} and relation {rel},"
-                                    " returning first".format(nid=end_node_id, rel=rel_type))
-                start_node_id = self.node_id(rel.start_node())
-                return start_node_id
+                return False
+            elif cnt > 1:
+                logging.warning("More than one start node found for end node ID {nid} and relation {rel},"
+                                " returning first".format(nid=end_node_id, rel=rel_type))
+            return start_node_id
         else:
             logging.error("Non-existing end node ID: {end_node_id}".format(end_node_id=end_node_id))
             return False
@@ -617,17 +1116,73 @@ class NeoStore:
         @param rel_type: Relation type
         @return: List with Node IDs (integers) of the start Node, or False.
         """
-        # First get Node from end node ID
-        end_node = self.node(end_node_id)
-        if end_node:
-            # Then get relation to end node.
-            node_list = [self.node_id(rel.start_node())
-                         for rel in self.graph.match(end_node=end_node, rel_type=rel_type)]
+        node_list = self.get_neighbours(end_node_id, rel_type=rel_type, direction="in")
+        if isinstance(node_list, list):
             return node_list
         else:
             logging.error("Non-existing end node ID: {end_node_id}".format(end_node_id=end_node_id))
             return False
 
+    @staticmethod
+    def typed_statement(stmt_name, rel_type):
+        """
+        This method will return the name of the statement for the relation type. A relation type can not be a
+        parameter, so module cypher has a statement per relation type, such as neighbour_out_has for neighbour_out.
+
+        :param stmt_name: Name of the statement for any relation type.
+
+        :param rel_type: Relation type, or None for any relation type.
+
+        :return: Name of the statement in the registry.
+        """
+        if rel_type is None:
+            return stmt_name
+        return stmt_name + "_" + rel_type.lower()
+
+    def get_neighbour(self, nid, rel_type=None, direction="out"):
+        """
+        This method will get the neighbour of a node over a relation in a single query. The query returns the nid of
+        (the first) neighbour and the number of relations that qualify, so the caller can check on duplicates without
+        a second round trip.
+
+        :param nid: nid of the anchor node.
+
+        :param rel_type: Relation type. If not specified then any relation type will do.
+
+        :param direction: 'out' to follow the relation from anchor node to end node, 'in' to follow the relation from
+        anchor node to start node.
+
+        :return: Tuple (nid of the neighbour, number of relations). Neighbour nid is None and number of relations is 0
+        if there are no relations. False if the anchor node does not exist.
+        """
+        res = self.run(self.typed_statement("neighbour_" + direction, rel_type), nid=nid, rel_type=rel_type)
+        try:
+            rec = res.next()
+        except StopIteration:
+            return False
+        return rec["neighbour"], rec["cnt"]
+
+    def get_neighbours(self, nid, rel_type=None, direction="out"):
+        """
+        This method will get all neighbours of a node over a relation in a single query. Compare with method
+        get_neighbour.
+
+        :param nid: nid of the anchor node.
+
+        :param rel_type: Relation type. If not specified then any relation type will do.
+
+        :param direction: 'out' to follow the relation from anchor node to end nodes, 'in' to follow the relation from
+        anchor node to start nodes.
+
+        :return: List of unique neighbour nids, or False if the anchor node does not exist.
+        """
+        res = self.run(self.typed_statement("neighbours_" + direction, rel_type), nid=nid, rel_type=rel_type)
+        try:
+            rec = res.next()
+        except StopIteration:
+            return False
+        return rec["neighbours"]
+
     def get_wedstrijd_type(self, org_id, racetype):
         """
         This query will find if organization has races of type racetype. It will return the number of races (True)
@@ -636,22 +1191,15 @@ class NeoStore:
         @param racetype:
         @return: Number of races for this type (True), or False if no races.
         """
-        query = """
-        MATCH (org:Organization)-[:has]->(race:Race)-[:type]->(rt:RaceType)
-        WHERE org.nid='{org_id}'
-          AND rt.name='{racetype}'
-        RETURN org, race, rt
-        """.format(org_id=org_id, racetype=racetype)
-        res = DataFrame(self.graph.run(query).data())
+        res = DataFrame(self.run("wedstrijd_type", org_id=org_id, racetype=racetype).data())
         if res.empty:
             return False
         else:
             return len(res.index)
 
-    def init_graph(self):
+    def create_indexes(self):
         """
-        This method will initialize the graph. It will set indices and create nodes required for the application
-        (on condition that the nodes do not exist already).
+        This method will create the constraints and indexes of the graph, if they do not exist already.
         @return:
         """
         stmt = "CREATE CONSTRAINT ON (n:{0}) ASSERT n.{1} IS UNIQUE"
@@ -659,10 +1207,23 @@ class NeoStore:
         self.graph.run(stmt.format('Person', 'name'))
         self.graph.run(stmt.format('RaceType', 'name'))
         self.graph.run(stmt.format('OrgType', 'name'))
-        nid_labels = ['Participant', 'Person', 'Race', 'Organization', 'Location', 'RaceType', 'OrgType']
+        # Every label has a constraint on nid, so that a restore finds the nodes for the relations on the index.
         stmt = "CREATE CONSTRAINT ON (n:{nid_label}) ASSERT n.nid IS UNIQUE"
-        for nid_label in nid_labels:
+        for nid_label in nid_labels + [node_label]:
             self.graph.run(stmt.format(nid_label=nid_label))
+        # Date nodes are found on key.
+        stmt = "CREATE INDEX ON :{date_label}(key)"
+        for date_label in ['Day', 'Month', 'Year']:
+            self.graph.run(stmt.format(date_label=date_label))
+        return
+
+    def init_graph(self):
+        """
+        This method will initialize the graph. It will set indices and create nodes required for the application
+        (on condition that the nodes do not exist already).
+        @return:
+        """
+        self.create_indexes()
 
         # RaceType
         """
@@ -695,13 +1256,266 @@ class NeoStore:
         The current release of py2neo 3.1.2 throws a IndexError in case a none-existing node ID is requested.)
         Note that since there seems to be no way to extract the Node ID of a node, the nid attribute is used. As a
         consequence, it is not possible to use the node(nid).
+        If the node cache is active (during a request), then a node that has been fetched before will be returned from
+        the cache.
         @param nid: ID of the node to be found.
         @return: Node, or False (None) in case the node could not be found.
         """
-        selected = self.selector.select(nid=nid)
-        node = selected.first()
+        node_cache = self.node_cache()
+        if node_cache is not None:
+            try:
+                return node_cache[nid]
+            except KeyError:
+                pass
+        node = self.run("node", nid=nid).evaluate()
+        if node and node_cache is not None:
+            node_cache[nid] = node
         return node
 
+    def node_cache(self):
+        """
+        This method returns the node cache (identity map) for the current thread. The node cache is a dictionary with
+        nid as key and the Node object as value. The cache is active only between start_node_cache and stop_node_cache,
+        which is the lifetime of a request.
+        :return: Dictionary with nid as key and Node as value, or None if the node cache is not active.
+        """
+        return getattr(self.local, "node_cache", None)
+
+    def start_node_cache(self):
+        """
+        This method will start an empty node cache for the current thread. It is called at the start of every request.
+        :return:
+        """
+        self.local.node_cache = {}
+        return
+
+    def stop_node_cache(self):
+        """
+        This method will stop the node cache for the current thread. Nodes are fetched from the database on every call
+        to method node again.
+        :return:
+        """
+        self.local.node_cache = None
+        return
+
+    def clear_node_cache(self, nid=None):
+        """
+        This method will remove a node from the node cache, or all nodes if no nid is specified. It needs to be called
+        for every write on a node that is not done through the Node object in the cache.
+        :param nid: nid of the node to remove from the cache. If not specified, then all nodes are removed.
+        :return:
+        """
+        node_cache = self.node_cache()
+        if node_cache is not None:
+            if nid:
+                node_cache.pop(nid, None)
+            else:
+                node_cache.clear()
+        return
+
+    def query_log(self):
+        """
+        This method returns the query log for the current thread. The query log is a list with a record for every
+        statement that has been sent to the database. The query log is active only between start_query_log and
+        stop_query_log, which is the lifetime of a request.
+        :return: List of query records, or None if the query log is not active.
+        """
+        return getattr(self.local, "query_log", None)
+
+    def start_query_log(self):
+        """
+        This method will start an empty query log for the current thread.
+        :return:
+        """
+        self.local.query_log = []
+        return
+
+    def stop_query_log(self):
+        """
+        This method will stop the query log for the current thread.
+        :return: List of query records that have been logged.
+        """
+        query_log = self.query_log()
+        self.local.query_log = None
+        return query_log
+
+    @contextmanager
+    def query_timer(self, kind, name=None, params=None):
+        """
+        This method times the statement in the with block and adds a record to the query log, if the query log is
+        active. The record is a dictionary with kind (run, select, create, merge, push, exists, calendar), name (of the
+        statement or the labels), shape of the parameters, rows returned and wall time in ms. The with block can set
+        the number of rows on the record. A statement that changes the data changes the data version.
+        :param kind: Kind of statement.
+        :param name: Name of the statement.
+        :param params: Parameters of the statement.
+        :return: Query record, or an empty dictionary if the query log is not active.
+        """
+        write = kind in write_kinds or (kind == "run" and write_statement(name))
+        query_log = self.query_log()
+        if query_log is None and self.slow_query_ms is None:
+            try:
+                yield {}
+            finally:
+                if write:
+                    self.data_changed()
+            return
+        rec = dict(kind=kind, name=name, params=params_shape(params), rows=None, ms=0)
+        start = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec["ms"] += (time.perf_counter() - start) * 1000
+            if write:
+                self.data_changed()
+            if query_log is not None:
+                query_log.append(rec)
+            if self.slow_query_ms is not None and rec["ms"] > self.slow_query_ms:
+                self.log_slow_query(kind, name, params, rec["ms"])
+
+    def init_data_version(self):
+        """
+        This method will start the data version of the store. The data version is the start time of the store and a
+        counter of the changes, so a version from before a restart of the application is never valid again.
+        @return:
+        """
+        self.data_start = "{t:x}".format(t=int(time.time()))
+        self.data_changes = itertools.count()
+        self.new_data_version()
+        # Last committed transaction of the database, for changes from other processes. See get_data_version.
+        self.last_tx_id = None
+        self.last_tx_checked = 0
+        return
+
+    def get_data_version(self):
+        """
+        This method will return the data version of the store, for the data in the database. Changes from this process
+        change the data version at once. Changes from other processes (scripts in Tools, other workers) are seen from
+        the id of the last committed transaction in the database. This id is read at most once every
+        data_version_seconds, so a change from another process is seen with that delay.
+        If the database does not give the transaction id, then only the changes from this process are seen.
+        @return: Data version string.
+        """
+        now = time.time()
+        if self.data_version_seconds is not None and now - self.last_tx_checked >= self.data_version_seconds:
+            self.last_tx_checked = now
+            try:
+                tx_id = self.graph.run(statements["last_tx_id"]).evaluate()
+            except Exception as exc:
+                logging.error("No transaction id from Neo4J, changes from other processes are not seen: {exc}"
+                              .format(exc=exc))
+                self.data_version_seconds = None
+            else:
+                if tx_id != self.last_tx_id:
+                    self.last_tx_id = tx_id
+                    self.data_modified = datetime.utcnow()
+        return "{v}-{t}".format(v=self.data_version, t=self.last_tx_id)
+
+    @contextmanager
+    def unversioned(self):
+        """
+        Statements in the with block of the current thread do not change the data version. This is for writes that do
+        not change what the data looks like, such as the rank that is set from the after chain on first read.
+        @return:
+        """
+        self.local.unversioned = True
+        try:
+            yield
+        finally:
+            self.local.unversioned = False
+
+    def new_data_version(self):
+        self.data_version = "{start}-{cnt}".format(start=self.data_start, cnt=next(self.data_changes))
+        self.data_modified = datetime.utcnow()
+        return
+
+    def data_changed(self):
+        """
+        This method is called after every statement that changes the data. Responses that are derived from the data of
+        an older data version are not valid anymore. In a transaction, the data version changes after the commit, so
+        that the new version never goes with data from before the commit.
+        @return:
+        """
+        if getattr(self.local, "unversioned", False):
+            return
+        if getattr(self.local, "tx", None) is not None:
+            self.local.tx_changed = True
+        else:
+            self.new_data_version()
+        return
+
+    def end_transaction(self, commit):
+        """
+        This method is called at the end of the outer transaction, after the commit or rollback.
+        @param commit: True if the transaction is committed, False if it is rolled back.
+        @return:
+        """
+        changed = getattr(self.local, "tx_changed", False)
+        self.local.tx_changed = False
+        if commit and changed:
+            self.new_data_version()
+        evict_dates = getattr(self.local, "evict_dates", [])
+        self.local.evict_dates = []
+        if commit:
+            for key in evict_dates:
+                if key is None:
+                    self.date_cache.clear()
+                else:
+                    self.date_cache.pop(key, None)
+        return
+
+    def log_slow_query(self, kind, name, params, ms):
+        """
+        This method will write a statement to the slow query log, with its parameters and the model function that
+        called the store. Statements from the registry get the profile if this is configured.
+        :param kind: Kind of statement.
+        :param name: Name of the statement.
+        :param params: Parameters of the statement.
+        :param ms: Wall time in ms.
+        :return:
+        """
+        params = {key: "***" if key in secret_params else value for (key, value) in (params or {}).items()}
+        msg = "{ms:.1f} ms|{kind}|{name}|{caller}|{params:.500}".format(ms=ms, kind=kind, name=name,
+                                                                        caller=query_caller(), params=str(params))
+        if self.slow_query_profile and kind == "run":
+            try:
+                msg += "|" + str(self.profile(name, **params))
+            except Exception as exc:
+                msg += "|Profile failed: {exc}".format(exc=exc)
+        logging.getLogger("slow_query").warning(msg)
+        return
+
+    def profile(self, stmt_name, **params):
+        """
+        This method will get the profile for a statement from the registry. A read statement is run again with
+        PROFILE, this gives the database hits and the rows per operator. A write statement must not run twice, so it
+        is run with EXPLAIN, this gives the plan without executing the statement.
+        The profile runs outside of the transaction of the thread.
+        :param stmt_name: Name of the statement in the registry.
+        :param params: Parameters for the statement.
+        :return: Dictionary with the total database hits and the operators, or None if there is no plan.
+        """
+        stmt = statements[stmt_name]
+        if write_statement(stmt_name):
+            cursor = self.graph.run("EXPLAIN " + stmt, **params)
+        else:
+            cursor = self.graph.run("PROFILE " + stmt, **params)
+        cursor.data()
+        summary = cursor.summary()
+        plan = getattr(summary, "profile", None) or getattr(summary, "plan", None)
+        if plan is None:
+            return None
+        operators = []
+        db_hits = 0
+        todo = [plan]
+        while todo:
+            step = todo.pop(0)
+            hits = getattr(step, "db_hits", None)
+            operators.append("{op}({hits})".format(op=step.operator_type, hits=hits))
+            db_hits += hits or 0
+            todo.extend(step.children)
+        return dict(db_hits=db_hits, operators=operators)
+
     def node_id(self, node_obj):
         """
         py2neo 3.1.2 doesn't have a method to get the ID from a node.
@@ -715,7 +1529,8 @@ class NeoStore:
         """
         # First check if my object is a node (not sure it is a node, but I am sure it is a sub-graph)
         try:
-            self.graph.exists(node_obj)
+            with self.query_timer("exists"):
+                self.db().exists(node_obj)
             # OK, my object is a node (or a relation?). Now return the nid attribute
             return node_obj['nid']
         except TypeError:
@@ -760,7 +1575,8 @@ class NeoStore:
             for prop in properties:
                 my_node[prop] = properties[prop]
             # Now push the changes to Neo4J database.
-            self.graph.push(my_node)
+            with self.query_timer("push", params=properties):
+                self.db().push(my_node)
             return True
         else:
             logging.error("No node found for NID {nid}".format(nid=properties["nid"]))
@@ -794,12 +1610,78 @@ class NeoStore:
             for prop in properties:
                 my_node[prop] = properties[prop]
             # Now push the changes to Neo4J database.
-            self.graph.push(my_node)
+            with self.query_timer("push", params=properties):
+                self.db().push(my_node)
             return True
         else:
             logging.error("No node found for NID {nid}".format(nid=properties["nid"]))
             return False
 
+    def add_participants(self, race_id, rows, prev_part_id=None):
+        """
+        This method will add a list of persons as participants to the race, in sequence of arrival. The participant
+        nodes are created in one statement, the after chain in a second statement. The first participant is linked
+        after participant prev_part_id, if there is one.
+        The persons must not participate in the race yet.
+
+        :param race_id: nid of the race.
+        :param rows: List of dictionaries in sequence of arrival, with person nid (pers_nid) and the properties for the
+        participant node (props).
+        :param prev_part_id: nid of the participant for the first participant in the list to arrive after.
+
+        :return: List of the nids of the participant nodes.
+        """
+        for row in rows:
+            row["props"]["nid"] = str(uuid.uuid4())
+        self.run("create_participants", race_id=race_id, rows=rows)
+        part_nids = [row["props"]["nid"] for row in rows]
+        prev_nids = [prev_part_id] + part_nids[:-1]
+        chain = [dict(next_nid=next_nid, prev_nid=prev_nid) for (next_nid, prev_nid) in zip(part_nids, prev_nids)
+                 if prev_nid]
+        if chain:
+            self.run("create_after_chain", rows=chain)
+        return part_nids
+
+    def participants_set_attribs(self, rows):
+        """
+        This method will set properties for a list of participant nodes in a single statement. Modified properties will
+        be updated, new properties will be added and properties not in the dictionary will be left unchanged. This is
+        method node_set_attribs for many participant nodes at once.
+
+        :param rows: List of property dictionaries, one for each participant node. 'nid' property is mandatory.
+
+        :return: Number of property dictionaries that have been handled.
+        """
+        if rows:
+            self.run("set_participant_props", rows=rows)
+            for row in rows:
+                self.clear_node_cache(row["nid"])
+        return len(rows)
+
+    def rank_participants(self, race_id, part_nids=None):
+        """
+        This method will set the rank for all participants in the race, with rank_gap between consecutive participants.
+        If no list of participants is given, then the sequence of arrival is taken from the after chain. Participants
+        that are not in the chain are added at the end.
+
+        :param race_id: nid of the race.
+        :param part_nids: list of participant nids in sequence of arrival.
+
+        :return: Number of participants that have been ranked.
+        """
+        if part_nids is None:
+            cursor = self.run("participant_chain", race_id=race_id)
+            try:
+                rec = cursor.next()
+            except StopIteration:
+                return 0
+            part_nids = [part["nid"] for part in rec["nodes(result)"]]
+            for (nid, rank) in self.get_participant_ranks(race_id):
+                if nid not in part_nids:
+                    part_nids.append(nid)
+        rows = [dict(nid=nid, rank=(pos + 1) * rank_gap) for pos, nid in enumerate(part_nids)]
+        return self.participants_set_attribs(rows)
+
     def relations(self, nid):
         """
         This method will check if node with ID has relations. Returns True if there are relations, returns False
@@ -808,8 +1690,7 @@ class NeoStore:
         :return: Number of relations - if there are relations, False - there are no relations.
         """
         # obj_node = self.node(nid)
-        query = "MATCH (n)--(m) WHERE n.nid='{nid}' return m.nid as m_nid".format(nid=nid)
-        res = self.graph.run(query).data()  # This will return the list of dictionaries with results.
+        res = self.run("node_relations", nid=nid).data()  # This will return the list of dictionaries with results.
         if len(res):
             return len(res)
         else:
@@ -830,8 +1711,8 @@ class NeoStore:
                           .format(node_id=nid))
             return False
         else:
-            query = "MATCH (n) WHERE n.nid='{nid}' DELETE n".format(nid=nid)
-            self.graph.run(query)
+            self.run("remove_node", nid=nid)
+            self.clear_node_cache(nid)
             return True
 
     def remove_node_force(self, nid):
@@ -841,8 +1722,8 @@ class NeoStore:
         @param nid: nid of the node
         @return: True if node is deleted, False otherwise
         """
-        query = "MATCH (n) WHERE n.nid='{nid}' DETACH DELETE n".format(nid=nid)
-        self.graph.run(query)
+        self.run("remove_node_force", nid=nid)
+        self.clear_node_cache(nid)
         return True
 
     def remove_relation(self, start_nid=None, end_nid=None, rel_type=None):
@@ -854,13 +1735,55 @@ class NeoStore:
         @param rel_type: Type of the relation
         @return:
         """
-        query = """
-            MATCH (start_node)-[rel_type:{rel_type}]->(end_node)
-            WHERE start_node.nid='{start_nid}'
-              AND end_node.nid='{end_nid}'
-            DELETE rel_type
-        """.format(rel_type=rel_type, start_nid=start_nid, end_nid=end_nid)
-        self.graph.run(query)
+        self.run("remove_relation", start_nid=start_nid, end_nid=end_nid, rel_type=rel_type)
+        return
+
+    def run(self, stmt_name, **params):
+        """
+        This method will run a statement from the statement registry in module cypher. The statements have a constant
+        text, values are passed as parameters. This allows Neo4J to re-use the query plan.
+        :param stmt_name: Name of the statement in the registry.
+        :param params: Parameters for the statement.
+        :return: py2neo Cursor with the result of the statement.
+        """
+        with self.query_timer("run", stmt_name, params) as rec:
+            cursor = self.db().run(statements[stmt_name], **params)
+        if self.query_log() is not None:
+            return LoggedCursor(cursor, rec)
+        return cursor
+
+    @contextmanager
+    def transaction(self):
+        """
+        This method opens a transaction (unit of work) for the current thread. All statements from this thread go into
+        the transaction, which is committed with a single commit at the end of the with block. If an exception is
+        raised in the with block, then the transaction is rolled back and the node cache is cleared, since it can have
+        nodes that are not in the database.
+        If a transaction is open already, then the statements go into that transaction. The outer transaction
+        commits.
+        Note that calendar date nodes are always created outside the transaction.
+
+        Usage: with ns.transaction(): ...
+
+        :return:
+        """
+        if getattr(self.local, "tx", None) is not None:
+            yield
+            return
+        tx = self.graph.begin()
+        self.local.tx = tx
+        try:
+            yield
+        except Exception:
+            self.local.tx = None
+            tx.rollback()
+            self.end_transaction(commit=False)
+            self.clear_node_cache()
+            raise
+        else:
+            self.local.tx = None
+            tx.commit()
+            self.end_transaction(commit=True)
         return
 
     def set_node_nid(self, node_id):
@@ -869,8 +1792,7 @@ class NeoStore:
         :param node_id: Neo4J ID of the node
         :return: nothing, nid should be set.
         """
-        query = "MATCH (n) WHERE id(n)={node_id} SET n.nid='{nid}' RETURN n.nid"
-        self.graph.run(query.format(node_id=node_id, nid=str(uuid.uuid4())))
+        self.run("set_node_nid", node_id=node_id, nid=str(uuid.uuid4()))
         return
 
 
@@ -889,6 +1811,35 @@ def nodelist_from_cursor(cursor):
     return list(node_list)
 
 
+def section_label(labels):
+    """
+    This function returns the label that a node is dumped for: the first label of the node in cypher.nid_labels, or
+    the first label in alphabetical order for a node without a label in nid_labels. The Node label is not a section.
+    @param labels: Labels of the node
+    @return: Label, or None for a node without labels.
+    """
+    for label in nid_labels:
+        if label in labels:
+            return label
+    return min((label for label in labels if label != node_label), default=None)
+
+
+def to_date(ds):
+    """
+    This function converts a Calendar key 'YYYY-MM-DD' to a datetime.date.
+    @param ds: datetime.date or Calendar key 'YYYY-MM-DD'.
+    @return: datetime.date, or False if ds could not be converted.
+    """
+    if isinstance(ds, str):
+        try:
+            ds = datetime.strptime(ds, '%Y-%m-%d').date()
+        except ValueError:
+            return False
+    if isinstance(ds, date):
+        return ds
+    return False
+
+
 def validate_node(node, label):
     """
     BE CAREFUL: has_label does not always work for unknown reason.
@@ -0,0 +1,462 @@
+"""
+This module has a sqlite store that implements the NeoStore interface. The graph is kept in the components, labels and
+relations tables of lib/datastore, the same tables as the sqlite dump of Tools/neo2sql.py. So a dump can be used as the
+store directly.
+Nodes are returned as py2neo Node objects. Traversals use the indexes on labels and relations. The heavier domain
+queries are implemented as a single indexed SQL statement, the other named statements are inherited from the MemStore.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from py2neo import Node
+from competition.memstore import MemStore, MemCursor
+from lib import datastore
+
+# Select clause for nodes: all properties and the labels, separated by '|'.
+node_select = """
+    SELECT c.*, (SELECT group_concat(l.label, '|') FROM labels l WHERE l.nid = c.nid) as node_labels
+    FROM components c
+"""
+
+
+class SqlGraph:
+    """
+    This class has the same graph primitives as the MemGraph, on the sqlite tables. Every thread has its own
+    connection. Changes are committed immediately, unless a transaction is open on the thread.
+    A transaction is started with an explicit BEGIN. The sqlite3 module then does not commit before a statement that
+    is not a DML statement, so a column that is added in the transaction is committed or rolled back with it.
+    """
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.local = threading.local()
+        # Only used for date nodes, to make sure that a date node is created once.
+        self.lock = threading.RLock()
+        # Connections of all threads, to close them.
+        self.connections = []
+        ds = self.ds()
+        ds.create_tables()
+        ds.create_indexes()
+        ds.add_column("components", "rank")
+        self.columns = ds.get_key_list("components")
+        return
+
+    def ds(self):
+        """
+        Returns the DataStore (connection) of the current thread.
+        """
+        ds = getattr(self.local, "ds", None)
+        if ds is None:
+            ds = datastore.DataStore(self.dbfile)
+            self.local.ds = ds
+            self.local.tx = False
+            with self.lock:
+                self.connections.append(ds)
+        return ds
+
+    def close(self):
+        """
+        Closes the connections of all threads. The sqlite file can be removed then, also on Windows.
+        """
+        with self.lock:
+            for ds in self.connections:
+                ds.close_connection()
+            self.connections = []
+        self.local = threading.local()
+        return
+
+    def execute(self, query, params=()):
+        return self.ds().dbConn.execute(query, params)
+
+    def commit(self):
+        if not self.local.tx:
+            self.ds().dbConn.commit()
+        return
+
+    def begin(self):
+        ds = self.ds()
+        ds.dbConn.isolation_level = None
+        ds.dbConn.execute("BEGIN")
+        self.local.tx = True
+        return
+
+    def end(self, commit=True):
+        self.local.tx = False
+        ds = self.ds()
+        if commit:
+            ds.dbConn.execute("COMMIT")
+        else:
+            ds.dbConn.execute("ROLLBACK")
+            # Columns that were added in the transaction are gone.
+            self.columns = ds.get_key_list("components")
+        ds.dbConn.isolation_level = ""
+        return
+
+    @staticmethod
+    def row2node(row):
+        props = dict((key, row[key]) for key in row.keys() if key != "node_labels" and row[key] is not None)
+        labels = row["node_labels"].split("|") if row["node_labels"] else []
+        return Node(*labels, **props)
+
+    def select(self, tail, params=()):
+        """
+        Returns the nodes from the components table (alias c) for the query tail (joins, where and order by clauses).
+        """
+        return [self.row2node(row) for row in self.execute(node_select + tail, params)]
+
+    def nodes_for(self, nids):
+        """
+        Returns a dictionary nid: Node for the list of nids, in one query.
+        """
+        nids = list(set(nids))
+        nodes = {}
+        # Stay below the sqlite limit on the number of parameters.
+        for pos in range(0, len(nids), 500):
+            part = nids[pos:pos + 500]
+            tail = "WHERE c.nid IN ({vt})".format(vt=", ".join(["?"] * len(part)))
+            for node in self.select(tail, part):
+                nodes[node["nid"]] = node
+        return nodes
+
+    def add_columns(self, node):
+        for key in node.keys():
+            if key not in self.columns:
+                self.ds().add_column("components", key)
+                self.columns.append(key)
+        return
+
+    def clear(self):
+        for table in datastore.DataStore.tables:
+            self.execute("DELETE FROM {t}".format(t=table))
+        self.commit()
+        return
+
+    def add_node(self, node):
+        self.add_columns(node)
+        keys = list(node.keys())
+        query = "INSERT INTO components ({cols}) VALUES ({vt})".format(cols=", ".join(keys),
+                                                                      vt=", ".join(["?"] * len(keys)))
+        self.execute(query, [node[key] for key in keys])
+        for label in node.labels():
+            self.execute("INSERT INTO labels (label, nid) VALUES (?, ?)", (label, node["nid"]))
+        self.commit()
+        return node
+
+    def delete_node(self, nid):
+        self.execute("DELETE FROM relations WHERE from_nid = ? OR to_nid = ?", (nid, nid))
+        self.execute("DELETE FROM labels WHERE nid = ?", (nid,))
+        self.execute("DELETE FROM components WHERE nid = ?", (nid,))
+        self.commit()
+        return True
+
+    def update_node(self, node):
+        self.add_columns(node)
+        cols = [col for col in self.columns if col != "nid"]
+        query = "UPDATE components SET {sets} WHERE nid = ?".format(sets=", ".join(col + " = ?" for col in cols))
+        self.execute(query, [node[col] for col in cols] + [node["nid"]])
+        self.commit()
+        return
+
+    def add_rel(self, start_nid, rel_type, end_nid):
+        query = "SELECT 1 FROM relations WHERE from_nid = ? AND rel = ? AND to_nid = ?"
+        if not self.execute(query, (start_nid, rel_type, end_nid)).fetchone():
+            self.execute("INSERT INTO relations (rel, from_nid, to_nid) VALUES (?, ?, ?)",
+                         (rel_type, start_nid, end_nid))
+            self.commit()
+        return
+
+    def delete_rel(self, start_nid, rel_type, end_nid):
+        self.execute("DELETE FROM relations WHERE from_nid = ? AND rel = ? AND to_nid = ?",
+                     (start_nid, rel_type, end_nid))
+        self.commit()
+        return
+
+    def node(self, nid):
+        nodes = self.select("WHERE c.nid = ?", (nid,))
+        if nodes:
+            return nodes[0]
+        return None
+
+    def find(self, *labels, **props):
+        tail = []
+        params = []
+        for label in labels:
+            tail.append("EXISTS (SELECT 1 FROM labels l WHERE l.nid = c.nid AND l.label = ?)")
+            params.append(label)
+        for key, value in props.items():
+            if key not in self.columns:
+                # No node has this property.
+                return []
+            tail.append("c.{key} = ?".format(key=key))
+            params.append(value)
+        if tail:
+            return self.select("WHERE " + " AND ".join(tail), params)
+        return self.select("", params)
+
+    def all_nids(self):
+        return [row["nid"] for row in self.execute("SELECT nid FROM components")]
+
+    def degree(self, nid):
+        query = "SELECT count(*) as cnt FROM relations WHERE from_nid = ? OR to_nid = ?"
+        return self.execute(query, (nid, nid)).fetchone()["cnt"]
+
+    def relations(self):
+        return [(row["from_nid"], row["rel"], row["to_nid"])
+                for row in self.execute("SELECT from_nid, rel, to_nid FROM relations")]
+
+    def out_nids(self, nid, rel_type=None):
+        if rel_type is None:
+            res = self.execute("SELECT to_nid FROM relations WHERE from_nid = ? ORDER BY rowid", (nid,))
+        else:
+            res = self.execute("SELECT to_nid FROM relations WHERE from_nid = ? AND rel = ? ORDER BY rowid",
+                               (nid, rel_type))
+        return [row["to_nid"] for row in res]
+
+    def in_nids(self, nid, rel_type=None):
+        if rel_type is None:
+            res = self.execute("SELECT from_nid FROM relations WHERE to_nid = ? ORDER BY rowid", (nid,))
+        else:
+            res = self.execute("SELECT from_nid FROM relations WHERE to_nid = ? AND rel = ? ORDER BY rowid",
+                               (nid, rel_type))
+        return [row["from_nid"] for row in res]
+
+    # Methods used by NeoStore on the object returned by method db()
+
+    def create(self, node):
+        self.add_node(node)
+        return
+
+    def merge(self, rel):
+        self.add_rel(rel.start_node()["nid"], rel.type(), rel.end_node()["nid"])
+        return
+
+    def push(self, node):
+        self.update_node(node)
+        return
+
+    @staticmethod
+    def exists(node):
+        if not isinstance(node, Node):
+            raise TypeError("Node expected")
+        return True
+
+
+class SqlStore(MemStore):
+    """
+    Sqlite implementation of the NeoStore. Statements are not serialized, sqlite handles concurrent access.
+    """
+
+    def __init__(self, dbfile=None):
+        """
+        Method to instantiate the sqlite store.
+
+        :param dbfile: Full path to the sqlite database. The tables and indexes are created if required.
+
+        :return: Object to handle neostore commands.
+        """
+        self.mem = None
+        # Thread local storage, for the node cache.
+        self.local = threading.local()
+        # Date nodes are found on the key index, the date cache is not used.
+        self.date_cache = {}
+        self.init_data_version()
+        if dbfile:
+            self.mem = SqlGraph(dbfile)
+        return
+
+    def init_app(self, app):
+        """
+        This method will open the sqlite database from the application configuration (STORE_FILE) and configure the
+        slow query log.
+
+        :param app: Flask application object.
+
+        :return:
+        """
+        self.mem = SqlGraph(app.config.get('STORE_FILE'))
+        self.new_data_version()
+        logging.info("Sqlite store on {dbfile}".format(dbfile=app.config.get('STORE_FILE')))
+        self.init_slow_query_log(app)
+        return
+
+    def close(self):
+        """
+        This method will close the sqlite connections of all threads.
+
+        :return:
+        """
+        self.mem.close()
+        return
+
+    def run(self, stmt_name, **params):
+        """
+        This method will run the named statement on the sqlite store.
+        :param stmt_name: Name of the statement in the registry.
+        :param params: Parameters for the statement.
+        :return: MemCursor with the result of the statement.
+        """
+        with self.query_timer("run", stmt_name, params) as rec:
+            records = getattr(self, "query_" + stmt_name)(**params)
+            rec["rows"] = len(records)
+        return MemCursor(records)
+
+    def get_nodes(self, *labels, **props):
+        """
+        This method will select all nodes that have labels and properties
+        @param labels:
+        @param props:
+        @return: list of nodes that fulfill the criteria
+        """
+        with self.query_timer("select", ":".join(labels), props) as rec:
+            nodes = self.mem.find(*labels, **props)
+            rec["rows"] = len(nodes)
+        return nodes
+
+    @contextmanager
+    def transaction(self):
+        """
+        This method opens a transaction on the sqlite connection of the current thread. The transaction is committed at
+        the end of the with block, or rolled back if an exception is raised in the with block.
+
+        :return:
+        """
+        if getattr(self.local, "tx", None) is not None:
+            yield
+            return
+        self.mem.begin()
+        self.local.tx = self.mem
+        try:
+            yield
+        except Exception:
+            self.mem.end(commit=False)
+            self.end_transaction(commit=False)
+            self.clear_node_cache()
+            raise
+        else:
+            self.mem.end(commit=True)
+            self.end_transaction(commit=True)
+        finally:
+            self.local.tx = None
+        return
+
+    # Named statements as indexed SQL.
+
+    def query_next_participant(self, race_id):
+        query = """
+            SELECT person.nid as nid, person.name as name
+            FROM relations r_has
+            JOIN labels lp ON lp.label = 'Person'
+            JOIN components person ON person.nid = lp.nid
+            WHERE r_has.to_nid = ? AND r_has.rel = 'has'
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_has.to_nid AND l.label = 'Race')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_has.from_nid AND l.label = 'Organization')
+              AND NOT EXISTS (SELECT 1
+                              FROM relations r_is
+                              JOIN relations r_part ON r_part.from_nid = r_is.to_nid AND r_part.rel = 'participates'
+                              JOIN relations r_org ON r_org.to_nid = r_part.to_nid AND r_org.rel = 'has'
+                              WHERE r_is.from_nid = person.nid AND r_is.rel = 'is'
+                                AND r_org.from_nid = r_has.from_nid)
+            ORDER BY name ASC
+        """
+        return [dict(nid=row["nid"], name=row["name"]) for row in self.mem.execute(query, (race_id,))]
+
+    def query_overview(self, cat):
+        query = """
+            SELECT person.nid as pers_nid, r_has.from_nid as org_nid, race.name as race, part.pos as pos,
+                   part.points as points
+            FROM components mf
+            JOIN relations r_mf ON r_mf.to_nid = mf.nid AND r_mf.rel = 'mf'
+            JOIN components person ON person.nid = r_mf.from_nid
+            JOIN relations r_is ON r_is.from_nid = person.nid AND r_is.rel = 'is'
+            JOIN components part ON part.nid = r_is.to_nid
+            JOIN relations r_part ON r_part.from_nid = part.nid AND r_part.rel = 'participates'
+            JOIN components race ON race.nid = r_part.to_nid
+            JOIN relations r_has ON r_has.to_nid = race.nid AND r_has.rel = 'has'
+            WHERE mf.name = ?
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = mf.nid AND l.label = 'MF')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = person.nid AND l.label = 'Person')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = part.nid AND l.label = 'Participant')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = race.nid AND l.label = 'Race')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_has.from_nid AND l.label = 'Organization')
+        """
+        return [dict(row) for row in self.mem.execute(query, (cat,))]
+
+    def query_participant_ranks(self, race_id):
+        query = """
+            SELECT part.nid as nid, part.rank as rank
+            FROM relations r
+            JOIN components part ON part.nid = r.from_nid
+            WHERE r.to_nid = ? AND r.rel = 'participates'
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r.to_nid AND l.label = 'Race')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = part.nid AND l.label = 'Participant')
+            ORDER BY part.rank IS NULL, part.rank
+        """
+        return [dict(nid=row["nid"], rank=row["rank"]) for row in self.mem.execute(query, (race_id,))]
+
+    def query_participant_seq_list(self, race_id):
+        tail = """
+            JOIN relations r ON r.from_nid = c.nid AND r.rel = 'participates'
+            WHERE r.to_nid = ?
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r.to_nid AND l.label = 'Race')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = c.nid AND l.label = 'Participant')
+            ORDER BY c.rank IS NULL, c.rank
+        """
+        return [dict(part=part) for part in self.mem.select(tail, (race_id,))]
+
+    def query_persons_nr_races(self):
+        query = """
+            SELECT person.nid as nid, person.name as name, count(r_part.to_nid) as nr_races
+            FROM labels lp
+            JOIN components person ON person.nid = lp.nid
+            LEFT JOIN relations r_is ON r_is.from_nid = person.nid AND r_is.rel = 'is'
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_is.to_nid AND l.label = 'Participant')
+            LEFT JOIN relations r_part ON r_part.from_nid = r_is.to_nid AND r_part.rel = 'participates'
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_part.to_nid AND l.label = 'Race')
+            WHERE lp.label = 'Person'
+            GROUP BY person.nid
+            ORDER BY nr_races DESC, name ASC
+        """
+        return [dict(row) for row in self.mem.execute(query)]
+
+    def query_points_per_category(self, cat):
+        query = """
+            SELECT person.name as name, person.nid as nid, part.nid as part_nid, part.points as points
+            FROM components mf
+            JOIN relations r_mf ON r_mf.to_nid = mf.nid AND r_mf.rel = 'mf'
+            JOIN components person ON person.nid = r_mf.from_nid
+            JOIN relations r_is ON r_is.from_nid = person.nid AND r_is.rel = 'is'
+            JOIN components part ON part.nid = r_is.to_nid
+            WHERE mf.name = ?
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = mf.nid AND l.label = 'MF')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = person.nid AND l.label = 'Person')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = part.nid AND l.label = 'Participant')
+        """
+        return [dict(row) for row in self.mem.execute(query, (cat,))]
+
+    def query_race4person(self, pers_id):
+        query = """
+            SELECT r_is.to_nid as part, r_part.to_nid as race, r_has.from_nid as org, r_on.to_nid as day,
+                   r_type.to_nid as racetype, r_in.to_nid as loc
+            FROM relations r_is
+            JOIN relations r_part ON r_part.from_nid = r_is.to_nid AND r_part.rel = 'participates'
+            JOIN relations r_has ON r_has.to_nid = r_part.to_nid AND r_has.rel = 'has'
+            JOIN relations r_on ON r_on.from_nid = r_has.from_nid AND r_on.rel = 'On'
+            JOIN relations r_type ON r_type.from_nid = r_part.to_nid AND r_type.rel = 'type'
+            JOIN relations r_in ON r_in.from_nid = r_has.from_nid AND r_in.rel = 'In'
+            JOIN components day ON day.nid = r_on.to_nid
+            WHERE r_is.from_nid = ? AND r_is.rel = 'is'
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_is.from_nid AND l.label = 'Person')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_is.to_nid AND l.label = 'Participant')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_part.to_nid AND l.label = 'Race')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_has.from_nid AND l.label = 'Organization')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = day.nid AND l.label = 'Day')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_type.to_nid AND l.label = 'RaceType')
+              AND EXISTS (SELECT 1 FROM labels l WHERE l.nid = r_in.to_nid AND l.label = 'Location')
+            ORDER BY day.key ASC
+        """
+        fields = ["race", "part", "day", "org", "racetype", "loc"]
+        rows = self.mem.execute(query, (pers_id,)).fetchall()
+        # Get all nodes for the result in one query.
+        nodes = self.mem.nodes_for([row[field] for row in rows for field in fields])
+        return [dict((field, nodes[row[field]]) for field in fields) for row in rows]
@@ -75,7 +75,7 @@ class DataStore:
         # Get the field names from Protege - Slots, where Value Type is not Instance.
         # class and protege_id are fixed and should always be there.
         query = """
-        CREATE TABLE components
+        CREATE TABLE IF NOT EXISTS components
             (beschrijving text,
              born text,
              city text,
@@ -88,9 +88,10 @@ class DataStore:
              points integer,
              pos integer,
              pwd text,
+             rank integer,
              rel_pos integer,
              remark text,
-             weight text,
+             weight integer,
              year integer
             )
         """
@@ -101,7 +102,7 @@ class DataStore:
     def create_table_relations(self):
         # Create table
         query = """
-        CREATE TABLE relations
+        CREATE TABLE IF NOT EXISTS relations
             (rel text not null,
              from_nid text not null,
              to_nid text not null)
@@ -113,7 +114,7 @@ class DataStore:
     def create_table_labels(self):
         # Create table
         query = """
-        CREATE TABLE labels
+        CREATE TABLE IF NOT EXISTS labels
             (label text not null,
              nid text not null)
         """
@@ -121,6 +122,44 @@ class DataStore:
         logging.info("Table labels is build.")
         return True
 
+    def create_indexes(self):
+        """
+        This method will create the indexes that are required to use the tables as a graph store: labels and relations
+        are searched on nid from both ends, and nodes are searched on name and key (date nodes).
+        @return:
+        """
+        indexes = [
+            "CREATE INDEX IF NOT EXISTS labels_nid ON labels (nid, label)",
+            "CREATE INDEX IF NOT EXISTS labels_label ON labels (label, nid)",
+            "CREATE INDEX IF NOT EXISTS relations_from ON relations (from_nid, rel)",
+            "CREATE INDEX IF NOT EXISTS relations_to ON relations (to_nid, rel)",
+            "CREATE INDEX IF NOT EXISTS relations_rel ON relations (rel)",
+            "CREATE INDEX IF NOT EXISTS components_name ON components (name)",
+            "CREATE INDEX IF NOT EXISTS components_key ON components (key)"
+        ]
+        for query in indexes:
+            self.dbConn.execute(query)
+        self.dbConn.commit()
+        logging.info("Indexes are build.")
+        return True
+
+    def add_column(self, tablename, column):
+        """
+        This method will add a column to the table, if the column is not there yet. If a transaction is open on the
+        connection, then the column is added in the transaction and the caller commits.
+        @param tablename: Name of the table
+        @param column: Name of the column. This must be a valid identifier, it is not quoted.
+        @return: True if the column has been added, False if it existed already.
+        """
+        if column in self.get_key_list(tablename):
+            return False
+        query = "ALTER TABLE {t} ADD COLUMN {c}".format(t=tablename, c=column)
+        self.dbConn.execute(query)
+        if not self.dbConn.in_transaction:
+            self.dbConn.commit()
+        logging.info("Column {c} added to table {t}".format(c=column, t=tablename))
+        return True
+
     def insert_row(self, tablename, rowdict):
         columns = ", ".join(rowdict.keys())
         values_template = ", ".join(["?"] * len(rowdict.keys()))
@@ -131,6 +170,44 @@ class DataStore:
         self.dbConn.commit()
         return
 
+    def insert_rows(self, tablename, columns, rows):
+        """
+        This method will insert a list of rows in a single statement. The rows are not committed, so many calls can be
+        done in one transaction. Call method commit at the end of the transaction.
+        @param tablename: Name of the table
+        @param columns: List of column names
+        @param rows: List of tuples, with values in sequence of the columns.
+        @return:
+        """
+        query = "insert into {tn} ({cols}) values ({vt})".format(tn=tablename, cols=", ".join(columns),
+                                                                 vt=", ".join(["?"] * len(columns)))
+        self.dbConn.executemany(query, rows)
+        return
+
+    def commit(self):
+        self.dbConn.commit()
+        return
+
+    def set_wal(self):
+        """
+        This method will set the journal mode of the database to Write-Ahead Logging. Writes are appended to the log,
+        and are not synced to disk for every transaction. This is faster for bulk loads.
+        @return:
+        """
+        self.dbConn.execute("PRAGMA journal_mode=WAL")
+        self.dbConn.execute("PRAGMA synchronous=NORMAL")
+        return
+
+    def reset_wal(self):
+        """
+        This method will set the journal mode of the database back to the default rollback journal, after a bulk load
+        with set_wal. The log is written into the database, so the database is a single file again.
+        @return:
+        """
+        self.dbConn.execute("PRAGMA journal_mode=DELETE")
+        self.dbConn.execute("PRAGMA synchronous=FULL")
+        return
+
     def get_records(self, tablename):
         """
         This method will return all components with all attributes from the components table 'in_bereik'.
@@ -153,6 +230,38 @@ class DataStore:
         key_list = [description[0] for description in cursor.description]
         return key_list
 
+    def get_labeled_components(self, offset=0):
+        """
+        This method will return the components with their label in a single query, sorted on label and nid. For a
+        component with more than one label, the first label in alphabetical order is returned. The rows are read from
+        the cursor when the caller iterates, so the components are not in memory at once.
+        @param offset: Number of rows to skip, to continue a previous read.
+        @return: Cursor on the components, with the label in column node_label.
+        """
+        query = """
+        SELECT components.*, min(labels.label) AS node_label
+        FROM components
+        JOIN labels ON labels.nid = components.nid
+        GROUP BY components.nid
+        ORDER BY node_label, components.nid
+        LIMIT -1 OFFSET ?
+        """
+        return self.dbConn.execute(query, (offset,))
+
+    def get_sorted_relations(self, offset=0):
+        """
+        This method will return the relations sorted on relation type, in a single query.
+        @param offset: Number of rows to skip, to continue a previous read.
+        @return: Cursor on the relations, with columns rel, from_nid and to_nid.
+        """
+        query = """
+        SELECT rel, from_nid, to_nid
+        FROM relations
+        ORDER BY rel, rowid
+        LIMIT -1 OFFSET ?
+        """
+        return self.dbConn.execute(query, (offset,))
+
     def get_label(self, nid):
         """
         This method will get the label for the node with nid.
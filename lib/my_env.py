@@ -72,6 +72,33 @@ def init_loghandler(scriptname, logdir, loglevel):
     return logger
 
 
+def init_file_logger(logname, scriptname, logdir, loglevel="info"):
+    """
+    This function initializes a named logger that writes to a rotating file of its own, beside the logfile of
+    init_loghandler. Logfilename consists of calling module name + logname + computername. Messages do not go to the
+    root logger, so they do not show up in the application log.
+    :param logname: Name of the logger, use logging.getLogger(logname) to write to the file.
+    :param scriptname: Name of the calling module.
+    :param logdir: Directory of the logfile.
+    :param loglevel: The loglevel for logging.
+    :return: logger
+    """
+    logger = logging.getLogger(logname)
+    logger.setLevel(logging.getLevelName(loglevel.upper()))
+    logger.propagate = False
+    if logger.handlers:
+        # Logger is initialized already.
+        return logger
+    modulename = get_modulename(scriptname)
+    computername = platform.node()
+    logfile = logdir + "/" + modulename + "_" + logname + "_" + computername + ".log"
+    maxbytes = 1024 * 1024
+    rfh = logging.handlers.RotatingFileHandler(logfile, maxBytes=maxbytes, backupCount=5)
+    rfh.setFormatter(logging.Formatter(fmt='%(asctime)s|%(levelname)s|%(message)s', datefmt='%d/%m/%Y|%H:%M:%S'))
+    logger.addHandler(rfh)
+    return logger
+
+
 def datestr2date(datestr):
     """
     This method will convert datestring to date type. Datestring must be of the form YYYY-MM-DD
@@ -0,0 +1,256 @@
+"""
+This procedure will test the in-memory store. The store is filled in the test, no database or dump is required.
+"""
+
+import gzip
+import os
+import tempfile
+import unittest
+
+from competition import memstore, neostore
+
+# Import py2neo to test on class types
+from py2neo import Node
+
+
+class MemStoreCase(unittest.TestCase):
+    """
+    Fixture for the tests on a store: one organization with one race and three participants in a chain of arrivals,
+    without rank. The class has no tests, it is the base class for the test classes.
+    """
+
+    @staticmethod
+    def create_store():
+        return memstore.MemStore()
+
+    def setUp(self):
+        # Initialize an empty store with one race and three participants.
+        self.ns = self.create_store()
+        self.ns.init_graph()
+        self.org = self.ns.create_node("Organization", name="Test Organization")
+        self.race = self.ns.create_node("Race", name="10 km")
+        self.ns.create_relation(from_node=self.org, rel="has", to_node=self.race)
+        self.ns.create_relation(from_node=self.race, rel="type", to_node=self.ns.get_node("RaceType",
+                                                                                          name="Hoofdwedstrijd"))
+        self.parts = []
+        for name in ["Anna", "Bert", "Carla"]:
+            person = self.ns.create_node("Person", name=name)
+            part = self.ns.create_node("Participant")
+            self.ns.create_relation(from_node=person, rel="is", to_node=part)
+            self.ns.create_relation(from_node=part, rel="participates", to_node=self.race)
+            if self.parts:
+                self.ns.create_relation(from_node=part, rel="after", to_node=self.parts[-1])
+            self.parts.append(part)
+
+
+# @unittest.skip("Focus on Coverage")
+class TestMemStore(MemStoreCase):
+
+    def test_get_nodes(self):
+        # Lookup on label and on label and property
+        self.assertEqual(len(self.ns.get_nodes("Person")), 3)
+        persons = self.ns.get_nodes("Person", name="Bert")
+        self.assertEqual(len(persons), 1)
+        self.assertTrue(isinstance(persons[0], Node))
+        self.assertEqual(self.ns.get_nodes("Person", name="Nobody"), [])
+        # Index follows property updates
+        self.ns.node_update(nid=persons[0]["nid"], name="Bart")
+        self.assertEqual(self.ns.get_nodes("Person", name="Bert"), [])
+        self.assertEqual(len(self.ns.get_nodes("Person", name="Bart")), 1)
+
+    def test_node(self):
+        nid = self.race["nid"]
+        self.assertTrue(neostore.validate_node(self.ns.node(nid), "Race"))
+        self.assertFalse(self.ns.node("BestaatNiet"))
+
+    def test_neighbours(self):
+        race_nid = self.race["nid"]
+        self.assertEqual(self.ns.get_start_node(end_node_id=race_nid, rel_type="has"), self.org["nid"])
+        self.assertEqual(len(self.ns.get_start_nodes(end_node_id=race_nid, rel_type="participates")), 3)
+        self.assertEqual(self.ns.get_end_nodes(start_node_id=self.org["nid"], rel_type="has"), [race_nid])
+        self.assertFalse(self.ns.get_end_node(start_node_id=race_nid, rel_type="has"))
+
+    def test_participant_seq_list(self):
+        # Race is ranked from the after chain on first read.
+        race_nid = self.race["nid"]
+        node_list = self.ns.get_participant_seq_list(race_nid)
+        self.assertEqual([part["nid"] for part in node_list], [part["nid"] for part in self.parts])
+        self.assertEqual(node_list[2]["rank"], 3 * neostore.rank_gap)
+
+    def test_cat4race(self):
+        # Participants without category are in the list, with category None.
+        dames = self.ns.get_node("MF", name="Dames")
+        anna = self.ns.get_node("Person", name="Anna")
+        self.ns.create_relation(from_node=anna, rel="mf", to_node=dames)
+        cat4part = self.ns.get_cat4race(self.race["nid"])
+        self.assertEqual(len(cat4part), 3)
+        self.assertEqual(cat4part[self.parts[0]["nid"]]["cat"], "Dames")
+        self.assertIsNone(cat4part[self.parts[1]["nid"]]["cat"])
+        self.assertEqual(cat4part[self.parts[1]["nid"]]["name"], "Bert")
+
+    def test_next_participants(self):
+        # Persons that do not participate in the organization yet, and the number of races for every person.
+        dirk = self.ns.create_node("Person", name="Dirk")
+        self.assertEqual(self.ns.get_next_participants(self.race["nid"]), [[dirk["nid"], "Dirk"]])
+        self.assertEqual([rec[1:] for rec in self.ns.get_persons_nr_races()],
+                         [["Anna", 1], ["Bert", 1], ["Carla", 1], ["Dirk", 0]])
+
+    def test_overview(self):
+        heren = self.ns.get_node("MF", name="Heren")
+        for name in ["Anna", "Bert"]:
+            self.ns.create_relation(from_node=self.ns.get_node("Person", name=name), rel="mf", to_node=heren)
+        self.ns.participants_set_attribs([dict(nid=part["nid"], points=10, pos=cnt)
+                                          for (cnt, part) in enumerate(self.parts, start=1)])
+        overview = self.ns.get_overview("Heren")
+        bert = self.ns.get_node("Person", name="Bert")
+        self.assertEqual(len(overview), 2)
+        self.assertEqual(overview[bert["nid"]][self.org["nid"]], dict(race=dict(name="10 km"),
+                                                                      part=dict(pos=2, points=10)))
+        self.assertEqual(self.ns.get_overview("Dames"), {})
+
+    def test_add_participants(self):
+        # Participants are added after the last participant, in sequence of the list.
+        race_nid = self.race["nid"]
+        rows = []
+        for (cnt, name) in enumerate(["Dirk", "Els"], start=4):
+            person = self.ns.create_node("Person", name=name)
+            rows.append(dict(pers_nid=person["nid"], props=dict(rank=cnt * neostore.rank_gap, pos=cnt)))
+        part_nids = self.ns.add_participants(race_nid, rows, prev_part_id=self.parts[-1]["nid"])
+        node_list = self.ns.get_participant_seq_list(race_nid)
+        self.assertEqual([part["nid"] for part in node_list], [part["nid"] for part in self.parts] + part_nids)
+        self.assertEqual(node_list[4]["pos"], 5)
+        self.assertEqual(self.ns.get_end_node(start_node_id=part_nids[0], rel_type="after"), self.parts[-1]["nid"])
+
+    def test_race_list(self):
+        # Races are in sequence of the race type weight, then on name. Weights 10, 20 and 100 sort as numbers.
+        for (name, racetype) in [("2 km", "Deelname"), ("5 km", "Bijwedstrijd"), ("1 km", "Bijwedstrijd")]:
+            race = self.ns.create_node("Race", name=name)
+            self.ns.create_relation(from_node=self.org, rel="has", to_node=race)
+            self.ns.create_relation(from_node=race, rel="type", to_node=self.ns.get_node("RaceType", name=racetype))
+        self.assertEqual([(rec["race"], rec["type"]) for rec in self.ns.get_race_list(self.org["nid"])],
+                         [("10 km", "Hoofdwedstrijd"), ("1 km", "Bijwedstrijd"), ("5 km", "Bijwedstrijd"),
+                          ("2 km", "Deelname")])
+
+    def test_stream_nodes(self):
+        # Every node once, with the outgoing relations.
+        nodes = dict((node["nid"], rels) for (node, rels) in self.ns.stream_nodes(batch=2))
+        self.assertEqual(len(nodes), self.ns.node_count())
+        self.assertEqual(sorted(nodes[self.parts[1]["nid"]]),
+                         [("after", self.parts[0]["nid"]), ("participates", self.race["nid"])])
+
+    def test_snapshot(self):
+        # Export and import give the same nodes and relations, an incomplete snapshot is refused.
+        (fd, snapshot) = tempfile.mkstemp(suffix=".jsonl.gz")
+        os.close(fd)
+        nodes = dict((node["nid"], dict(node)) for (node, rels) in self.ns.stream_nodes())
+        rels = sorted(self.ns.stream_relations())
+        self.assertEqual(self.ns.export_snapshot(snapshot, batch=2), (len(nodes), len(rels)))
+        self.ns.create_node("Person", name="Dirk")
+        self.assertEqual(self.ns.import_snapshot(snapshot, batch=2), (len(nodes), len(rels)))
+        self.assertEqual(dict((node["nid"], dict(node)) for (node, rels) in self.ns.stream_nodes()), nodes)
+        self.assertEqual(sorted(self.ns.stream_relations()), rels)
+        self.assertEqual(self.ns.get_nodes("Person", name="Dirk"), [])
+        with gzip.open(snapshot, "rt", encoding="utf-8") as fh:
+            lines = fh.readlines()
+        with gzip.open(snapshot, "wt", encoding="utf-8") as fh:
+            fh.writelines(lines[:-1])
+        self.assertRaises(ValueError, self.ns.import_snapshot, snapshot)
+        os.remove(snapshot)
+
+    def test_remove_node(self):
+        # Node with relations is not removed, unless forced.
+        nid = self.parts[1]["nid"]
+        self.assertFalse(self.ns.remove_node(nid))
+        self.assertTrue(self.ns.remove_node_force(nid))
+        self.assertFalse(self.ns.node(nid))
+        self.assertEqual(len(self.ns.get_start_nodes(end_node_id=self.race["nid"], rel_type="participates")), 2)
+
+    def test_transaction(self):
+        # Changes are undone if the transaction fails.
+        try:
+            with self.ns.transaction():
+                self.ns.create_node("Person", name="Rollback")
+                self.ns.remove_node_force(self.parts[0]["nid"])
+                self.ns.node_update(nid=self.race["nid"], name="21 km")
+                raise ValueError("Rollback")
+        except ValueError:
+            pass
+        self.assertEqual(self.ns.get_nodes("Person", name="Rollback"), [])
+        self.assertTrue(self.ns.node(self.parts[0]["nid"]))
+        self.assertEqual(self.ns.get_end_node(start_node_id=self.parts[1]["nid"], rel_type="after"),
+                         self.parts[0]["nid"])
+        self.assertEqual(self.ns.node(self.race["nid"])["name"], "10 km")
+
+    def test_date_node(self):
+        day = self.ns.date_node("2017-05-13")
+        self.assertEqual(day["key"], "2017-05-13")
+        self.assertEqual(self.ns.date_node("2017-05-13")["nid"], day["nid"])
+        self.assertEqual(len(self.ns.get_nodes("Month")), 1)
+        self.assertFalse(self.ns.date_node("Ongeldig"))
+        # Lookup does not create date nodes
+        self.assertEqual(self.ns.find_date_node("2017-05-13")["nid"], day["nid"])
+        self.assertFalse(self.ns.find_date_node("2018-01-01"))
+        self.assertEqual(len(self.ns.get_nodes("Day")), 1)
+        # Date in use is not removed, unused date is removed up to the month that is still in use.
+        self.ns.create_relation(from_node=self.org, rel="On", to_node=day)
+        self.ns.date_node("2017-05-20")
+        self.assertEqual(self.ns.remove_date("2017-05-13"), 0)
+        self.assertEqual(self.ns.remove_date("2017-05-20"), 1)
+        self.assertEqual(len(self.ns.get_nodes("Day")), 1)
+        self.assertEqual(len(self.ns.get_nodes("Month")), 1)
+
+    def test_data_version(self):
+        # Writes change the data version, reads do not. In a transaction the version changes on commit only.
+        # The race is ranked on first read, the rank follows from the after chain so this is not a change.
+        version = self.ns.get_data_version()
+        self.assertEqual(self.ns.get_participant_seq_list(self.race["nid"])[0]["rank"], neostore.rank_gap)
+        self.ns.get_nodes("Person")
+        self.assertEqual(self.ns.get_data_version(), version)
+        self.ns.node_update(nid=self.race["nid"], name="20 km")
+        self.assertNotEqual(self.ns.get_data_version(), version)
+        version = self.ns.data_version
+        self.ns.node_update(nid=self.race["nid"], name="21 km")
+        self.assertNotEqual(self.ns.data_version, version)
+        version = self.ns.data_version
+        with self.ns.transaction():
+            self.ns.create_node("Person", name="Dirk")
+            self.assertEqual(self.ns.data_version, version)
+        self.assertNotEqual(self.ns.data_version, version)
+        version = self.ns.data_version
+        try:
+            with self.ns.transaction():
+                self.ns.create_node("Person", name="Rollback")
+                raise ValueError("Rollback")
+        except ValueError:
+            pass
+        self.assertEqual(self.ns.data_version, version)
+
+    def test_query_log(self):
+        # Statements are logged only while the query log is active.
+        self.assertIsNone(self.ns.stop_query_log())
+        self.ns.start_query_log()
+        self.ns.get_nodes("Person")
+        self.ns.get_participant_seq_list(self.race["nid"])
+        self.ns.create_node("Person", name="Dirk")
+        query_log = self.ns.stop_query_log()
+        self.assertEqual([(rec["kind"], rec["name"]) for rec in query_log][:2],
+                         [("select", "Person"), ("run", "participant_seq_list")])
+        self.assertEqual(query_log[0]["rows"], 3)
+        self.assertEqual(query_log[1]["params"], dict(race_id="str"))
+        self.assertEqual(query_log[-1]["kind"], "create")
+        self.ns.get_nodes("Person")
+        self.assertIsNone(self.ns.query_log())
+
+    def test_slow_query_log(self):
+        # With threshold 0, every statement is slow. Caller is the first function outside of the store.
+        self.ns.slow_query_ms = 0
+        self.ns.slow_query_profile = True
+        with self.assertLogs("slow_query", "WARNING") as cm:
+            self.ns.get_participant_seq_list(self.race["nid"])
+            self.ns.create_node("User", name="dirk", pwd="geheim")
+        self.assertIn("|run|participant_seq_list|tests.test_memstore.test_slow_query_log:", cm.output[0])
+        self.assertNotIn("geheim", cm.output[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
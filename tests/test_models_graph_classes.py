@@ -16,7 +16,7 @@ class TestModelGraph(unittest.TestCase):
         self.app = create_app('testing')
         self.app_ctx = self.app.app_context()
         self.app_ctx.push()
-        self.ns = neostore.NeoStore()
+        self.ns = mg.ns
 
     def tearDown(self):
         self.app_ctx.pop()
@@ -16,7 +16,7 @@ class TestModelGraph(unittest.TestCase):
         self.app = create_app('testing')
         self.app_ctx = self.app.app_context()
         self.app_ctx.push()
-        self.ns = neostore.NeoStore()
+        self.ns = mg.ns
 
     def tearDown(self):
         self.app_ctx.pop()
@@ -88,10 +88,29 @@ class TestModelGraph(unittest.TestCase):
         self.assertTrue(isinstance(person_node, list))
         self.assertTrue(isinstance(person_node[0], str))
         self.assertTrue((isinstance(person_node[1], str)))
+        # Sorted on name, and nobody that participates in a race of the organization already.
+        names = [person[1] for person in next_part]
+        self.assertEqual(names, sorted(names))
+        next_nids = [person[0] for person in next_part]
+        for org_race_id in mg.get_races_for_org(mg.get_org_id(race_id)):
+            for person in mg.participant_list(org_race_id):
+                self.assertNotIn(person[0], next_nids)
 
     # def test_organization_delete(self):
     #   This test is done in test_models_graph_classes.py
 
+    def test_results_for_category(self):
+        # Standings are sorted on points, each row is name, points, number of races and person nid.
+        result_set = mg.results_for_category("Dames")
+        self.assertTrue(isinstance(result_set, list))
+        points = [row[1] for row in result_set]
+        self.assertEqual(points, sorted(points, reverse=True))
+        # Points recalculated for a race must give the same standings as standings loaded from the database.
+        mg.points_for_race("332e1cce-e73e-4a87-bf78-acbdd05cbda3")
+        result_set = sorted(mg.results_for_category("Heren"))
+        mg.standings.clear()
+        self.assertEqual(sorted(mg.results_for_category("Heren")), result_set)
+
     def test_participant_after_list(self):
         # This is the participant_seq_list, with an object [-1, "Eerste Aankomst"] prepended
         race_id = "332e1cce-e73e-4a87-bf78-acbdd05cbda3"
@@ -117,6 +136,29 @@ class TestModelGraph(unittest.TestCase):
         first_nid = mg.participant_first_id(race_id)
         self.assertFalse(first_nid)
 
+    def test_participants_import(self):
+        # Import two finishers on name and nid after the last finisher, then remove them again.
+        race_id = "332e1cce-e73e-4a87-bf78-acbdd05cbda3"
+        last_id = mg.participant_last_id(race_id)
+        next_part = mg.next_participant(race_id)
+        rows = mg.finishers_from_csv(["person;pos;remark", "{name};12;".format(name=next_part[0][1]),
+                                      "{nid};;Test".format(nid=next_part[1][0])])
+        # Unknown person, nothing is imported
+        self.assertEqual(mg.participants_import(race_id, rows + [dict(person="BestaatNiet")])[0], 0)
+        self.assertEqual(mg.participant_last_id(race_id), last_id)
+        self.assertEqual(mg.participants_import(race_id, rows), (2, []))
+        finishers = mg.participant_after_list(race_id)
+        self.assertEqual([finisher[0] for finisher in finishers[-3:]], [last_id, next_part[0][0], next_part[1][0]])
+        for person in next_part[:2]:
+            mg.Participant(race_id=race_id, pers_id=person[0]).remove()
+        self.assertEqual(mg.participant_last_id(race_id), last_id)
+
+    def test_decode_csv(self):
+        # Utf-8 with byte order mark and cp1252 from Excel are accepted, other files raise UnicodeDecodeError.
+        self.assertEqual(mg.decode_csv("\ufeffJosé;1".encode("utf-8")), "José;1")
+        self.assertEqual(mg.decode_csv("José;1".encode("cp1252")), "José;1")
+        self.assertRaises(UnicodeDecodeError, mg.decode_csv, b"\x81;1")
+
     def test_participant_last_id(self):
         # Get the nid of the last person in the race.
         race_id = "332e1cce-e73e-4a87-bf78-acbdd05cbda3"
@@ -175,6 +217,25 @@ class TestModelGraph(unittest.TestCase):
         self.assertTrue(isinstance(person, list))
         self.assertTrue(isinstance(person[0], str))
         self.assertTrue(isinstance(person[1], str))
+        # Person list with number of races, sorted on number of races.
+        person_list = mg.person_list(nr_races=True)
+        self.assertEqual(len(person_list), 25)
+        nr_races = [person[2] for person in person_list]
+        self.assertEqual(nr_races, sorted(nr_races, reverse=True))
+        # Dirk Vermeylen participated in 3 races
+        person = [person for person in person_list if person[0] == "0857952c-6a80-438e-b9a0-b25825b70a64"][0]
+        self.assertEqual(person[2], 3)
+
+    def test_results4person_org(self):
+        # The overview in one query must give the same result as races4person_org for every person.
+        result4person = mg.results4person_org("Heren")
+        self.assertTrue(isinstance(result4person, dict))
+        for row in mg.results_for_category("Heren"):
+            races = mg.races4person_org(row[3])
+            self.assertEqual(sorted(result4person[row[3]].keys()), sorted(races.keys()))
+            for org_nid in races:
+                self.assertEqual(result4person[row[3]][org_nid]["race"]["name"], races[org_nid]["race"]["name"])
+                self.assertEqual(result4person[row[3]][org_nid]["part"].get("pos"), races[org_nid]["part"].get("pos"))
 
     def test_race_delete(self):
         # Try to delete a race with participants
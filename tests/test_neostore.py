@@ -5,7 +5,7 @@ This procedure will test the neostore functionality.
 import unittest
 import uuid
 
-from competition import create_app, neostore
+from competition import create_app, models_graph as mg, neostore
 from datetime import date
 
 # Import py2neo to test on class types
@@ -27,7 +27,7 @@ class TestNeoStore(unittest.TestCase):
         self.app = create_app('testing')
         self.app_ctx = self.app.app_context()
         self.app_ctx.push()
-        self.ns = neostore.NeoStore()
+        self.ns = mg.ns
         self.ns.init_graph()
 #       my_env.init_loghandler(__name__, "c:\\temp\\log", "warning")
 
@@ -70,6 +70,9 @@ class TestNeoStore(unittest.TestCase):
         self.assertTrue(isinstance(self.ns.date_node("1963-07-02"), Node))
         # Test date from invalid string is False
         self.assertFalse(isinstance(self.ns.date_node("OngeldigeDatum"), Node))
+        # Remove the first date, then clear all other dates
+        self.assertEqual(self.ns.remove_date(dsd), 3)
+        self.assertEqual(len(self.ns.get_nodes()), nr_nodes + 3)
         self.ns.clear_date()
         # Check number of nodes back to original number
         ds_nr_nodes = len(self.ns.get_nodes())
@@ -87,6 +90,18 @@ class TestNeoStore(unittest.TestCase):
         self.assertTrue(isinstance(part_node, bool))
         self.assertEqual(part_node, False)
 
+    def test_get_cat4race(self):
+        # Braderijloop Schoten - 10 km has 6 participants, each participant has a category.
+        race_id = "332e1cce-e73e-4a87-bf78-acbdd05cbda3"
+        cat4part = self.ns.get_cat4race(race_id)
+        self.assertEqual(len(cat4part), 6)
+        for part_nid in cat4part:
+            self.assertEqual(cat4part[part_nid]["cat"], self.ns.get_cat4part(part_nid))
+            self.assertTrue(isinstance(cat4part[part_nid]["pers_nid"], str))
+        # Race without participants
+        race_id = "a0d3ffb2-5fd3-42fb-909d-11f1c635fdc6"
+        self.assertEqual(self.ns.get_cat4race(race_id), {})
+
     def test_get_end_node(self):
         # Test if relation does not exist, do we have a valid end-node?
         # Valid organization, type Wedstrijd so nid is the return value, check for True
@@ -124,6 +139,25 @@ class TestNeoStore(unittest.TestCase):
         # Invalid start node needs to return False
         self.assertFalse(self.ns.get_end_nodes(start_node_id="Ongeldig", rel_type=rel_type))
 
+    def test_get_neighbour(self):
+        # Dirk Van Dijck participated in 4 races, return first participant node and number of participations.
+        node_id = "53db6b6c-45cc-4ed8-bb63-93ff40e5c101"
+        (part_id, cnt) = self.ns.get_neighbour(node_id, rel_type="is")
+        self.assertTrue(isinstance(part_id, str))
+        self.assertEqual(cnt, 4)
+        # Same relations in the other direction
+        (pers_id, cnt) = self.ns.get_neighbour(part_id, rel_type="is", direction="in")
+        self.assertEqual(pers_id, node_id)
+        self.assertEqual(cnt, 1)
+        # No relation of this type
+        self.assertEqual(self.ns.get_neighbour(node_id, rel_type="BestaatNiet"), (None, 0))
+        # Invalid anchor node
+        self.assertFalse(self.ns.get_neighbour("BestaatNiet", rel_type="is"))
+        # All neighbours
+        self.assertEqual(len(self.ns.get_neighbours(node_id, rel_type="is")), 4)
+        self.assertEqual(self.ns.get_neighbours(node_id, rel_type="BestaatNiet"), [])
+        self.assertFalse(self.ns.get_neighbours("BestaatNiet", rel_type="is"))
+
     def test_get_start_node(self):
         # Test for non-existing end node
         node_id = "BestaatNiet"
@@ -289,6 +323,24 @@ class TestNeoStore(unittest.TestCase):
         self.assertTrue(isinstance(self.ns.node(node_id), Node))
         self.assertFalse(self.ns.node("NodeIDDoesNotExist"))
 
+    def test_node_cache(self):
+        node_id = "ea83be48-fa39-4f6b-8f57-4952283997b7"
+        # No cache outside of a request, a fresh query every time.
+        self.assertIsNone(self.ns.node_cache())
+        self.ns.start_node_cache()
+        node = self.ns.node(node_id)
+        self.assertIs(self.ns.node(node_id), node)
+        # Non-existing nodes are not remembered
+        self.assertFalse(self.ns.node("NodeIDDoesNotExist"))
+        self.assertEqual(len(self.ns.node_cache()), 1)
+        # New nodes are in the cache, removed nodes are gone from the cache.
+        loc_node = self.ns.create_node("Location", city=str(uuid.uuid4()))
+        self.assertIs(self.ns.node(loc_node["nid"]), loc_node)
+        self.ns.remove_node(loc_node["nid"])
+        self.assertFalse(self.ns.node(loc_node["nid"]))
+        self.ns.stop_node_cache()
+        self.assertIsNone(self.ns.node_cache())
+
     def test_node_id(self):
         node_id = "ea83be48-fa39-4f6b-8f57-4952283997b7"
         self.assertFalse(self.ns.node_id(node_id))
@@ -297,15 +349,46 @@ class TestNeoStore(unittest.TestCase):
         # Function to test setting of nids on nodes.
         # Initially every node should have a nid.
         self.assertEqual(self.ns.get_nodes_no_nid(), 0)
-        # Then add date for new year
+        # Then add date for new year, the lookup does not create the date
         ds = "1987-10-03"
-        self.ns.date_node(ds)
-        # Check that date node with month has nid
+        self.assertFalse(self.ns.find_date_node(ds))
+        day = self.ns.date_node(ds)
+        # Check that date node with month has nid, the day node is cached
         props = dict(key="1987-10")
         node = self.ns.get_node(**props)
         self.assertTrue(isinstance(node["nid"], str))
+        self.assertEqual(self.ns.get_nodes_no_nid(), 0)
+        self.assertIs(self.ns.date_node(ds), day)
+        self.assertIs(self.ns.find_date_node(ds), day)
         # Remove date nodes
         self.ns.clear_date()
+        self.assertFalse(self.ns.find_date_node(ds))
+        # Nodes from a restore get a nid in batches.
+        for city in ["NoNid1", "NoNid2", "NoNid3"]:
+            self.ns.create_node_no_nid("Location", city=city)
+        self.assertEqual(self.ns.get_nodes_no_nid(batch=2), 3)
+        for city in ["NoNid1", "NoNid2", "NoNid3"]:
+            node = self.ns.get_node("Location", city=city)
+            self.assertTrue(isinstance(node["nid"], str))
+            self.ns.remove_node(node["nid"])
+
+    def test_remove_date_cache(self):
+        # A removed day leaves the date cache after the commit, a rollback leaves the cache as it is.
+        ds = "1899-01-02"
+        day = self.ns.date_node(ds)
+        self.assertIs(self.ns.date_cache[ds], day)
+        try:
+            with self.ns.transaction():
+                self.assertTrue(self.ns.remove_date(ds))
+                raise ValueError("Rollback")
+        except ValueError:
+            pass
+        self.assertIs(self.ns.date_cache[ds], day)
+        with self.ns.transaction():
+            self.assertTrue(self.ns.remove_date(ds))
+            self.assertIs(self.ns.date_cache[ds], day)
+        self.assertNotIn(ds, self.ns.date_cache)
+        self.assertFalse(self.ns.find_date_node(ds))
 
     def test_node_props(self):
         # This method will test node_props and node_update
@@ -337,6 +420,53 @@ class TestNeoStore(unittest.TestCase):
         self.assertFalse(self.ns.node_update(**my_props))
         self.assertFalse(self.ns.node_props("Ongeldig"))
 
+    def test_participants_set_attribs(self):
+        # Set points for all participants in a race in one go, then restore the original points.
+        race_id = "332e1cce-e73e-4a87-bf78-acbdd05cbda3"
+        node_list = self.ns.get_participant_seq_list(race_id)
+        orig_rows = [dict(nid=part["nid"], points=part["points"]) for part in node_list]
+        rows = [dict(nid=part["nid"], points=1) for part in node_list]
+        self.assertEqual(self.ns.participants_set_attribs(rows), 6)
+        for part in node_list:
+            self.assertEqual(self.ns.node_props(part["nid"])["points"], 1)
+        self.ns.participants_set_attribs(orig_rows)
+        self.assertEqual(self.ns.participants_set_attribs([]), 0)
+
+    def test_ping(self):
+        # Connection is made on first use, health check on a connected store.
+        self.assertTrue(self.ns.ping())
+        self.assertTrue(self.ns.ping())
+
+    def test_transaction(self):
+        # Nodes created in a transaction are visible in the transaction, and in the database after commit.
+        with self.ns.transaction():
+            node = self.ns.create_node("TestNode", name="Commit")
+            nid = node["nid"]
+            self.assertEqual(self.ns.node(nid)["name"], "Commit")
+        self.assertEqual(self.ns.node(nid)["name"], "Commit")
+        self.ns.remove_node_force(nid)
+        # Nodes created in a transaction that fails are not in the database.
+        try:
+            with self.ns.transaction():
+                node = self.ns.create_node("TestNode", name="Rollback")
+                nid = node["nid"]
+                raise ValueError("Rollback")
+        except ValueError:
+            pass
+        self.assertFalse(self.ns.node(nid))
+
+    def test_rank_participants(self):
+        # Ranking from the after chain must give the same sequence of arrival as the current rank.
+        race_id = "332e1cce-e73e-4a87-bf78-acbdd05cbda3"
+        seq_nids = [part["nid"] for part in self.ns.get_participant_seq_list(race_id)]
+        self.assertEqual(self.ns.rank_participants(race_id), 6)
+        ranks = self.ns.get_participant_ranks(race_id)
+        self.assertEqual([nid for (nid, rank) in ranks], seq_nids)
+        self.assertEqual([rank for (nid, rank) in ranks], [pos * neostore.rank_gap for pos in range(1, 7)])
+        # Race without participants
+        race_id = "a0d3ffb2-5fd3-42fb-909d-11f1c635fdc6"
+        self.assertEqual(self.ns.rank_participants(race_id), 0)
+
     def test_relations(self):
         # Try to remove node with relations. This will test the methods remove_node and relations.
         nid = "0857952c-6a80-438e-b9a0-b25825b70a64"
@@ -346,6 +476,47 @@ class TestNeoStore(unittest.TestCase):
         self.assertFalse(self.ns.remove_node(nid))
         self.assertFalse(self.ns.relations(nid))
 
+    def test_get_data_version(self):
+        # The data version includes the last committed transaction, reads do not change it.
+        version = self.ns.get_data_version()
+        self.assertNotEqual(version.split("-")[-1], "None")
+        self.ns.get_nodes("Person")
+        self.assertEqual(self.ns.get_data_version(), version)
+        node = self.ns.create_node("Location", city="DataVersion")
+        self.ns.remove_node(node["nid"])
+        self.assertNotEqual(self.ns.get_data_version(), version)
+
+    def test_restore(self):
+        # Nodes and relations from a dump are merged on nid, a batch that is restored again does not add nodes.
+        rows = [dict(nid=str(uuid.uuid4()), city="Restore{cnt}".format(cnt=cnt)) for cnt in range(3)]
+        self.assertEqual(self.ns.restore_nodes("Location", rows), 3)
+        self.assertEqual(self.ns.restore_nodes("Location", rows), 3)
+        self.assertEqual(len(self.ns.get_nodes("Location", city="Restore1")), 1)
+        rels = [dict(from_nid=rows[0]["nid"], to_nid=rows[1]["nid"])]
+        self.assertEqual(self.ns.restore_relations("after", rels), 1)
+        self.assertEqual(self.ns.get_end_node(start_node_id=rows[0]["nid"], rel_type="after"), rows[1]["nid"])
+        for row in rows:
+            self.assertTrue(self.ns.node(row["nid"]).has_label("Node"))
+            self.ns.remove_node_force(row["nid"])
+
+    def test_set_node_labels(self):
+        # A node from before the Node label is not found on nid, until it gets the label.
+        nid = str(uuid.uuid4())
+        self.ns.graph.run("CREATE (n:Location {city: 'NoNodeLabel', nid: $nid})", nid=nid)
+        self.assertFalse(self.ns.node(nid))
+        self.assertEqual(self.ns.set_node_labels(self.ns.graph), 1)
+        self.assertTrue(self.ns.node(nid).has_label("Node"))
+        self.assertEqual(self.ns.set_node_labels(self.ns.graph), 0)
+        self.ns.remove_node(nid)
+
+    def test_run(self):
+        # Run statements from the registry by name.
+        self.assertEqual(len(self.ns.run("organization_list").data()), 9)
+        res = self.ns.run("race_list", org_id="436de584-4a6a-4ff4-b37e-b34b9e1c4df5").data()
+        self.assertEqual(len(res), 2)
+        # Unknown statement
+        self.assertRaises(KeyError, lambda: self.ns.run("BestaatNiet"))
+
     def test_validate_node(self):
         # Validate Participant
         part_node = self.ns.get_participant_in_race(pers_id="0b306bd0-7c88-43b9-8657-a644486e377d",
@@ -68,3 +68,30 @@ class UserModelTestCase(unittest.TestCase):
         # You need to log in first, so check for log in message
         self.assertEqual(r.status_code, 200)
         self.assertTrue('Aankomsten' in r.get_data(as_text=True))
+
+    def test_health(self):
+        r = self.client.get('/health')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue('"ok"' in r.get_data(as_text=True))
+
+    def test_debug_queries(self):
+        # The query log is for a logged in user only.
+        r = self.client.get('/_debug/queries')
+        self.assertEqual(r.status_code, 302)
+        self.assertTrue('/login' in r.headers['Location'])
+
+    def test_not_modified(self):
+        # Read page is not built again for the same data version, a change or a login gives a new ETag.
+        r = self.client.get('/person/list')
+        self.assertEqual(r.status_code, 200)
+        etag = r.headers['ETag']
+        r = self.client.get('/person/list', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        node = mg.ns.create_node("Location", city="NotModified")
+        mg.ns.remove_node(node["nid"])
+        r = self.client.get('/person/list', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
+        etag = r.headers['ETag']
+        self.get_login()
+        r = self.client.get('/person/list', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
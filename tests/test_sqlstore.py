@@ -0,0 +1,66 @@
+"""
+This procedure will test the sqlite store. It runs the tests of the in-memory store on a sqlite store in a temporary
+file, and tests the domain queries that are implemented in SQL.
+"""
+
+import os
+import tempfile
+import unittest
+
+from competition import sqlstore
+from tests import test_memstore
+
+
+# @unittest.skip("Focus on Coverage")
+class TestSqlStore(test_memstore.TestMemStore):
+
+    def create_store(self):
+        (fd, self.dbfile) = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        return sqlstore.SqlStore(self.dbfile)
+
+    def tearDown(self):
+        # Windows does not remove a file with an open connection.
+        self.ns.close()
+        os.remove(self.dbfile)
+
+    def test_transaction_column(self):
+        # A property without column adds the column in the transaction, the transaction is not committed halfway.
+        try:
+            with self.ns.transaction():
+                self.ns.create_node("Person", name="Rollback")
+                self.ns.create_node("Location", country="BE")
+                raise ValueError("Rollback")
+        except ValueError:
+            pass
+        self.assertEqual(self.ns.get_nodes("Person", name="Rollback"), [])
+        self.assertEqual(self.ns.get_nodes("Location", country="BE"), [])
+        with self.ns.transaction():
+            self.ns.create_node("Location", country="NL")
+        self.assertEqual(len(self.ns.get_nodes("Location", country="NL")), 1)
+
+    def test_race4person(self):
+        # Link the organization to a date and a location, then find the race for the person.
+        org_nid = self.org["nid"]
+        self.ns.create_relation(from_node=self.org, rel="On", to_node=self.ns.date_node("2017-05-13"))
+        self.ns.create_relation(from_node=self.org, rel="In", to_node=self.ns.create_node("Location", city="Lier"))
+        pers_nid = self.ns.get_node("Person", name="Bert")["nid"]
+        races = self.ns.get_race4person(pers_nid)
+        self.assertEqual(len(races), 1)
+        self.assertEqual(races[0]["race"]["nid"], self.race["nid"])
+        self.assertEqual(races[0]["org"]["nid"], org_nid)
+        self.assertEqual(races[0]["part"]["nid"], self.parts[1]["nid"])
+
+    def test_points_per_category(self):
+        heren = self.ns.get_node("MF", name="Heren")
+        for name in ["Anna", "Bert"]:
+            self.ns.create_relation(from_node=self.ns.get_node("Person", name=name), rel="mf", to_node=heren)
+        self.ns.participants_set_attribs([dict(nid=part["nid"], points=10) for part in self.parts])
+        res = self.ns.points_per_category("Heren")
+        self.assertEqual(sorted(rec["name"] for rec in res), ["Anna", "Bert"])
+        self.assertEqual([rec["points"] for rec in res], [10, 10])
+        self.assertEqual(self.ns.points_per_category("Dames"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
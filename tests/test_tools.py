@@ -0,0 +1,52 @@
+"""
+This procedure will test the scripts in Tools on the in-memory store. The store is filled with the fixture of the
+in-memory store tests, no database or dump is required.
+"""
+
+import os
+import tempfile
+import unittest
+
+from competition import neostore
+from lib import datastore
+from tests import test_memstore
+from Tools import clear_dates, neo2sql, rank_participants
+
+
+# @unittest.skip("Focus on Coverage")
+class TestTools(test_memstore.MemStoreCase):
+
+    def test_rank_races(self):
+        # Every participant gets the rank from the after chain, a race without participants is skipped.
+        self.ns.create_node("Race", name="5 km")
+        self.assertEqual(rank_participants.rank_races(self.ns), 3)
+        ranks = dict(self.ns.get_participant_ranks(self.race["nid"]))
+        self.assertEqual([ranks[part["nid"]] for part in self.parts],
+                         [cnt * neostore.rank_gap for cnt in range(1, 4)])
+
+    def test_clear_dates(self):
+        # Dates that are not used are removed, the date of the organization remains.
+        self.ns.create_relation(from_node=self.org, rel="On", to_node=self.ns.date_node("2017-05-13"))
+        self.ns.date_node("2017-05-20")
+        self.ns.date_node("2016-05-20")
+        self.assertEqual(clear_dates.clear_dates(self.ns), dict(Day=2, Month=1, Year=1))
+        self.assertEqual(len(self.ns.get_nodes("Day")), 1)
+        self.assertEqual(clear_dates.clear_dates(self.ns), dict(Day=0, Month=0, Year=0))
+
+    def test_neo2sql(self):
+        # The dump has all nodes and relations, and is a single file in the default journal mode.
+        self.ns.create_node("Location", city="Lier")
+        dumpdir = tempfile.mkdtemp()
+        dumpfile = os.path.join(dumpdir, "dump.sqlite3")
+        self.assertEqual(neo2sql.dump(self.ns, dumpfile), (self.ns.node_count(), len(self.ns.mem.relations())))
+        self.assertEqual(os.listdir(dumpdir), ["dump.sqlite3"])
+        ds = datastore.DataStore(dumpfile)
+        self.assertEqual(ds.dbConn.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        self.assertEqual(ds.dbConn.execute("SELECT city FROM components WHERE city IS NOT NULL").fetchone()[0], "Lier")
+        ds.close_connection()
+        os.remove(dumpfile)
+        os.rmdir(dumpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()